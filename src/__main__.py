@@ -3,7 +3,80 @@ import sys
 
 from sourced.ml.cmd.args import add_repo2_args
 from sourced.ml.cmd import ArgumentDefaultsHelpFormatterNoNone
+from algorithms.path_contexts import TOKEN_EXTRACTORS
 from cmd.code2vec_extract_features import code2vec_extract_features
+from cmd.code2vec_extract_features_local import code2vec_extract_features_local
+from cmd.code2vec_index import code2vec_index
+from cmd.code2vec_serve import code2vec_serve
+from cmd.code2vec_train import code2vec_train
+from training.trainer import LABEL_PATTERN
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+def add_path_args(my_parser: argparse.ArgumentParser):
+    my_parser.add_argument('--max-length', type=int, default=5, help="Max path length.",
+                           required=False)
+    my_parser.add_argument('--max-width', type=int, default=2, help="Max path width.",
+                           required=False)
+    my_parser.add_argument('--max-leaves', type=int, default=None,
+                           help="Only extract the paths between the first leaves of every UAST.")
+    my_parser.add_argument('--max-contexts', type=int, default=None,
+                           help="Maximum number of paths per UAST, a uniform sample is kept if "
+                                "there are more.")
+    my_parser.add_argument('--time-budget', type=float, default=None,
+                           help="Seconds given to each step of the extraction of a UAST "
+                                "(flattening, path search, conversion), the remaining paths are "
+                                "skipped.")
+    my_parser.add_argument('--path-tokens', nargs="+", choices=sorted(TOKEN_EXTRACTORS),
+                           default=["internal_type"],
+                           help="Representations of the path nodes, all of them are extracted in "
+                                "the same pass and each path starts with the name of its "
+                                "representation if there are several.")
+
+
+def language_timeout(text: str):
+    """
+    Parses "<language>=<seconds>".
+    """
+    language, sep, seconds = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError("expected <language>=<seconds>, got %s" % text)
+    return language, float(seconds)
+
+
+def add_parse_args(my_parser: argparse.ArgumentParser):
+    my_parser.add_argument('--parse-workers', type=int, default=None,
+                           help="Parse the files with this number of concurrent requests to "
+                                "Babelfish per partition instead of one at a time by the "
+                                "engine.")
+    my_parser.add_argument('--parse-endpoint', default="localhost:9432",
+                           help="Babelfish server's address used by --parse-workers.")
+    my_parser.add_argument('--parse-in-flight', type=int, default=None,
+                           help="Maximum number of files read ahead of the parsing per "
+                                "partition, twice --parse-workers if unset.")
+    my_parser.add_argument('--parse-timeout', type=float, default=60,
+                           help="Seconds to parse a file.")
+    my_parser.add_argument('--parse-timeouts', type=language_timeout, nargs="+", default=[],
+                           metavar="LANGUAGE=SECONDS",
+                           help="Timeouts of specific languages, e.g. java=120.")
+    my_parser.add_argument('--parse-retries', type=int, default=2,
+                           help="Maximum number of retries of a file after a transient error.")
+    my_parser.add_argument('--parse-connections', type=int, default=1,
+                           help="Number of gRPC connections to Babelfish per partition.")
+
+
+def add_vocabulary_args(my_parser: argparse.ArgumentParser):
+    my_parser.add_argument('--min-count', type=int, default=1,
+                           help="Minimum frequency of the values and paths to keep.")
+    my_parser.add_argument('--max-vocab-size', type=int, default=None,
+                           help="Maximum number of values and of paths to keep, the most "
+                                "frequent ones are kept.")
+    my_parser.add_argument('--drop-oov', action="store_true",
+                           help="Drop the path contexts with pruned values or paths instead "
+                                "of mapping them to the OOV id.")
+    my_parser.add_argument('-o', '--output', type=str,
+                           help="Output path for the Code2VecFeatures model", required=True)
 
 
 def get_parser() -> argparse.ArgumentParser:
@@ -23,14 +96,189 @@ def get_parser() -> argparse.ArgumentParser:
     extract_parser.set_defaults(handler=code2vec_extract_features)
 
     add_repo2_args(extract_parser)
+    add_parse_args(extract_parser)
 
     # code2vec specific args
-    extract_parser.add_argument('--max-length', type=int, default=5, help="Max path length.",
-                                required=False)
-    extract_parser.add_argument('--max-width', type=int, default=2, help="Max path width.",
-                                required=False)
-    extract_parser.add_argument('-o', '--output', type=str,
-                                help="Output path for the Code2VecFeatures model", required=True)
+    add_path_args(extract_parser)
+    extract_parser.add_argument('--hash-paths', action="store_true",
+                                help="Emit integer hashes of the path contexts instead of their "
+                                     "string representation.")
+    add_vocabulary_args(extract_parser)
+    extract_parser.add_argument('--sharded', action="store_true",
+                                help="Treat --output as a directory and write the path contexts "
+                                     "of every partition to a separate shard next to a "
+                                     "vocabulary-only Code2VecFeatures model.")
+    extract_parser.add_argument('--cache', type=str, default=None,
+                                help="Path to the SQLite cache of the extracted path contexts "
+                                     "on the local filesystem of each executor. Disabled if "
+                                     "unset.")
+    extract_parser.add_argument('--cache-size', type=int, default=1024,
+                                help="Maximum size of the path contexts cache in MiB.")
+    extract_parser.add_argument('--zero-copy', action="store_true",
+                                help="Decode the serialized UASTs straight into the arrays used "
+                                     "by the path extraction instead of building bblfsh.Node "
+                                     "objects. Uses less memory and has no nesting limit, but "
+                                     "is slower than the C++ protobuf runtime.")
+    extract_parser.add_argument('--dedup', action="store_true",
+                                help="Extract the path contexts of identical functions only once "
+                                     "and record how many documents each kept one stands for.")
+    extract_parser.add_argument('--count-duplicates', action="store_true",
+                                help="With --dedup, the frequencies of the values and paths count "
+                                     "every duplicate instead of only one of them.")
+    extract_parser.add_argument('--balance', action="store_true",
+                                help="Redistribute the functions so that the partitions have "
+                                     "about the same estimated cost of path extraction instead "
+                                     "of the same number of functions.")
+    extract_parser.add_argument('--balance-partitions', type=int, default=None,
+                                help="With --balance, number of partitions, unchanged if unset.")
+    extract_parser.add_argument('--metrics', type=str, default=None,
+                                help="Path to the JSON file where to write the counters and "
+                                     "histograms of every stage.")
+
+    extract_local_parser = subparsers.add_parser(
+        "extract-local", help="Extract features from UASTs or source files without Spark",
+        formatter_class=ArgumentDefaultsHelpFormatterNoNone)
+
+    extract_local_parser.set_defaults(handler=code2vec_extract_features_local)
+
+    extract_local_parser.add_argument('-i', '--input', nargs="+", required=True,
+                                      help="Files and directories with serialized UASTs (*.uast) "
+                                           "or source files to parse with Babelfish. The "
+                                           "documents are named repository//path@blob like in "
+                                           "extract, the repository is the input directory.")
+    extract_local_parser.add_argument('--bblfsh', default="localhost:9432",
+                                      help="Babelfish server's address.")
+    extract_local_parser.add_argument('-x', '--mode', choices=("file", "func"), default="func",
+                                      help="What to select for analysis.")
+    extract_local_parser.add_argument('-j', '--processes', type=int, default=None,
+                                      help="Number of worker processes, all the CPUs if unset.")
+    extract_local_parser.add_argument('--chunk-size', type=int, default=16,
+                                      help="Number of files sent to a worker process at once.")
+    extract_local_parser.add_argument('--log-level', default="INFO", choices=LOG_LEVELS,
+                                      help="Logging verbosity.")
+    add_path_args(extract_local_parser)
+    add_vocabulary_args(extract_local_parser)
+
+    train_parser = subparsers.add_parser(
+        "train", help="Train the code2vec attention network on extracted path contexts",
+        formatter_class=ArgumentDefaultsHelpFormatterNoNone)
+
+    train_parser.set_defaults(handler=code2vec_train)
+
+    train_parser.add_argument('-i', '--input', required=True,
+                              help="Path to the Code2VecFeatures model or to the directory "
+                                   "written by extract --sharded.")
+    train_parser.add_argument('-o', '--output', required=True,
+                              help="Output path for the trained Code2Vec model.")
+    train_parser.add_argument('--label-pattern', default=LABEL_PATTERN,
+                              help="Regular expression which extracts the label from the "
+                                   "document name as its first group.")
+    train_parser.add_argument('--value-dim', type=int, default=128,
+                              help="Dimension of the value embeddings.")
+    train_parser.add_argument('--path-dim', type=int, default=128,
+                              help="Dimension of the path embeddings.")
+    train_parser.add_argument('--code-dim', type=int, default=None,
+                              help="Dimension of the code vectors, 2 * value dim + path dim if "
+                                   "unset.")
+    train_parser.add_argument('--batch-size', type=int, default=256,
+                              help="Number of documents per batch.")
+    train_parser.add_argument('--max-contexts', type=int, default=200,
+                              help="Maximum number of path contexts per document, the others "
+                                   "are subsampled in every epoch.")
+    train_parser.add_argument('--shuffle-buffer', type=int, default=None,
+                              help="Number of documents in the shuffle buffer, all of them if "
+                                   "unset. Bounds the memory used by the shuffling of shards.")
+    train_parser.add_argument('--loader-workers', type=int, default=2,
+                              help="Number of threads which prepare the batches.")
+    train_parser.add_argument('--prefetch', type=int, default=4,
+                              help="Number of windows of batches prepared in advance.")
+    train_parser.add_argument('--learning-rate', type=float, default=0.001,
+                              help="Learning rate of Adam.")
+    train_parser.add_argument('--epochs', type=int, default=10, help="Number of epochs.")
+    train_parser.add_argument('-j', '--threads', type=int, default=None,
+                              help="Number of threads, all the CPUs if unset. Set "
+                                   "OPENBLAS_NUM_THREADS=1 or the like to avoid "
+                                   "oversubscription.")
+    train_parser.add_argument('--seed', type=int, default=0,
+                              help="Seed of the initialization and of the shuffling.")
+    train_parser.add_argument('--checkpoint-dir', default=None,
+                              help="Directory where to save the checkpoints. Disabled if unset.")
+    train_parser.add_argument('--checkpoint-every', type=int, default=1,
+                              help="Number of epochs between the checkpoints.")
+    train_parser.add_argument('--resume', action="store_true",
+                              help="Resume from the latest checkpoint in --checkpoint-dir.")
+    train_parser.add_argument('--log-level', default="INFO", choices=LOG_LEVELS,
+                              help="Logging verbosity.")
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Serve the code vectors of UASTs and source code over HTTP or stdin",
+        formatter_class=ArgumentDefaultsHelpFormatterNoNone)
+
+    serve_parser.set_defaults(handler=code2vec_serve)
+
+    serve_parser.add_argument('-m', '--model', required=True,
+                              help="Path to the trained Code2Vec model.")
+    serve_parser.add_argument('-f', '--features', required=True,
+                              help="Path to the Code2VecFeatures model or to the directory "
+                                   "written by extract --sharded which the model was trained "
+                                   "on, only the vocabularies are loaded.")
+    serve_parser.add_argument('--host', default="localhost", help="Address to listen on.")
+    serve_parser.add_argument('--port', type=int, default=8080, help="Port to listen on.")
+    serve_parser.add_argument('--stdin', action="store_true",
+                              help="Read JSON requests from stdin, one per line, and write the "
+                                   "responses to stdout instead of listening on HTTP.")
+    serve_parser.add_argument('--workers', type=int, default=8,
+                              help="With --stdin, number of requests processed concurrently.")
+    serve_parser.add_argument('--max-batch', type=int, default=32,
+                              help="Maximum number of requests whose code vectors are computed "
+                                   "together.")
+    serve_parser.add_argument('--max-delay', type=float, default=2,
+                              help="Milliseconds to wait for more requests to batch after the "
+                                   "first one.")
+    serve_parser.add_argument('--max-model-contexts', type=int, default=200,
+                              help="Maximum number of path contexts fed to the network per "
+                                   "UAST, like train --max-contexts.")
+    serve_parser.add_argument('--bblfsh', default="localhost:9432",
+                              help="Babelfish server's address to parse the source code.")
+    serve_parser.add_argument('--log-level', default="INFO", choices=LOG_LEVELS,
+                              help="Logging verbosity.")
+    # the path contexts must be extracted like the ones of the training features
+    add_path_args(serve_parser)
+
+    index_parser = subparsers.add_parser(
+        "index", help="Build a nearest neighbour index of the code vectors of the documents or "
+                      "of the path or value embeddings",
+        formatter_class=ArgumentDefaultsHelpFormatterNoNone)
+
+    index_parser.set_defaults(handler=code2vec_index)
+
+    index_parser.add_argument('-m', '--model', required=True,
+                              help="Path to the trained Code2Vec model.")
+    index_parser.add_argument('-i', '--input', required=True,
+                              help="Path to the Code2VecFeatures model or to the directory "
+                                   "written by extract --sharded with the documents and the "
+                                   "vocabularies of the model.")
+    index_parser.add_argument('-o', '--output', default=None,
+                              help="Output directory of the index, <model>.<kind>.index next "
+                                   "to the model if unset.")
+    index_parser.add_argument('--kind', choices=("docs", "paths", "values"), default="docs",
+                              help="What to index.")
+    index_parser.add_argument('--lists', type=int, default=None,
+                              help="Number of IVF lists, 0 for exact search only. 4 * sqrt(n) "
+                                   "if unset, or 0 below 10000 vectors.")
+    index_parser.add_argument('--sample', type=int, default=256,
+                              help="Number of vectors per list used to train the centroids.")
+    index_parser.add_argument('--iterations', type=int, default=20,
+                              help="Number of k-means iterations.")
+    index_parser.add_argument('--batch-size', type=int, default=256,
+                              help="Number of documents per batch of code vectors.")
+    index_parser.add_argument('--max-contexts', type=int, default=200,
+                              help="Maximum number of path contexts per document, like train "
+                                   "--max-contexts.")
+    index_parser.add_argument('--seed', type=int, default=0,
+                              help="Seed of the sampling of the path contexts and of k-means.")
+    index_parser.add_argument('--log-level', default="INFO", choices=LOG_LEVELS,
+                              help="Logging verbosity.")
     return parser
 
 
@@ -38,6 +286,8 @@ def main():
     parser = get_parser()
 
     args = parser.parse_args()
+    if getattr(args, "count_duplicates", False) and not args.dedup:
+        parser.error("--count-duplicates requires --dedup")
 
     try:
         handler = args.handler
@@ -1,6 +1,14 @@
-from algorithms.structures.extended_node import ExtNode
+import random
+import sys
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Sequence
+
+from algorithms.structures.flat_tree import FlatTree
 
 import bblfsh
+import numpy as np
 
 UP = "UP"
 DOWN = "DOWN"
@@ -17,105 +25,123 @@ def node_to_internal_type(node: bblfsh.Node):
     return node.internal_type
 
 
-def node_to_roles(node: bblfsh.Node):
+def node_to_token(node: bblfsh.Node):
     """
-    Converte bblfsh roles of a node to a unique string representation
+    Use the token property of a node as its representation as start/end of a path
     :param node: base_node
-    :return: node's roles or the string's hash (in case its UP/DOWN token or a leaf)
+    :return: node's token
     """
-    return " | ".join(bblfsh.role_name(r) for r in sorted(node.roles))
+    return node.token
+
 
+@lru_cache(maxsize=1 << 16)
+def _roles_name(roles: tuple) -> str:
+    return sys.intern(" | ".join(bblfsh.role_name(r) for r in roles))
 
-def lca(u: ExtNode, v: ExtNode):
+
+def node_to_roles(node: bblfsh.Node):
     """
-    Computes least common ancestor of 2 nodes using log_parents and depth
-    :param u: origin node
-    :param v: destiny node
-    :return: least commo ancestor
+    Converte bblfsh roles of a node to a unique string representation, the strings are interned
+    and shared by all the nodes with the same roles
+    :param node: base_node
+    :return: node's roles or the string itself (in case its UP/DOWN token)
     """
-    if u.depth < v.depth:
-        u, v = v, u
+    if type(node) == str:
+        return node
+    return _roles_name(tuple(sorted(node.roles)))
 
-    for i in range(len(u.log_parents), -1, -1):
-        if len(u.log_parents) > i and u.log_parents[i].depth >= v.depth:
-            u = u.log_parents[i]
 
-    if u == v:
-        return u
+# representations of the path nodes which can be selected by name
+TOKEN_EXTRACTORS = {"internal_type": node_to_internal_type, "roles": node_to_roles}
 
-    for i in range(len(u.log_parents), -1, -1):
-        if u == v:
-            break
-        if len(u.log_parents) > i and len(v.log_parents) > i and u.log_parents[i] != v.log_parents[
-            i]:
-            u = u.log_parents[i]
-            v = v.log_parents[i]
 
-    return v.log_parents[0]
+# dirty hardcoding to avoid getting paths with comments as start/end
+NOOP_TYPES = ('NoopLine', 'SameLineNoops')
 
 
-def distance(u: ExtNode, v: ExtNode, ancestor: ExtNode):
+def count_candidate_pairs(n_leaves: int, max_width: int) -> int:
     """
-    Computes distance of the path from u to v using the lca node as:
-        d(u,v) = d(root, u) + d(root, v) - 2 * d(root, lca)
-    :param u:
-    :param v:
-    :param ancestor:
-    :return:
+    Number of pairs of leaves inside the max_width window, i.e. the pairs checked by get_pairs()
+    before skipping the comments and applying max_length.
     """
-    dru = u.depth
-    drv = v.depth
-    drlca = ancestor.depth
-
-    return dru + drv - 2 * drlca
+    m = min(max_width - 1, n_leaves - 1)
+    if m < 1:
+        return 0
+    return m * n_leaves - m * (m + 1) // 2
 
 
-def get_path(u: ExtNode, v: ExtNode, ancestor: ExtNode, leaf_token,
-             up_symbol=UP, down_symbol=DOWN):
+def get_pairs(tree: FlatTree, max_length: int, max_width: int, batch_size: int=1 << 16,
+              max_leaves: int=None):
     """
-    Returns the path from u to v separated by up an down symbols.
-    The path is formed by the original base nodes.
-    :param u: start node
-    :param v: end node
-    :param ancestor: least common ancestor of u and v
-    :param leaf_token: how to get leaf token out of start/end nodes
-    :param up_symbol: symbol indicating next token is parent of the previous
-    :param down_symbol: symbol indicating next token is a child of the previous
-    :return:
+    Finds all the pairs of leaves inside the max_width window whose path is not longer than
+    max_length. LCA and distances are computed in batches over the binary-lifting table.
+    :param tree: flattened UAST
+    :param max_length:
+    :param max_width:
+    :param batch_size: approximate number of pairs processed at once
+    :param max_leaves: only pair the first max_leaves leaves
+    :return: generator of (u, v, ancestor) node indices in the same order as the leaves
     """
-    path = []
-
-    start, end = leaf_token(u), leaf_token(v)
-
-    while u != ancestor:
-        path.append(u.bn)
-        path.append(up_symbol)
-        u = u.log_parents[0]
-
-    path.append(ancestor.bn)
-
-    aux_path = []
-
-    while v != ancestor:
-        aux_path.append(v.bn)
-        aux_path.append(down_symbol)
-        v = v.log_parents[0]
-
-    path = path + aux_path[::-1]
-
-    return start, tuple(path), end
-
-
-# dirty hardcoding to avoid getting paths with comments as start/end
-def is_noop_line(node):
-    return node.bn.internal_type == 'NoopLine' or node.bn.internal_type == 'SameLineNoops'
+    leaves = tree.leaves[:max_leaves]
+    n_leaves, width = len(leaves), max_width - 1
+    if n_leaves < 2 or width < 1:
+        return
+
+    # TODO decide where to filter comments and maybe decouple from bblfsh
+    noop = np.isin(tree.type_ids[leaves], [tree.type_id(t) for t in NOOP_TYPES])
+    offsets = np.arange(1, width + 1)
+    rows = max(1, batch_size // width)
+
+    for start in range(0, n_leaves - 1, rows):
+        i = np.arange(start, min(start + rows, n_leaves - 1))[:, None]
+        j = i + offsets[None, :]
+        i, j = np.broadcast_to(i, j.shape)[j < n_leaves], j[j < n_leaves]
+        keep = ~(noop[i] | noop[j])
+        u, v = leaves[i[keep]], leaves[j[keep]]
+        ancestor = tree.lca_batch(u, v)
+        keep = tree.depth[u] + tree.depth[v] - 2 * tree.depth[ancestor] <= max_length
+        yield from zip(u[keep].tolist(), v[keep].tolist(), ancestor[keep].tolist())
+
+
+def sample_pairs(pairs, max_contexts: int=None, deadline: float=None, seed: int=0,
+                 check_every: int=1024):
+    """
+    Reservoir sampling of at most max_contexts pairs (algorithm R), the pairs are consumed until
+    the deadline at most.
+    :param pairs: iterable of (u, v, ancestor), see get_pairs()
+    :param max_contexts: size of the sample, all the pairs are kept if None
+    :param deadline: time.perf_counter() value after which the remaining pairs are ignored
+    :param seed: seed of the random generator, the same pairs give the same sample
+    :param check_every: number of pairs consumed between two checks of the deadline
+    :return: list of the sampled pairs in their original order, number of pairs consumed and \
+             whether the deadline was reached
+    """
+    rnd = random.Random(seed)
+    sample, positions = [], []
+    seen, timed_out = 0, False
+    for pair in pairs:
+        if max_contexts is None or seen < max_contexts:
+            sample.append(pair)
+            positions.append(seen)
+        else:
+            i = rnd.randrange(seen + 1)
+            if i < max_contexts:
+                sample[i] = pair
+                positions[i] = seen
+        seen += 1
+        if deadline is not None and seen % check_every == 0 and time.perf_counter() > deadline:
+            timed_out = True
+            break
+    if max_contexts is not None and seen > max_contexts:
+        sample = [sample[i] for i in np.argsort(positions)]
+    return sample, seen, timed_out
 
 
 def get_paths(uast: bblfsh.Node, max_length: int, max_width: int,
-              token_extractor=node_to_internal_type, leaf_token=lambda node: node.bn.token):
+              token_extractor=node_to_internal_type, leaf_token=node_to_token):
     """
     Creates a list of all the paths given the max_length and max_width restrictions.
-    :param uast_file: file containing a bblfsh UAST as string and binary-coded
+    :param uast: bblfsh UAST root node
     :param max_length:
     :param max_width:
     :param token_extractor: function to transform a node into a single string token
@@ -124,22 +150,126 @@ def get_paths(uast: bblfsh.Node, max_length: int, max_width: int,
      ending leaf, and path is the list of nodes in their minimal distance path.
     """
 
-    tree, leaves = ExtNode.extend_tree(uast)
+    tree = FlatTree.from_uast(uast)
+    return to_path_contexts(tree, get_pairs(tree, max_length, max_width), token_extractor,
+                            leaf_token)
+
+
+def to_path_contexts(tree: FlatTree, pairs, token_extractor=node_to_internal_type,
+                     leaf_token=node_to_token):
+    """
+    Converts pairs of leaves to path contexts.
+    :param tree: flattened UAST
+    :param pairs: iterable of (u, v, ancestor) node indices, see get_pairs()
+    :param token_extractor: function to transform a node into a single string token
+    :param leaf_token: get leaves token as a different node
+    :return: list(tuple) list of paths context like (u, path, v)
+    """
+    return to_path_contexts_multi(tree, pairs, (token_extractor,), leaf_token)[0]
+
 
-    paths = []
-    if len(leaves) < 2:
-        return []
+def _node_memo(tree: FlatTree, token_extractor) -> list:
+    """
+    :return: list with the representation of every node of the tree, or None if it has not \
+             been computed yet
+    """
+    if token_extractor is node_to_internal_type:
+        types = tree.types
+        return [types[i] for i in tree.type_ids.tolist()]
+    return [None] * len(tree)
+
+
+def _interleave(tokens: list, separator: str) -> tuple:
+    """
+    :return: (tokens[0], separator, tokens[1], separator, ..., tokens[-1])
+    """
+    result = [separator] * (2 * len(tokens) - 1)
+    result[::2] = tokens
+    return tuple(result)
 
-    for i in range(len(leaves)):
-        for j in range(i + 1, min(i + max_width, len(leaves))):
-            u, v = leaves[i], leaves[j]
-            # TODO decide where to filter comments and maybe decouple from bblfsh
-            if not is_noop_line(u) and not is_noop_line(v):
-                ancestor = lca(u, v)
-                d = distance(u, v, ancestor)
-                if d <= max_length:
-                    u, path, v = get_path(u, v, ancestor, leaf_token=leaf_token)
-                    # convert nodes to its desired representation
-                    paths.append((u, tuple([token_extractor(p) for p in path]), v))
 
-    return paths
+def to_path_contexts_multi(tree: FlatTree, pairs, token_extractors: Sequence,
+                           leaf_token=node_to_token, deadline: float=None,
+                           check_every: int=1024):
+    """
+    Converts pairs of leaves to path contexts with several representations of the path nodes,
+    e.g. internal types and roles, in a single pass: every node is converted at most once per
+    representation.
+
+    Neighbouring pairs share most of their paths, so the ancestor chain of every leaf is walked
+    once and turned into two token segments per representation:
+        up: (leaf, UP, parent, UP, grandparent, ...)
+        down: (..., grandparent, DOWN, parent, DOWN, leaf)
+    The path of (u, v) is the prefix of the up segment of u until the ancestor followed by the
+    suffix of the down segment of v after it, i.e. two slices and one concatenation per path.
+    :param tree: flattened UAST
+    :param pairs: iterable of (u, v, ancestor) node indices, see get_pairs()
+    :param token_extractors: functions to transform a node into a single string token
+    :param leaf_token: get leaves token as a different node
+    :param deadline: time.perf_counter() value after which the remaining pairs are ignored, \
+                     the path contexts are then fewer than the pairs
+    :param check_every: number of pairs converted between two checks of the deadline
+    :return: list with the path contexts (u, path, v) of each token extractor
+    """
+    nodes, parents, depth = tree.nodes, tree.parents.tolist(), tree.depth.tolist()
+    kinds = [(token_extractor, _node_memo(tree, token_extractor), token_extractor(UP),
+              token_extractor(DOWN)) for token_extractor in token_extractors]
+    # decoded trees have the tokens in a column
+    leaf_tokens = tree.tokens if leaf_token is node_to_token else None
+    results = [[] for _ in kinds]
+    # leaf -> (number of ancestors in the segments, leaf token, [(up, down) per kind]), the
+    # leaves before the current start of the window are evicted in order of insertion
+    leaves = {}
+    inserted = deque()
+    position = np.zeros(len(tree), dtype=np.int64)
+    position[tree.leaves] = np.arange(len(tree.leaves))
+    position = position.tolist()
+
+    def segments(leaf: int, levels: int):
+        levels = min(levels, depth[leaf])
+        entry = leaves.get(leaf)
+        if entry is not None:
+            if entry[0] >= levels:
+                return entry
+            # grow geometrically so that each leaf is walked a few times at most
+            levels = min(max(levels, 2 * entry[0]), depth[leaf])
+        else:
+            inserted.append(leaf)
+        chain = [leaf]
+        node = leaf
+        for _ in range(levels):
+            node = parents[node]
+            chain.append(node)
+        kind_segments = []
+        for token_extractor, memo, up_token, down_token in kinds:
+            tokens = []
+            for node in chain:
+                token = memo[node]
+                if token is None:
+                    token = memo[node] = token_extractor(nodes[node])
+                tokens.append(token)
+            kind_segments.append((_interleave(tokens, up_token),
+                                  _interleave(tokens[::-1], down_token)))
+        if entry is not None:
+            token = entry[1]
+        else:
+            token = leaf_tokens[leaf] if leaf_tokens is not None else leaf_token(nodes[leaf])
+        entry = leaves[leaf] = (levels, token, kind_segments)
+        return entry
+
+    window_start = -1
+    for converted, (u, v, ancestor) in enumerate(pairs, 1):
+        if position[u] != window_start:
+            window_start = position[u]
+            while inserted and position[inserted[0]] < window_start:
+                del leaves[inserted.popleft()]
+        ups, downs = depth[u] - depth[ancestor], depth[v] - depth[ancestor]
+        _, start, u_segments = segments(u, max(ups, 4))
+        _, end, v_segments = segments(v, max(downs, 4))
+        for paths, (up, _), (_, down) in zip(results, u_segments, v_segments):
+            paths.append((start, up[:2 * ups + 1] + down[len(down) - 2 * downs:], end))
+        if deadline is not None and converted % check_every == 0 and \
+                time.perf_counter() > deadline:
+            break
+
+    return results
@@ -9,10 +9,11 @@ class ExtNode(object):
     """
     Extended Node used for efficiently extract paths from a tree structure
 
-    bn, depth, numeration: are initialized during tree top-down traversal
-    children: during the recursive return call
+    bn, depth, numeration, children: are initialized during tree top-down traversal
     log_parents: annotated in a separate traversal
 
+    All the traversals use an explicit stack, so deep trees do not hit the recursion limit.
+
     """
 
     def __init__(self, base_node: bblfsh.Node, depth: int, numeration: int=-1, children=(),
@@ -54,19 +55,20 @@ class ExtNode(object):
         :param leaves: list of seen leaves
         :return: current node as ExtNode and 'num'
         """
-        if len(node.children) == 0:
-            ext_node = ExtNode(node, depth, num)
-            leaves.append(ext_node)
-            return ext_node, num + 1
-        else:
-            ext_node = ExtNode(node, depth, -1)
-            new_children = [None] * len(node.children)
-            for i, child in enumerate(node.children):
-                new_children[i], num = ExtNode.extend_node(child, depth + 1, num, leaves)
-
-            ext_node.children = new_children
-
-            return ext_node, num
+        ext_node = ExtNode(node, depth, -1)
+        stack = [ext_node]
+        while stack:
+            current = stack.pop()
+            children = current.bn.children
+            if len(children) == 0:
+                current.numeration = num
+                leaves.append(current)
+                num += 1
+            else:
+                current.children = [ExtNode(child, current.depth + 1, -1) for child in children]
+                stack.extend(reversed(current.children))
+
+        return ext_node, num
 
     def annotate_log_parents(self, parents: List):
         """
@@ -74,14 +76,23 @@ class ExtNode(object):
         :param self: current node to annotate
         :param parents: list of current node's parents until the root
         """
-        if len(parents) > 0:
-            self.log_parents = [parents[i] for i in
-                                [(2 ** i) - 1 for i in range(0, len(parents)) if
-                                 2 ** i < len(parents)]]
-        for i, child in enumerate(self.children):
-            child.annotate_log_parents([self] + parents)
-
-    def _as_dict(self) -> OrderedDict:
+        # ancestors[::-1] are the parents of the node being visited
+        ancestors = list(reversed(parents))
+        base = len(ancestors)
+        stack = [(self, 0)]
+        while stack:
+            node, level = stack.pop()
+            del ancestors[base + level:]
+            if len(ancestors) > 0:
+                node.log_parents = []
+                step = 1
+                while step < len(ancestors):
+                    node.log_parents.append(ancestors[-step])
+                    step *= 2
+            ancestors.append(node)
+            stack.extend((child, level + 1) for child in reversed(node.children))
+
+    def _node_dict(self) -> OrderedDict:
         # custom base representation depending on the base node
         base_repr = [('token', 'N/A')]
         if isinstance(type(self.bn), bblfsh.Node.__class__):
@@ -89,13 +100,23 @@ class ExtNode(object):
 
         ext_repr = [("depth", self.depth), ("numeration", self.numeration)]
         if len(self.children) > 0:
-            # if node has children
-            children = [n._as_dict() for n in self.children]
-            ext_repr = [("depth", self.depth), ("numeration", self.numeration),
-                        ("children", children)]
+            # if node has children, they are filled in by _as_dict
+            ext_repr.append(("children", []))
 
         return OrderedDict(base_repr + ext_repr)
 
+    def _as_dict(self) -> OrderedDict:
+        root = self._node_dict()
+        stack = [(self, root)]
+        while stack:
+            node, node_dict = stack.pop()
+            for child in node.children:
+                child_dict = child._node_dict()
+                node_dict["children"].append(child_dict)
+                stack.append((child, child_dict))
+
+        return root
+
     @staticmethod
     def extend_tree(root: bblfsh.Node) -> Tuple:
         """
@@ -112,12 +133,54 @@ class ExtNode(object):
 
         return ext_tree, leaves
 
-    def to_json(self) -> str:
-        """ Return a JSON representation of this node and all children. """
-        return json.dumps(self._as_dict(), indent=4, separators=(',', ': '))
+    def to_json(self, indent: int=4) -> str:
+        """
+        Return a JSON representation of this node and all children. The output is the same as
+        json.dumps(self._as_dict(), indent=indent) but it is written with an explicit stack,
+        because json.dumps() recurses into the nested children.
+        :param indent: number of spaces per level, or None to write everything on one line: \
+                       the size of the indented JSON grows with the square of the depth
+        """
+        parts = []
+        if indent is None:
+            newline, spaces, separator = "", "", ", "
+        else:
+            newline, spaces, separator = "\n", " " * indent, ","
+        # nodes with their indentation level and the text after their closing brace, or texts
+        stack = [(self, 0, "")]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                parts.append(item)
+                continue
+            node, level, suffix = item
+            outer, inner = newline + spaces * level, newline + spaces * (level + 1)
+            fields = node._node_dict()
+            has_children = fields.pop("children", None) is not None
+            parts.append("{")
+            for i, (key, value) in enumerate(fields.items()):
+                value = json.dumps(value, indent=indent, separators=(separator, ": "))
+                parts.append("%s%s: %s" % (inner, json.dumps(key),
+                                           value.replace("\n", inner)))
+                if has_children or i < len(fields) - 1:
+                    parts.append(separator)
+            if not has_children:
+                parts.append(outer + "}" + suffix)
+                continue
+            parts.append(inner + '"children": [')
+            stack.append(outer + "}" + suffix)
+            stack.append(inner + "]")
+            last = len(node.children) - 1
+            for i, child in reversed(list(enumerate(node.children))):
+                stack.append((child, level + 2, separator if i < last else ""))
+                stack.append(newline + spaces * (level + 2))
+        return "".join(parts)
 
     def __repr__(self) -> str:
-        return self.to_json()
+        # only the fields of the node, the whole tree can be too large and too deep to print
+        fields = self._node_dict()
+        fields["children"] = len(self.children)
+        return "ExtNode(%s)" % ", ".join("%s=%r" % field for field in fields.items())
 
     def __str__(self) -> str:
         return self.to_json()
@@ -0,0 +1,413 @@
+import sys
+import time
+from array import array
+from typing import List, Sequence
+
+import bblfsh
+import numpy as np
+
+# field numbers of the serialized bblfsh UAST Node (sdk v1)
+NODE_INTERNAL_TYPE = 1
+NODE_CHILDREN = 3
+NODE_TOKEN = 4
+NODE_ROLES = 7
+# keys of the length-delimited fields, i.e. field number << 3 | wire type 2
+_INTERNAL_TYPE_KEY = NODE_INTERNAL_TYPE << 3 | 2
+_CHILDREN_KEY = NODE_CHILDREN << 3 | 2
+_TOKEN_KEY = NODE_TOKEN << 3 | 2
+_ROLES_KEY = NODE_ROLES << 3 | 2
+
+
+def _read_varint(data: bytes, pos: int):
+    """
+    :return: value of the protobuf varint at pos and the position after it
+    """
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+class FlatNode(object):
+    """
+    Read-only view of a node of a FlatTree built from a serialized UAST, with the attributes of
+    bblfsh.Node used by the path extraction.
+    """
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree: "FlatTree", index: int):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def internal_type(self) -> str:
+        return self.tree.types[self.tree.type_ids[self.index]]
+
+    @property
+    def token(self) -> str:
+        return self.tree.tokens[self.index]
+
+    @property
+    def roles(self) -> List[int]:
+        offsets = self.tree.role_offsets
+        return self.tree.roles[offsets[self.index]:offsets[self.index + 1]].tolist()
+
+    @property
+    def children(self) -> List["FlatNode"]:
+        children = np.flatnonzero(self.tree.parents == self.index)
+        return [FlatNode(self.tree, int(i)) for i in children if i != self.index]
+
+
+class FlatNodes(Sequence):
+    """
+    Sequence of the nodes of a FlatTree built from a serialized UAST, the views are created on
+    access.
+    """
+
+    def __init__(self, tree: "FlatTree"):
+        self._tree = tree
+
+    def __getitem__(self, index: int) -> FlatNode:
+        if not -len(self) <= index < len(self):
+            raise IndexError("node index out of range")
+        return FlatNode(self._tree, index % len(self))
+
+    def __len__(self) -> int:
+        return len(self._tree.parents)
+
+
+class FlatTree(object):
+    """
+    Array-backed tree used for efficiently extract paths from a tree structure
+
+    Nodes are numbered in pre-order (the root is 0) and every per-node attribute is stored in a
+    NumPy array indexed by that number, so no object is allocated per node.
+
+    nodes: original tree nodes, or FlatNode views if the tree was decoded with from_bytes()
+    parents: index of the parent of each node (the root is its own parent)
+    depth: depth of each node in the tree (0-based)
+    leaves: indices of the leaves from left to right
+    type_ids: id of the internal_type of each node, see 'types'
+    types: list of the distinct internal_types in order of appearance, interned
+    log_parents: binary-lifting table where log_parents[k][n] is the 2^k-th ancestor of n
+    tokens: token of each node, only if the tree was decoded with from_bytes()
+    roles, role_offsets: roles of each node in CSR form, the roles of the n-th node are
+                         roles[role_offsets[n]:role_offsets[n + 1]], only if the tree was
+                         decoded with from_bytes()
+    """
+
+    def __init__(self, nodes: List, parents: np.ndarray, depth: np.ndarray,
+                 leaves: np.ndarray, type_ids: np.ndarray, types: List[str],
+                 tokens: List[str]=None, roles: np.ndarray=None, role_offsets: np.ndarray=None):
+        """
+        :param nodes: original tree nodes in pre-order, None to use FlatNode views
+        :param parents: index of the parent of each node (the root is its own parent)
+        :param depth: depth of each node in the tree
+        :param leaves: indices of the leaves from left to right
+        :param type_ids: id of the internal_type of each node
+        :param types: internal_type of each id
+        :param tokens: token of each node
+        :param roles: roles of all the nodes in pre-order
+        :param role_offsets: offsets of the roles of each node
+        """
+        self.nodes = nodes if nodes is not None else FlatNodes(self)
+        self.parents = parents
+        self.depth = depth
+        self.leaves = leaves
+        self.type_ids = type_ids
+        self.types = types
+        self.tokens = tokens
+        self.roles = roles
+        self.role_offsets = role_offsets
+        self.log_parents = self._build_log_parents(parents, depth)
+
+    @staticmethod
+    def _build_log_parents(parents: np.ndarray, depth: np.ndarray) -> np.ndarray:
+        """
+        Builds the binary-lifting ancestor table. Since nodes are numbered in pre-order every
+        level of the table can be computed from the previous one with a single gather.
+        :param parents: index of the parent of each node
+        :param depth: depth of each node in the tree
+        :return: array of shape (levels, number of nodes)
+        """
+        max_depth = int(depth.max()) if len(depth) > 0 else 0
+        levels = max(1, max_depth.bit_length())
+        log_parents = np.empty((levels, len(parents)), dtype=np.int32)
+        log_parents[0] = parents
+        for k in range(1, levels):
+            log_parents[k] = log_parents[k - 1][log_parents[k - 1]]
+        return log_parents
+
+    @staticmethod
+    def from_uast(root: bblfsh.Node, deadline: float=None, check_every: int=4096,
+                  max_leaves: int=None) -> "FlatTree":
+        """
+        Flattens a tree of nodes in a single iterative pre-order traversal.
+        :param root: root of the tree to flatten
+        :param deadline: time.perf_counter() value after which TimeoutError is raised
+        :param check_every: number of nodes flattened between two checks of the deadline
+        :param max_leaves: only the nodes up to the max_leaves-th leaf in pre-order are kept, \
+                           i.e. the first leaves and their ancestors
+        :return: FlatTree
+        """
+        nodes = []
+        parents = array("i")
+        depth = array("i")
+        leaves = array("i")
+        type_ids = array("i")
+        type2id = {}
+
+        stack = [(root, 0, 0)]
+        while stack:
+            node, parent, node_depth = stack.pop()
+            index = len(nodes)
+            if deadline is not None and index % check_every == 0 and \
+                    time.perf_counter() > deadline:
+                raise TimeoutError("Flattened %d nodes before the deadline" % index)
+            nodes.append(node)
+            parents.append(parent)
+            depth.append(node_depth)
+            type_ids.append(type2id.setdefault(node.internal_type, len(type2id)))
+            children = node.children
+            if len(children) == 0:
+                leaves.append(index)
+                if max_leaves is not None and len(leaves) >= max_leaves:
+                    break
+            else:
+                stack.extend((child, index, node_depth + 1) for child in reversed(children))
+
+        return FlatTree(nodes,
+                        np.frombuffer(parents, dtype=np.int32),
+                        np.frombuffer(depth, dtype=np.int32),
+                        np.frombuffer(leaves, dtype=np.int32),
+                        np.frombuffer(type_ids, dtype=np.int32),
+                        [sys.intern(t) for t in type2id])
+
+    @staticmethod
+    def from_bytes(data: bytes, deadline: float=None, check_every: int=4096,
+                   max_leaves: int=None) -> "FlatTree":
+        """
+        Decodes a serialized UAST (bblfsh.Node.SerializeToString()) straight into the arrays,
+        without building the bblfsh.Node objects. The nodes are numbered in pre-order like in
+        from_uast(). Like bblfsh.Node.FromString(), it raises ValueError if the data is broken,
+        e.g. a token is not valid UTF-8.
+        :param data: protobuf wire format of the root node
+        :param deadline: time.perf_counter() value after which TimeoutError is raised
+        :param check_every: number of nodes decoded between two checks of the deadline
+        :param max_leaves: only the nodes up to the max_leaves-th leaf in pre-order are kept, \
+                           the later children are skipped without being decoded
+        :return: FlatTree whose nodes are FlatNode views
+        """
+        if deadline is not None and time.perf_counter() > deadline:
+            raise TimeoutError("Reached the deadline before decoding")
+        data = bytes(data)
+        parents = array("i", [0])
+        depth = array("i", [0])
+        type_ids = array("i", [-1])
+        tokens = [""]
+        role_nodes = array("i")
+        role_values = array("i")
+        type2id = {}
+        stack = []
+        # bound methods of the hot loop
+        push, pop = stack.append, stack.pop
+        add_parent, add_depth, add_type_id, add_token = \
+            parents.append, depth.append, type_ids.append, tokens.append
+        children_key, internal_type_key, token_key, roles_key = \
+            _CHILDREN_KEY, _INTERNAL_TYPE_KEY, _TOKEN_KEY, _ROLES_KEY
+        read_varint = _read_varint
+        index, pos, end = 0, 0, len(data)
+        n_leaves, full = 0, False
+        while True:
+            if pos >= end:
+                if pos > end:
+                    raise ValueError("Truncated UAST node %d" % index)
+                if not stack:
+                    break
+                if max_leaves is not None and index == len(tokens) - 1:
+                    # the node has no children
+                    n_leaves += 1
+                    full = n_leaves >= max_leaves
+                end, index = pop()
+                continue
+            key = data[pos]
+            if key & 0x80:
+                key, pos = read_varint(data, pos)
+            else:
+                pos += 1
+            wire_type = key & 7
+            if wire_type == 2:
+                length = data[pos]
+                if length & 0x80:
+                    length, pos = read_varint(data, pos)
+                else:
+                    pos += 1
+                if key == children_key:
+                    if full:
+                        # the open nodes are the ancestors of the last kept leaf
+                        pos += length
+                        continue
+                    push((end, index))
+                    add_parent(index)
+                    add_depth(len(stack))
+                    add_type_id(-1)
+                    add_token("")
+                    index, end = len(tokens) - 1, pos + length
+                    if deadline is not None and index % check_every == 0 and \
+                            time.perf_counter() > deadline:
+                        raise TimeoutError("Decoded %d nodes before the deadline" % index)
+                    continue
+                if key == internal_type_key:
+                    internal_type = data[pos:pos + length]
+                    type_id = type2id.get(internal_type)
+                    if type_id is None:
+                        type_id = type2id[internal_type] = len(type2id)
+                    type_ids[index] = type_id
+                elif key == token_key:
+                    try:
+                        tokens[index] = data[pos:pos + length].decode("utf-8")
+                    except UnicodeDecodeError as e:
+                        # protobuf rejects such strings too, see bblfsh.Node.FromString()
+                        raise ValueError("Invalid UTF-8 token of node %d: %s" % (index, e)) \
+                            from None
+                elif key == roles_key:
+                    # packed repeated enum, the roles below 128 take a single byte
+                    packed = data[pos:pos + length]
+                    if packed.isascii():
+                        role_values.extend(packed)
+                        role_nodes.extend(array("i", [index]) * length)
+                    else:
+                        roles_pos, roles_end = pos, pos + length
+                        while roles_pos < roles_end:
+                            role, roles_pos = read_varint(data, roles_pos)
+                            role_nodes.append(index)
+                            role_values.append(role)
+                pos += length
+            elif wire_type == 0:
+                value, pos = read_varint(data, pos)
+                if key >> 3 == NODE_ROLES:
+                    role_nodes.append(index)
+                    role_values.append(value)
+            elif wire_type == 1:
+                pos += 8
+            elif wire_type == 5:
+                pos += 4
+            else:
+                raise ValueError("Unsupported wire type %d at %d" % (wire_type, pos))
+
+        parents = np.frombuffer(parents, dtype=np.int32)
+        is_leaf = np.ones(len(parents), dtype=bool)
+        is_leaf[parents[1:]] = False
+        type_ids = np.frombuffer(type_ids, dtype=np.int32).copy()
+        types = [sys.intern(t.decode("utf-8")) for t in type2id]
+        if (type_ids < 0).any():
+            # nodes without internal_type, the default value of proto3 is not serialized
+            type_ids[type_ids < 0] = len(types)
+            types.append("")
+        role_nodes = np.frombuffer(role_nodes, dtype=np.int32)
+        order = np.argsort(role_nodes, kind="stable")
+        role_offsets = np.searchsorted(role_nodes[order], np.arange(len(parents) + 1))
+        return FlatTree(None, parents, np.frombuffer(depth, dtype=np.int32),
+                        np.flatnonzero(is_leaf).astype(np.int32), type_ids, types, tokens,
+                        np.frombuffer(role_values, dtype=np.int32)[order],
+                        role_offsets)
+
+    def type_id(self, internal_type: str) -> int:
+        """
+        :param internal_type: internal_type to look for
+        :return: id of the internal_type or -1 if no node in the tree has it
+        """
+        try:
+            return self.types.index(internal_type)
+        except ValueError:
+            return -1
+
+    def lca(self, u: int, v: int) -> int:
+        """
+        Computes least common ancestor of 2 nodes using log_parents and depth
+        :param u: index of the origin node
+        :param v: index of the destiny node
+        :return: index of the least common ancestor
+        """
+        depth, log_parents = self.depth, self.log_parents
+        if depth[u] < depth[v]:
+            u, v = v, u
+
+        diff, k = int(depth[u] - depth[v]), 0
+        while diff:
+            if diff & 1:
+                u = log_parents[k, u]
+            diff >>= 1
+            k += 1
+
+        if u == v:
+            return int(u)
+
+        for k in range(len(log_parents) - 1, -1, -1):
+            if log_parents[k, u] != log_parents[k, v]:
+                u = log_parents[k, u]
+                v = log_parents[k, v]
+
+        return int(log_parents[0, u])
+
+    def lca_batch(self, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        """
+        Vectorized version of lca() which computes the least common ancestor of every pair
+        (u[i], v[i]) at once.
+        :param u: indices of the origin nodes
+        :param v: indices of the destiny nodes
+        :return: indices of the least common ancestors
+        """
+        depth, log_parents = self.depth, self.log_parents
+        du, dv = depth[u], depth[v]
+        swap = du < dv
+        u, v = np.where(swap, v, u), np.where(swap, u, v)
+
+        diff = np.abs(du - dv)
+        for k in range(len(log_parents)):
+            jump = ((diff >> k) & 1).astype(bool)
+            u = np.where(jump, log_parents[k][u], u)
+
+        for k in range(len(log_parents) - 1, -1, -1):
+            pu, pv = log_parents[k][u], log_parents[k][v]
+            differ = pu != pv
+            u = np.where(differ, pu, u)
+            v = np.where(differ, pv, v)
+
+        return np.where(u == v, u, log_parents[0][u])
+
+    def distance(self, u: int, v: int, ancestor: int) -> int:
+        """
+        Computes distance of the path from u to v using the lca node as:
+            d(u,v) = d(root, u) + d(root, v) - 2 * d(root, lca)
+        """
+        return int(self.depth[u] + self.depth[v] - 2 * self.depth[ancestor])
+
+    def path(self, u: int, v: int, ancestor: int) -> List[int]:
+        """
+        Returns the indices of the nodes in the path from u to v, both included.
+        :param u: index of the start node
+        :param v: index of the end node
+        :param ancestor: index of the least common ancestor of u and v
+        """
+        parents = self.parents
+        up = []
+        while u != ancestor:
+            up.append(u)
+            u = parents[u]
+
+        down = []
+        while v != ancestor:
+            down.append(v)
+            v = parents[v]
+
+        up.append(ancestor)
+        up.extend(reversed(down))
+        return up
+
+    def __len__(self) -> int:
+        return len(self.nodes)
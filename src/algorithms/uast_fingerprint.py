@@ -0,0 +1,78 @@
+from hashlib import blake2b
+
+from algorithms.structures.flat_tree import NODE_CHILDREN, NODE_INTERNAL_TYPE, NODE_ROLES, \
+    NODE_TOKEN, _read_varint
+
+# the fields read by the path extraction, positions and properties do not change the paths
+FINGERPRINT_FIELDS = frozenset((NODE_INTERNAL_TYPE, NODE_TOKEN, NODE_ROLES))
+# markers of the start and the end of a child node in the hashed stream, neither of them is the
+# first byte of a hashed field: 0x1a is the key of the children and field number 0 is invalid
+_CHILD_START = bytes([NODE_CHILDREN << 3 | 2])
+_CHILD_END = b"\x00"
+
+
+def uast_fingerprint(data: bytes, digest_size: int=16) -> bytes:
+    """
+    Content hash of a serialized UAST (bblfsh.Node.SerializeToString()) which only covers the
+    tree structure, the internal types, the tokens and the roles of the nodes. The same code at
+    another line, in another file or in another repository gets the same fingerprint, and so the
+    same path contexts.
+    :param data: protobuf wire format of the root node
+    :param digest_size: size of the hash in bytes
+    :return: the hash, or the hash of the raw bytes if they cannot be decoded
+    """
+    h = blake2b(digest_size=digest_size)
+    try:
+        _hash_fields(data, h.update)
+    except (ValueError, IndexError):
+        h = blake2b(data, digest_size=digest_size)
+    return h.digest()
+
+
+def _hash_fields(data: bytes, update):
+    """
+    Feeds update() with the fields of every node in pre-order, the child nodes are delimited by
+    markers instead of their lengths, which include the skipped fields.
+    """
+    stack = []
+    push, pop = stack.append, stack.pop
+    read_varint, fields = _read_varint, FINGERPRINT_FIELDS
+    pos, end = 0, len(data)
+    while True:
+        if pos >= end:
+            if pos > end:
+                raise ValueError("Truncated UAST")
+            if not stack:
+                return
+            end = pop()
+            update(_CHILD_END)
+            continue
+        start = pos
+        key = data[pos]
+        if key & 0x80:
+            key, pos = read_varint(data, pos)
+        else:
+            pos += 1
+        wire_type = key & 7
+        if wire_type == 2:
+            length = data[pos]
+            if length & 0x80:
+                length, pos = read_varint(data, pos)
+            else:
+                pos += 1
+            if key >> 3 == NODE_CHILDREN:
+                push(end)
+                end = pos + length
+                update(_CHILD_START)
+                continue
+            pos += length
+        elif wire_type == 0:
+            _, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise ValueError("Unsupported wire type %d at %d" % (wire_type, start))
+        if key >> 3 in fields:
+            update(data[start:pos])
@@ -1,36 +1,230 @@
-from algorithms.path_contexts import get_paths
+from algorithms.path_contexts import TOKEN_EXTRACTORS, count_candidate_pairs, get_pairs, \
+    sample_pairs, to_path_contexts_multi
+from algorithms.structures.flat_tree import FlatTree
 from sourced.ml.utils import PickleableLogger
 from collections import Counter
+from functools import lru_cache
+from hashlib import blake2b
+import time
+
+from utils.metrics import Metrics
+
+# Prefixes of the keys emitted in hashed mode:
+#   c<u> <path> <v>: path context made of the hashes of its start token, path and end token
+#   t<hash>:<text>:  side table entry which maps the hash of a start/end token to its text
+#   p<hash>:<text>:  side table entry which maps the hash of a path to its nodes joined by PATH_SEP
+CONTEXT_PREFIX = "c"
+VALUE_PREFIX = "t"
+PATH_PREFIX = "p"
+PATH_SEP = "\x1f"
+
+
+@lru_cache(maxsize=1 << 18)
+def hash_token(text: str) -> int:
+    """
+    Stable 64-bit hash of a token, it does not depend on PYTHONHASHSEED.
+    """
+    return int.from_bytes(blake2b(text.encode("utf-8", "surrogatepass"), digest_size=8).digest(),
+                          "little")
+
+
+def parse_context_key(key: str):
+    """
+    :param key: context key without namespace, i.e. "c<u> <path> <v>"
+    :return: tuple (u, path, v) of hashes
+    """
+    u, path, v = key[1:].split(" ")
+    return int(u, 16), int(path, 16), int(v, 16)
+
+
+def parse_table_key(key: str):
+    """
+    :param key: side table key without namespace, i.e. "t<hash>:<text>" or "p<hash>:<text>"
+    :return: ((prefix, hash), text)
+    """
+    h, text = key[1:].split(":", 1)
+    return (key[0], int(h, 16)), text
+
 
 class Uast2BagOfPaths(PickleableLogger):
     """
     Converts a UAST to a bag of path contexts
     """
+    # leaves kept from a UAST which is not flattened within the time budget, if max_leaves is None
+    TIMEOUT_MAX_LEAVES = 4096
 
-    def __init__(self, max_length=5, max_width=5):
+    def __init__(self, max_length=5, max_width=5, hashed=False, metrics=None, max_leaves=None,
+                 max_contexts=None, time_budget=None, path_tokens=("internal_type",)):
         """
         :param max_length: of the extracted paths
         :param max_width: max width of the extracted paths (i.e., number of leaves between the start and end of the path)
+        :param hashed: emit integer hashes of the path contexts plus a side table with their \
+                       texts instead of the string representation of each path context
+        :param metrics: Metrics or accumulator of Metrics where to record the "extract" stage
+        :param max_leaves: only the paths between the first max_leaves leaves of a UAST are \
+                           extracted
+        :param max_contexts: maximum number of paths per UAST, a uniform sample is kept if there \
+                             are more
+        :param time_budget: seconds given to each step of the extraction of a UAST: the \
+                            flattening, the search of the paths and their conversion. The \
+                            results of a step which runs out of time are truncated, see extract()
+        :param path_tokens: representations of the path nodes, keys of TOKEN_EXTRACTORS. All of \
+                            them are built in the same pass and if there are several, each path \
+                            starts with the name of its representation.
         """
         super().__init__()
         self._max_length = max_length
         self._max_width = max_width
+        self._hashed = hashed
+        self.metrics = metrics
+        self._max_leaves = max_leaves
+        self._max_contexts = max_contexts
+        self._time_budget = time_budget
+        for name in path_tokens:
+            if name not in TOKEN_EXTRACTORS:
+                raise ValueError("Unknown path token %s, must be one of %s" %
+                                 (name, sorted(TOKEN_EXTRACTORS)))
+        self._path_tokens = tuple(path_tokens)
 
-    def __call__(self, uast):
+    @property
+    def options(self) -> dict:
+        """
+        Options which change the extracted bags.
+        """
+        return {"max_length": self._max_length, "max_width": self._max_width,
+                "hashed": self._hashed, "max_leaves": self._max_leaves,
+                "max_contexts": self._max_contexts, "time_budget": self._time_budget,
+                "path_tokens": list(self._path_tokens)}
+
+    def __call__(self, uast, limits: dict=None):
         """
         Converts a UAST to a weighed bag-of-path-contexts.
         The tokens are preprocessed by _token_parser.
 
         :param uast: The UAST root node.
+        :param limits: dict where to store which per-UAST limits were hit, see extract()
         :return: list(tuple) list of paths context like (u, path, v) where u & v and the
         starting and ending leaf, and path is the list of nodes in their minimal distance path.
         """
+        start = time.perf_counter()
+        metrics = Metrics() if self.metrics is not None else None
+        path_contexts = self.extract(uast, metrics, limits)
+        if self._hashed:
+            dict_of_paths = self._hash_path_contexts(Counter(path_contexts))
+        else:
+            dict_of_paths = {str(path): val for path, val in Counter(path_contexts).items()}
+        self._log.debug("Extracted %d paths", len(path_contexts))
 
-        path_contexts = get_paths(uast, self._max_length, self._max_width)
-        dict_of_paths = {str(path): val for path, val in Counter(path_contexts).items()}
-        self._log.info("Extracted paths successfully")
-
+        if metrics is not None:
+            self.metrics.add(metrics
+                             .count("extract.contexts", len(dict_of_paths))
+                             .count("extract.seconds", time.perf_counter() - start))
         return dict_of_paths
 
+    def extract(self, uast, metrics: Metrics=None, limits: dict=None) -> list:
+        """
+        Extracts the path contexts of a UAST within the per-UAST limits. Each step gets its own
+        time budget, so that a slow step does not starve the next one:
+        - a UAST which is not flattened in time is flattened again up to its max_leaves-th leaf
+          (TIMEOUT_MAX_LEAVES if max_leaves is None) and the paths between those leaves are kept,
+        - the search stops at the deadline and the paths found so far are sampled,
+        - the conversion stops at the deadline and the paths converted so far are kept.
+        :param uast: The UAST root node or the serialized UAST, which is decoded straight into a \
+                     FlatTree, see FlatTree.from_bytes().
+        :param metrics: Metrics where to record the sizes and how many UASTs hit each limit
+        :param limits: dict where to store whether each limit was hit: "max_leaves", \
+                       "max_contexts" and "time_budget"
+        :return: list of path contexts (u, path, v), see get_paths()
+        """
+        if isinstance(uast, (bytes, bytearray)):
+            flatten = FlatTree.from_bytes
+            if metrics is not None:
+                metrics.count("extract.bytes", len(uast))
+        else:
+            flatten = FlatTree.from_uast
+        truncated = False
+        try:
+            try:
+                tree = flatten(uast, self._deadline())
+            except TimeoutError as e:
+                truncated = True
+                max_leaves = self._max_leaves or self.TIMEOUT_MAX_LEAVES
+                self._log.debug("UAST not flattened within the time budget, keeping its first "
+                                "%d leaves: %s", max_leaves, e)
+                tree = flatten(uast, max_leaves=max_leaves)
+        except (ValueError, IndexError) as e:
+            self._log.error("Failed to decode the UAST: %s", e)
+            return []
+        pairs = get_pairs(tree, self._max_length, self._max_width, max_leaves=self._max_leaves)
+        pairs, n_paths, timed_out = sample_pairs(pairs, self._max_contexts, self._deadline())
+        timed_out = timed_out or truncated
+        sampled = len(pairs) < n_paths
+        kinds = to_path_contexts_multi(
+            tree, pairs, [TOKEN_EXTRACTORS[name] for name in self._path_tokens],
+            deadline=self._deadline())
+        if len(kinds[0]) < len(pairs):
+            # the deadline was reached during the conversion
+            timed_out = True
+            pairs = pairs[:len(kinds[0])]
+        if len(kinds) == 1:
+            path_contexts = kinds[0]
+        else:
+            path_contexts = [(u, (name,) + path, v)
+                             for name, contexts in zip(self._path_tokens, kinds)
+                             for u, path, v in contexts]
+
+        n_leaves = len(tree.leaves)
+        # a truncated tree holds max_leaves leaves if the UAST had more
+        hits = {"max_leaves": self._max_leaves is not None and
+                (n_leaves > self._max_leaves or truncated and n_leaves == self._max_leaves),
+                "max_contexts": sampled,
+                "time_budget": timed_out}
+        if any(hits.values()):
+            self._log.debug("UAST with %d leaves and %d paths hit the limits %s", n_leaves,
+                            n_paths, [name for name, hit in hits.items() if hit])
+        if limits is not None:
+            limits.update(hits)
+        if metrics is not None:
+            metrics \
+                .count("extract.uasts") \
+                .count("extract.leaves", n_leaves) \
+                .count("extract.candidate_pairs",
+                       count_candidate_pairs(min(n_leaves, self._max_leaves or n_leaves),
+                                             self._max_width)) \
+                .count("extract.paths", len(pairs)) \
+                .count("extract.sampled_out_paths", n_paths - len(pairs)) \
+                .observe("extract.leaves_per_uast", n_leaves) \
+                .observe("extract.paths_per_uast", len(pairs))
+            for name, hit in hits.items():
+                metrics.count("limits." + name, int(hit))
+        return path_contexts
+
+    def _deadline(self):
+        """
+        :return: time.perf_counter() value at which a step which starts now runs out of time
+        """
+        if self._time_budget is None:
+            return None
+        return time.perf_counter() + self._time_budget
+
+    @staticmethod
+    def _hash_path_contexts(path_contexts: Counter):
+        bag = {}
+        values = {}
+        paths = {}
+        for (u, path, v), val in path_contexts.items():
+            path = PATH_SEP.join(path)
+            hu, hpath, hv = hash_token(u), hash_token(path), hash_token(v)
+            bag["%s%x %x %x" % (CONTEXT_PREFIX, hu, hpath, hv)] = val
+            values[hu] = u
+            values[hv] = v
+            paths[hpath] = path
+
+        for prefix, table in ((VALUE_PREFIX, values), (PATH_PREFIX, paths)):
+            for h, text in table.items():
+                bag["%s%x:%s" % (prefix, h, text)] = 1
+
+        return bag
+
     def _get_log_name(self):
         return self.__class__.__name__
@@ -0,0 +1,123 @@
+"""
+Cosine nearest neighbour search over dense vectors: exact search by blocks of matrix products
+and the building blocks of an inverted file (IVF) index, i.e. spherical k-means and the search
+in the lists of the closest centroids.
+"""
+import numpy as np
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    :return: float32 copy of the vectors scaled to unit norm, zero vectors stay zero
+    """
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    vectors /= np.maximum(norms, np.finfo(np.float32).tiny)
+    return vectors
+
+
+def top_k(scores: np.ndarray, k: int):
+    """
+    :param scores: array of shape (queries, candidates)
+    :param k: number of best candidates to keep
+    :return: columns of the k highest scores of every row in decreasing order and the scores
+    """
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        columns = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        columns = np.broadcast_to(np.arange(k), (len(scores), k))
+    best = np.take_along_axis(scores, columns, axis=1)
+    order = np.argsort(-best, axis=1, kind="stable")
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(best, order, axis=1)
+
+
+def exact_search(vectors: np.ndarray, queries: np.ndarray, k: int, block: int=1 << 16):
+    """
+    Scores every vector against every query, 'block' vectors at a time to bound the memory.
+    :param vectors: unit vectors of shape (n, dim), may be memory-mapped
+    :param queries: unit vectors of shape (queries, dim)
+    :param k: number of neighbours
+    :param block: number of vectors scored at once
+    :return: rows of the k nearest vectors of every query and their cosine similarities, both \
+             of shape (queries, min(k, n))
+    """
+    rows = np.empty((len(queries), 0), dtype=np.int64)
+    scores = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), block):
+        block_rows, block_scores = top_k(queries @ vectors[start:start + block].T, k)
+        rows, scores = merge_top_k(rows, scores, block_rows + start, block_scores, k)
+    return rows, scores
+
+
+def merge_top_k(rows: np.ndarray, scores: np.ndarray, other_rows: np.ndarray,
+                other_scores: np.ndarray, k: int):
+    """
+    :return: the k best of two sets of candidates of every query, see top_k()
+    """
+    rows = np.concatenate((rows, other_rows), axis=1)
+    columns, scores = top_k(np.concatenate((scores, other_scores), axis=1), k)
+    return np.take_along_axis(rows, columns, axis=1), scores
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, block: int=1 << 16) -> np.ndarray:
+    """
+    :return: index of the closest centroid of every vector by cosine similarity
+    """
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block):
+        labels[start:start + block] = np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int=20,
+                     seed: int=0) -> np.ndarray:
+    """
+    Lloyd's algorithm with cosine similarity, the centroids are renormalized after every update.
+    Empty clusters are restarted from random vectors.
+    :param vectors: unit vectors of shape (n, dim), n >= n_clusters
+    :param n_clusters: number of centroids
+    :param iterations: number of updates
+    :param seed: seed of the initialization
+    :return: float32 unit centroids of shape (n_clusters, dim)
+    """
+    rnd = np.random.RandomState(seed)
+    centroids = np.array(vectors[np.sort(rnd.choice(len(vectors), n_clusters, replace=False))],
+                         dtype=np.float32)
+    for _ in range(iterations):
+        labels = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        empty = np.flatnonzero(np.bincount(labels, minlength=n_clusters) == 0)
+        sums[empty] = vectors[rnd.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+def ivf_search(vectors: np.ndarray, list_offsets: np.ndarray, centroids: np.ndarray,
+               queries: np.ndarray, k: int, n_probe: int):
+    """
+    Searches the lists of the n_probe centroids closest to every query.
+    :param vectors: unit vectors sorted by list, may be memory-mapped
+    :param list_offsets: the vectors of the i-th list are [list_offsets[i], list_offsets[i + 1])
+    :param centroids: unit centroids of the lists
+    :param queries: unit vectors of shape (queries, dim)
+    :param k: number of neighbours
+    :param n_probe: number of lists to search per query
+    :return: positions in vectors of the k nearest candidates of every query and their cosine \
+             similarities, padded with -1 and -inf if the lists have less than k vectors
+    """
+    probes = top_k(queries @ centroids.T, n_probe)[0]
+    rows = np.full((len(queries), k), -1, dtype=np.int64)
+    scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    for i, query in enumerate(queries):
+        starts, ends = list_offsets[probes[i]], list_offsets[probes[i] + 1]
+        candidates = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+        if len(candidates) == 0:
+            continue
+        candidate_scores = np.concatenate([vectors[start:end] @ query
+                                           for start, end in zip(starts, ends)])
+        columns, best = top_k(candidate_scores[None], k)
+        rows[i, :columns.shape[1]] = candidates[columns[0]]
+        scores[i, :columns.shape[1]] = best[0]
+    return rows, scores
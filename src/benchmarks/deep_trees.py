@@ -0,0 +1,95 @@
+"""
+Stress benchmark of the tree traversals on synthetic trees thousands of levels deep.
+
+Every tree is a chain of internal nodes with one extra leaf hanging from each level, the shape
+produced by long string concatenations or chained method calls. Time and memory should grow
+linearly with the depth, i.e. the per-node columns should stay flat.
+
+Usage (from src/): python -m benchmarks.deep_trees --depths 10000 20000 40000 80000
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+import bblfsh
+
+from algorithms.path_contexts import get_paths
+from algorithms.structures.extended_node import ExtNode
+from algorithms.structures.flat_tree import FlatTree
+
+
+def deep_tree(depth: int) -> bblfsh.Node:
+    """
+    Builds a chain of 'depth' internal nodes where every level also has a leaf.
+    :param depth: number of levels of the tree
+    :return: root of the tree
+    """
+    root = bblfsh.Node(internal_type="Root")
+    node = root
+    for i in range(depth):
+        leaf = node.children.add()
+        leaf.internal_type = "Leaf"
+        leaf.token = "leaf%d" % i
+        node = node.children.add()
+        node.internal_type = "Chain"
+    leaf = node.children.add()
+    leaf.internal_type = "Leaf"
+    leaf.token = "end"
+    return root
+
+
+def measure(func, *args):
+    """
+    :return: wall time in seconds and peak of traced memory in bytes of func(*args)
+    """
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def get_stages(max_length: int, max_width: int):
+    def extend_tree(uast):
+        return ExtNode.extend_tree(uast)
+
+    def as_dict(uast):
+        return ExtNode.extend_tree(uast)[0]._as_dict()
+
+    def flat_tree(uast):
+        return FlatTree.from_uast(uast)
+
+    def paths(uast):
+        return get_paths(uast, max_length, max_width)
+
+    return [("ExtNode.extend_tree", extend_tree), ("ExtNode._as_dict", as_dict),
+            ("FlatTree.from_uast", flat_tree), ("get_paths", paths)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--depths", type=int, nargs="+", default=[10000, 20000, 40000, 80000],
+                        help="Depths of the synthetic trees.")
+    parser.add_argument("--max-length", type=int, default=5, help="Max path length.")
+    parser.add_argument("--max-width", type=int, default=2, help="Max path width.")
+    args = parser.parse_args()
+
+    print("%-20s %8s %9s %10s %12s %10s" % ("stage", "depth", "time, s", "us/node", "peak, MiB",
+                                           "B/node"))
+    for depth in args.depths:
+        uast = deep_tree(depth)
+        n_nodes = 2 * depth + 2
+        for name, stage in get_stages(args.max_length, args.max_width):
+            elapsed, peak = measure(stage, uast)
+            print("%-20s %8d %9.3f %10.2f %12.1f %10.0f" % (
+                name, depth, elapsed, elapsed / n_nodes * 1e6, peak / (1 << 20), peak / n_nodes))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
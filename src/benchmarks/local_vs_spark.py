@@ -0,0 +1,71 @@
+"""
+Throughput comparison of the Spark extraction (extract) with the local one (extract-local).
+
+Both commands are run end to end in subprocesses, so the Spark session startup is included. The
+local mode does not read siva files, it takes the serialized UASTs (*.uast) or a checkout of the
+same repositories which is parsed with Babelfish.
+
+Usage (from the repository root):
+    python src/benchmarks/local_vs_spark.py --repositories tests/data --local-input checkout/
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(command: list) -> float:
+    """
+    :return: wall time in seconds of the command
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, SRC] + command, check=True)
+    return time.perf_counter() - start
+
+
+def count_contexts(path: str) -> int:
+    sys.path.insert(0, SRC)
+    from models.code2vec_features import Code2VecFeatures
+    return len(Code2VecFeatures().load(path).contexts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-r", "--repositories", default="tests/data",
+                        help="Directory with the siva files for extract.")
+    parser.add_argument("-l", "--languages", nargs="+", default=["Python", "Java"],
+                        help="Languages to analyze.")
+    parser.add_argument("-i", "--local-input", nargs="+", required=True,
+                        help="UASTs or source files of the same repositories for extract-local.")
+    parser.add_argument("--bblfsh", default="localhost:9432", help="Babelfish server's address.")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="Number of worker processes of extract-local.")
+    parser.add_argument("--max-length", type=int, default=5, help="Max path length.")
+    parser.add_argument("--max-width", type=int, default=2, help="Max path width.")
+    args = parser.parse_args()
+
+    common = ["--max-length", str(args.max_length), "--max-width", str(args.max_width)]
+    local = ["extract-local", "-i"] + args.local_input + ["--bblfsh", args.bblfsh] + common
+    if args.processes is not None:
+        local += ["-j", str(args.processes)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = []
+        for name, command in (
+                ("spark", ["extract", "-r", args.repositories, "-l"] + args.languages + common),
+                ("local", local)):
+            output = os.path.join(tmpdir, name + ".asdf")
+            elapsed = run(command + ["-o", output])
+            results.append((name, elapsed, count_contexts(output)))
+
+    print("%-8s %9s %12s %14s" % ("mode", "time, s", "contexts", "contexts/s"))
+    for name, elapsed, n_contexts in results:
+        print("%-8s %9.2f %12d %14.1f" % (name, elapsed, n_contexts, n_contexts / elapsed))
+    print("speedup of local: %.1fx" % (results[0][1] / results[1][1]))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
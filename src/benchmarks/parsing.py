@@ -0,0 +1,85 @@
+"""
+Throughput of ParserPool for several numbers of concurrent requests.
+
+By default the files are parsed by a stub Babelfish server started in the same process, which
+answers after --latency seconds, see utils.bblfsh_stub. With --endpoint they are sent to a real
+server instead, e.g. to pick --parse-workers for a deployment. Requests for a single file at a
+time is the behaviour of the engine.
+
+Usage (from src/):
+    python -m benchmarks.parsing --workers 1 4 16 64 --latency 0.02
+    python -m benchmarks.parsing --endpoint localhost:9432 -i repos/ --workers 1 8 32
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from local.extraction import list_files
+from utils.parsing import ParserPool
+
+
+def synthetic_files(n: int, lines: int):
+    """
+    :return: list of (path, contents, language) of small Python files
+    """
+    return [("file%d.py" % i, "\n".join("x%d = f(y, %d)" % (j, i) for j in range(lines)),
+             "python") for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--endpoint", help="Babelfish server, a stub server if unset.")
+    parser.add_argument("-i", "--input", nargs="+", help="Files and directories to parse, "
+                                                         "random Python files if unset.")
+    parser.add_argument("--files", type=int, default=500, help="Number of random files.")
+    parser.add_argument("--lines", type=int, default=50, help="Lines per random file.")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="Seconds per request of the stub server.")
+    parser.add_argument("--failures", type=int, default=0,
+                        help="Transient errors per file of the stub server.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16, 64],
+                        help="Numbers of concurrent requests to sweep.")
+    parser.add_argument("--connections", type=int, default=1, help="gRPC channels per pool.")
+    args = parser.parse_args()
+
+    if args.input:
+        files = []
+        for path in list_files(args.input):
+            with open(path, "rb") as f:
+                files.append((path, f.read(), None))
+    else:
+        files = synthetic_files(args.files, args.lines)
+
+    server = stub = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        from utils.bblfsh_stub import serve_stub
+        server, endpoint, stub = serve_stub(workers=max(args.workers) * args.connections,
+                                            latency=args.latency, failures=args.failures)
+    try:
+        print("%8s %10s %9s %9s %8s %7s" % ("workers", "files/s", "p50 ms", "p99 ms", "failed",
+                                            "retries"))
+        for workers in args.workers:
+            latencies = []
+            if stub is not None:
+                stub.requests.clear()
+            with ParserPool(endpoint, workers, connections=args.connections,
+                            backoff=0.01) as pool:
+                start = time.perf_counter()
+                for _, result in pool.parse_all(files):
+                    latencies.append(result.seconds * 1000)
+                elapsed = time.perf_counter() - start
+            counters = pool.metrics.counters
+            print("%8d %10.1f %9.2f %9.2f %8d %7d" % (
+                workers, len(files) / elapsed, *np.percentile(latencies, [50, 99]),
+                counters["parse.failed"], counters["parse.retries"]))
+            sys.stdout.flush()
+    finally:
+        if server is not None:
+            server.stop(0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Spread of the path extraction time across partitions with and without CostBalancer.
+
+The documents are synthetic trees with a heavy-tailed (log-normal) number of leaves, like the
+sizes of real functions. The extraction of every document is timed once with Uast2BagOfPaths,
+then the documents are split into --partitions partitions either in equal numbers of documents
+(what the engine gives) or by their estimated cost, see cost_targets(). The time of a partition
+is the sum of the times of its documents, and max/mean is the slowdown of the stage caused by
+its slowest partition. The correlation shows how well the serialized size predicts the time.
+
+Usage (from src/):
+    python -m benchmarks.partition_balance --documents 2000 --partitions 16 32
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from algorithms.uast_to_bag_paths import Uast2BagOfPaths
+from benchmarks.path_extraction import synthetic_tree
+from transformers.cost_balancer import cost_targets, spread, uast_cost
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--documents", type=int, default=1000, help="Number of documents.")
+    parser.add_argument("--median-leaves", type=int, default=40,
+                        help="Median number of leaves of a document.")
+    parser.add_argument("--sigma", type=float, default=1.2,
+                        help="Sigma of the log-normal number of leaves, the larger the heavier "
+                             "the tail.")
+    parser.add_argument("--max-leaves", type=int, default=20000,
+                        help="Maximum number of leaves of a document.")
+    parser.add_argument("--partitions", type=int, nargs="+", default=[8, 32],
+                        help="Numbers of partitions to sweep.")
+    parser.add_argument("--max-length", type=int, default=5)
+    parser.add_argument("--max-width", type=int, default=2)
+    args = parser.parse_args()
+
+    rnd = np.random.RandomState(0)
+    leaves = np.clip(np.round(rnd.lognormal(np.log(args.median_leaves), args.sigma,
+                                            args.documents)), 2, args.max_leaves).astype(int)
+    extractor = Uast2BagOfPaths(args.max_length, args.max_width)
+    costs, seconds = [], []
+    for i, n_leaves in enumerate(leaves):
+        uast = synthetic_tree(int(n_leaves), depth=12, branching=3, seed=i)
+        costs.append(uast_cost(uast.SerializeToString()))
+        start = time.perf_counter()
+        extractor(uast)
+        seconds.append(time.perf_counter() - start)
+    costs, seconds = np.array(costs), np.array(seconds)
+    print("%d documents, %.1fs of extraction, leaves p50 %d max %d, cost/time correlation %.3f"
+          % (len(costs), seconds.sum(), np.median(leaves), leaves.max(),
+             np.corrcoef(costs, seconds)[0, 1]))
+
+    print("%10s %9s %10s %10s %10s %9s" % ("partitions", "split", "p50 ms", "p99 ms", "max ms",
+                                           "max/mean"))
+    for n_partitions in args.partitions:
+        splits = (
+            ("count", np.arange(len(costs)) * n_partitions // len(costs)),
+            ("cost", cost_targets(costs, 0, costs.sum() / n_partitions, n_partitions)),
+        )
+        for name, targets in splits:
+            times = np.bincount(targets, weights=seconds, minlength=n_partitions) * 1000
+            stats = spread(times)
+            print("%10d %9s %10.1f %10.1f %10.1f %9.2f" % (
+                n_partitions, name, stats["p50"], stats["p99"], stats["max"],
+                stats["max/mean"]))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Benchmark of the path extraction hot path on synthetic and real UASTs.
+
+Every tree is run through each phase of get_paths() separately for every combination of
+max_length and max_width:
+    flatten: FlatTree.from_uast() without the ancestor table
+    annotate: binary-lifting ancestor table (FlatTree.log_parents)
+    pairs: leaf pairs inside the window with their LCA and distance filter, see get_pairs()
+    tokenize: conversion of the pairs to path contexts, see to_path_contexts()
+    bag: Uast2BagOfPaths, i.e. get_paths() plus the counting of the path contexts
+Timings are the best of --repeat runs. Peak RSS is the maximum resident set size of the process
+so far, so it never decreases from one case to the next.
+
+Real UASTs are read from files serialized with bblfsh.Node.SerializeToString() (*.uast), e.g.
+the ones of the repositories in tests/data exported with the engine.
+
+Usage (from src/):
+    python -m benchmarks.path_extraction --leaves 1000 10000 --output run.json
+    python -m benchmarks.path_extraction --uasts uasts/ --compare run.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+import bblfsh
+import numpy as np
+
+from algorithms.path_contexts import count_candidate_pairs, get_pairs, to_path_contexts
+from algorithms.structures.flat_tree import FlatTree
+from algorithms.uast_to_bag_paths import Uast2BagOfPaths
+from local.extraction import UAST_EXTENSION, list_files
+
+PHASES = ("flatten", "annotate", "pairs", "tokenize", "bag")
+
+
+def synthetic_tree(n_leaves: int, depth: int, branching: int, seed: int=0) -> bblfsh.Node:
+    """
+    Builds a random tree by repeatedly expanding a random leaf into 'branching' children until
+    there are at least 'n_leaves' leaves. Leaves at the maximum depth are not expanded.
+    :param n_leaves: number of leaves
+    :param depth: maximum depth of the tree
+    :param branching: number of children of every internal node
+    :param seed: seed of the random generator, the same arguments build the same tree
+    :return: root of the tree
+    """
+    rnd = random.Random(seed)
+    root = bblfsh.Node(internal_type="Root")
+    expandable = [(root, 0)]
+    leaves = 1
+    while leaves < n_leaves and expandable:
+        i = rnd.randrange(len(expandable))
+        node, node_depth = expandable[i]
+        expandable[i] = expandable[-1]
+        expandable.pop()
+        for _ in range(branching):
+            child = node.children.add()
+            child.internal_type = "Type%d" % rnd.randrange(32)
+            child.token = "token%d" % rnd.randrange(1000)
+            if node_depth + 1 < depth:
+                expandable.append((child, node_depth + 1))
+        leaves += branching - 1
+    return root
+
+
+def read_uasts(inputs: list):
+    """
+    :return: generator of (name, UAST) of the serialized UASTs in the inputs
+    """
+    for path in list_files(inputs):
+        if path.endswith(UAST_EXTENSION):
+            with open(path, "rb") as f:
+                yield os.path.basename(path), bblfsh.Node.FromString(f.read())
+
+
+def best_of(repeat: int, func, *args):
+    """
+    :return: minimal wall time in seconds of func(*args) and its result
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_rss() -> int:
+    """
+    :return: maximum resident set size of the process in bytes
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def run_case(uast: bblfsh.Node, max_length: int, max_width: int, repeat: int) -> dict:
+    """
+    Times every phase of the path extraction of a single tree.
+    :return: dict with the timings in seconds, the sizes and the throughputs
+    """
+    timings = {}
+    timings["flatten"], tree = best_of(repeat, FlatTree.from_uast, uast)
+    # from_uast() also builds the ancestor table, which is timed separately
+    timings["annotate"], _ = best_of(repeat, FlatTree._build_log_parents, tree.parents,
+                                     tree.depth)
+    timings["flatten"] = max(0.0, timings["flatten"] - timings["annotate"])
+    timings["pairs"], pairs = best_of(
+        repeat, lambda: list(get_pairs(tree, max_length, max_width)))
+    timings["tokenize"], paths = best_of(repeat, to_path_contexts, tree, pairs)
+    timings["bag"], _ = best_of(repeat, Uast2BagOfPaths(max_length, max_width), uast)
+
+    n_leaves = len(tree.leaves)
+    candidates = count_candidate_pairs(n_leaves, max_width)
+    total = timings["flatten"] + timings["annotate"] + timings["pairs"] + timings["tokenize"]
+    return {
+        "max_length": max_length,
+        "max_width": max_width,
+        "nodes": len(tree),
+        "leaves": n_leaves,
+        "depth": int(tree.depth.max()),
+        "candidate_pairs": candidates,
+        "paths": len(paths),
+        "timings": timings,
+        "total": total,
+        "paths_per_sec": len(paths) / total if total > 0 else 0.0,
+        "pairs_per_sec": candidates / timings["pairs"] if timings["pairs"] > 0 else 0.0,
+        "peak_rss": peak_rss(),
+    }
+
+
+def compare(results: list, baseline: dict):
+    """
+    Prints the speedup of every case against the same case of a previous run.
+    """
+    previous = {(r["tree"], r["max_length"], r["max_width"]): r for r in baseline["results"]}
+    print("\n%-28s %4s %4s %9s %9s" % ("tree", "len", "wid", "speedup", "rss"))
+    for r in results:
+        p = previous.get((r["tree"], r["max_length"], r["max_width"]))
+        if p is None:
+            continue
+        print("%-28s %4d %4d %8.2fx %8.2fx" % (r["tree"], r["max_length"], r["max_width"],
+                                               p["total"] / max(r["total"], 1e-12),
+                                               r["peak_rss"] / max(p["peak_rss"], 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--leaves", type=int, nargs="*", default=[1000, 10000],
+                        help="Numbers of leaves of the synthetic trees.")
+    parser.add_argument("--depth", type=int, default=30, help="Max depth of the synthetic trees.")
+    parser.add_argument("--branching", type=int, default=3,
+                        help="Number of children of the internal nodes of the synthetic trees.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic trees.")
+    parser.add_argument("--uasts", nargs="*", default=[],
+                        help="Files and directories with serialized UASTs (*.uast).")
+    parser.add_argument("--max-length", type=int, nargs="+", default=[5, 8],
+                        help="Max path lengths to sweep.")
+    parser.add_argument("--max-width", type=int, nargs="+", default=[2, 5],
+                        help="Max path widths to sweep.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of every phase.")
+    parser.add_argument("-o", "--output", help="Path of the JSON file with the results.")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with.")
+    args = parser.parse_args()
+
+    trees = [("synthetic-%d-%d-%d" % (n, args.depth, args.branching),
+              lambda n=n: synthetic_tree(n, args.depth, args.branching, args.seed))
+             for n in args.leaves]
+    trees.extend((name, lambda uast=uast: uast) for name, uast in read_uasts(args.uasts))
+
+    print("%-28s %4s %4s %7s %9s" % ("tree", "len", "wid", "leaves", "paths") +
+          "".join(" %9s" % phase for phase in PHASES) + " %11s %11s %9s" % (
+              "paths/s", "pairs/s", "RSS, MiB"))
+    results = []
+    for name, build in trees:
+        uast = build()
+        for max_length in args.max_length:
+            for max_width in args.max_width:
+                result = run_case(uast, max_length, max_width, args.repeat)
+                result["tree"] = name
+                results.append(result)
+                print("%-28s %4d %4d %7d %9d" % (name, max_length, max_width, result["leaves"],
+                                                 result["paths"]) +
+                      "".join(" %9.4f" % result["timings"][p] for p in PHASES) +
+                      " %11.0f %11.0f %9.1f" % (result["paths_per_sec"], result["pairs_per_sec"],
+                                                result["peak_rss"] / (1 << 20)))
+                sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": platform.python_version(),
+                       "numpy": np.__version__,
+                       "platform": platform.platform(),
+                       "args": vars(args),
+                       "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
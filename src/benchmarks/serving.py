@@ -0,0 +1,128 @@
+"""
+Latency and throughput of the embedding service over HTTP for several micro-batch sizes.
+
+Random UASTs are serialized and sent concurrently by --clients threads over keep-alive
+connections to the service running in the same process. The vocabularies are built from the
+path contexts of the UASTs and the weights are random, which does not change the cost. The
+latencies are measured by the clients, max batch 1 disables the batching.
+
+Usage (from src/):
+    OPENBLAS_NUM_THREADS=1 python -m benchmarks.serving --clients 1 8 --max-batch 1 8 32
+"""
+import argparse
+import base64
+import http.client
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+
+from algorithms.uast_to_bag_paths import Uast2BagOfPaths
+from benchmarks.path_extraction import synthetic_tree
+from models.code2vec import Code2Vec
+from models.code2vec_features import Code2VecFeatures
+from serving.embedder import Code2VecEmbedder
+from serving.server import EmbeddingService, make_http_server
+from training.network import init_weights
+
+
+def build_embedder(uasts: list, uast2paths: Uast2BagOfPaths, value_dim: int, path_dim: int,
+                   n_labels: int) -> Code2VecEmbedder:
+    """
+    :return: Code2VecEmbedder with the vocabularies of the UASTs and random weights
+    """
+    value2index, path2index = {}, {}
+    for uast in uasts:
+        for u, path, v in uast2paths.extract(uast):
+            for token in (u, v):
+                value2index.setdefault(token, len(value2index))
+            path2index.setdefault(path, len(path2index))
+    vocabulary = Code2VecFeatures().construct(value2index, path2index,
+                                              dict.fromkeys(value2index, 1),
+                                              dict.fromkeys(path2index, 1))
+    weights = init_weights(len(value2index), len(path2index), n_labels, value_dim, path_dim,
+                           2 * value_dim + path_dim)
+    model = Code2Vec().construct(labels=["label%d" % i for i in range(n_labels)], **weights)
+    return Code2VecEmbedder(vocabulary, model, uast2paths)
+
+
+def run_clients(port: int, bodies: list, clients: int, requests: int):
+    """
+    :return: latencies in seconds of all the requests and the wall time
+    """
+    latencies = [[] for _ in range(clients)]
+
+    def client(index: int):
+        connection = http.client.HTTPConnection("localhost", port)
+        for i in range(requests):
+            body = bodies[(index * requests + i) % len(bodies)]
+            start = time.perf_counter()
+            connection.request("POST", "/embed", body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            latencies[index].append(time.perf_counter() - start)
+            if response.status != 200:
+                raise ValueError("HTTP %d" % response.status)
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.concatenate(latencies), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--uasts", type=int, default=64, help="Number of random UASTs.")
+    parser.add_argument("--leaves", type=int, default=100, help="Leaves per random UAST.")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8],
+                        help="Numbers of concurrent clients to sweep.")
+    parser.add_argument("--max-batch", type=int, nargs="+", default=[1, 8, 32],
+                        help="Maximum batch sizes to sweep.")
+    parser.add_argument("--max-delay", type=float, default=2,
+                        help="Milliseconds to wait for more requests to batch.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per client.")
+    parser.add_argument("--max-length", type=int, default=5, help="Max path length.")
+    parser.add_argument("--max-width", type=int, default=2, help="Max path width.")
+    parser.add_argument("--value-dim", type=int, default=128, help="Value embeddings dimension.")
+    parser.add_argument("--path-dim", type=int, default=128, help="Path embeddings dimension.")
+    parser.add_argument("--labels", type=int, default=1000, help="Number of labels.")
+    args = parser.parse_args()
+
+    uasts = [synthetic_tree(args.leaves, 8, 3, seed) for seed in range(args.uasts)]
+    embedder = build_embedder(uasts, Uast2BagOfPaths(args.max_length, args.max_width),
+                              args.value_dim, args.path_dim, args.labels)
+    bodies = [json.dumps({"uast": base64.b64encode(uast.SerializeToString()).decode()})
+              for uast in uasts]
+
+    print("%7s %9s %9s %9s %9s %10s" % ("clients", "max batch", "p50 ms", "p99 ms", "req/s",
+                                        "mean batch"))
+    for clients in args.clients:
+        for max_batch in args.max_batch:
+            service = EmbeddingService(embedder, max_batch, args.max_delay / 1000)
+            server = make_http_server(service, "localhost", 0)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                run_clients(server.server_address[1], bodies, clients, 10)
+                latencies, elapsed = run_clients(server.server_address[1], bodies, clients,
+                                                 args.requests)
+            finally:
+                server.shutdown()
+                server.server_close()
+                service.close()
+            stats = service.stats()
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            print("%7d %9d %9.2f %9.2f %9.1f %10.2f" % (
+                clients, max_batch, p50, p99, len(latencies) / elapsed,
+                stats["batch.mean_size"]))
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
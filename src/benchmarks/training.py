@@ -0,0 +1,92 @@
+"""
+Throughput of the code2vec training in path contexts per second for several numbers of threads,
+with the share of the time spent waiting for the BatchLoader.
+
+The path contexts come from a Code2VecFeatures model or are generated at random: every document
+gets a random number of contexts and a label from a small set. Timings are the best of --repeat
+epochs, the weights keep training between the repetitions.
+
+Run with single-threaded BLAS to measure the scaling of the trainer itself (from src/):
+    OPENBLAS_NUM_THREADS=1 python -m benchmarks.training --threads 1 2 4 8
+    OPENBLAS_NUM_THREADS=1 python -m benchmarks.training -i features.asdf --threads 1 8
+"""
+import argparse
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from models.code2vec_features import Code2VecFeatures
+from training.loader import load_corpus
+from training.trainer import Code2VecTrainer
+
+
+def synthetic_features(n_docs: int, n_values: int, n_paths: int, n_labels: int,
+                       mean_contexts: int, seed: int=0) -> Code2VecFeatures:
+    """
+    :return: Code2VecFeatures with random path contexts and documents named like Moder does
+    """
+    rnd = np.random.RandomState(seed)
+    sizes = rnd.randint(1, 2 * mean_contexts, n_docs)
+    offsets = np.zeros(n_docs + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    contexts = np.stack([rnd.randint(0, n_values, offsets[-1]),
+                         rnd.randint(0, n_paths, offsets[-1]),
+                         rnd.randint(0, n_values, offsets[-1])], axis=1).astype(np.int32)
+    value2index = {"v%d" % i: i for i in range(n_values)}
+    path2index = {("p%d" % i,): i for i in range(n_paths)}
+    return Code2VecFeatures().construct(
+        value2index, path2index, dict.fromkeys(value2index, 1), dict.fromkeys(path2index, 1),
+        docs=["file%d.py_func%d:1" % (i, i % n_labels) for i in range(n_docs)],
+        doc_offsets=offsets, contexts=contexts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-i", "--input", help="Code2VecFeatures model or shards, random if unset.")
+    parser.add_argument("--docs", type=int, default=20000, help="Number of random documents.")
+    parser.add_argument("--values", type=int, default=50000, help="Number of random values.")
+    parser.add_argument("--paths", type=int, default=50000, help="Number of random paths.")
+    parser.add_argument("--labels", type=int, default=1000, help="Number of random labels.")
+    parser.add_argument("--mean-contexts", type=int, default=100,
+                        help="Mean number of path contexts of the random documents.")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4],
+                        help="Numbers of threads to sweep.")
+    parser.add_argument("--batch-size", type=int, default=256, help="Documents per batch.")
+    parser.add_argument("--max-contexts", type=int, default=200,
+                        help="Maximum number of path contexts per document.")
+    parser.add_argument("--value-dim", type=int, default=128, help="Value embeddings dimension.")
+    parser.add_argument("--path-dim", type=int, default=128, help="Path embeddings dimension.")
+    parser.add_argument("--repeat", type=int, default=2, help="Timed epochs per case.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.input:
+        features = load_corpus(args.input)
+    else:
+        features = synthetic_features(args.docs, args.values, args.paths, args.labels,
+                                      args.mean_contexts)
+
+    print("%7s %12s %12s %8s %7s" % ("threads", "contexts/s", "docs/s", "speedup", "wait"))
+    baseline = None
+    for threads in args.threads:
+        trainer = Code2VecTrainer(features, value_dim=args.value_dim, path_dim=args.path_dim,
+                                  batch_size=args.batch_size, max_contexts=args.max_contexts,
+                                  threads=threads)
+        best = None
+        with ThreadPoolExecutor(threads) as pool:
+            for _ in range(args.repeat):
+                counters = trainer.train_epoch(pool).counters
+                rate = counters["train.contexts"] / counters["train.seconds"]
+                if best is None or rate > best[0]:
+                    best = (rate, counters["train.documents"] / counters["train.seconds"],
+                            counters["train.wait_seconds"] / counters["train.seconds"])
+        baseline = baseline or best[0]
+        print("%7d %12.1f %12.1f %7.2fx %6.1f%%" % (threads, best[0], best[1],
+                                                   best[0] / baseline, 100 * best[2]))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
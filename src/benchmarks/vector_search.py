@@ -0,0 +1,94 @@
+"""
+Recall and latency of the IVF search of VectorIndex against the exact search.
+
+The vectors are read from an index written by the index command or generated at random around
+--clusters centers, which is closer to real embeddings than uniform noise. The queries are
+perturbed copies of random vectors. Recall@k is the share of the exact k nearest neighbours
+found by the IVF search, latencies are per single-vector query.
+
+Usage (from src/):
+    python -m benchmarks.vector_search --size 200000 --probes 1 4 16 64
+    python -m benchmarks.vector_search --index model.docs.index --probes 8 32
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from models.vector_index import VectorIndex, write_index
+
+
+def clustered_vectors(n: int, dim: int, n_clusters: int, noise: float, seed: int=0):
+    """
+    :return: float32 array (n, dim) of Gaussian noise around random unit centers
+    """
+    rnd = np.random.RandomState(seed)
+    centers = rnd.randn(n_clusters, dim)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    vectors = centers[rnd.randint(n_clusters, size=n)] + \
+        rnd.randn(n, dim) * noise / np.sqrt(dim)
+    return vectors.astype(np.float32)
+
+
+def timed_queries(search, queries: np.ndarray):
+    """
+    :return: results of search() on every query and the latencies in ms
+    """
+    rows, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        rows.append(search(query)[0][0])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(rows), np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--index", help="Index written by the index command, random if unset.")
+    parser.add_argument("--size", type=int, default=100000, help="Number of random vectors.")
+    parser.add_argument("--dim", type=int, default=384, help="Dimension of the random vectors.")
+    parser.add_argument("--clusters", type=int, default=1000,
+                        help="Number of centers of the random vectors.")
+    parser.add_argument("--noise", type=float, default=1.0,
+                        help="Norm of the noise around the centers.")
+    parser.add_argument("--lists", type=int, default=None,
+                        help="Number of IVF lists of the random index, see write_index().")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries.")
+    parser.add_argument("-k", type=int, default=10, help="Number of neighbours.")
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 4, 16, 64],
+                        help="Numbers of lists searched per query to sweep.")
+    args = parser.parse_args()
+
+    rnd = np.random.RandomState(1)
+    with tempfile.TemporaryDirectory(prefix="code2vec-index-") as tmpdir:
+        if args.index:
+            index = VectorIndex(args.index)
+        else:
+            vectors = clustered_vectors(args.size, args.dim, args.clusters, args.noise)
+            start = time.perf_counter()
+            manifest = write_index(tmpdir, vectors, [str(i) for i in range(len(vectors))],
+                                   args.lists)
+            print("Built %d lists over %d vectors in %.1fs" % (
+                manifest["lists"], len(vectors), time.perf_counter() - start))
+            index = VectorIndex(tmpdir)
+        if index.lists is None:
+            print("The index has no lists, only the exact search is measured")
+        queries = np.stack([index.vector(row) for row in rnd.choice(len(index), args.queries)])
+        queries += rnd.randn(*queries.shape).astype(np.float32) * 0.1 / np.sqrt(index.dim)
+
+        exact, latencies = timed_queries(lambda q: index.exact_search(q, args.k), queries)
+        print("%8s %10s %9s %9s" % ("probes", "recall@%d" % args.k, "p50 ms", "p99 ms"))
+        print("%8s %10.4f %9.3f %9.3f" % ("exact", 1, *np.percentile(latencies, [50, 99])))
+        sys.stdout.flush()
+        for n_probe in args.probes if index.lists is not None else []:
+            found, latencies = timed_queries(lambda q: index.search(q, args.k, n_probe), queries)
+            recall = np.mean([len(np.intersect1d(a, b)) / len(a) for a, b in zip(exact, found)])
+            print("%8d %10.4f %9.3f %9.3f" % (n_probe, recall,
+                                              *np.percentile(latencies, [50, 99])))
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
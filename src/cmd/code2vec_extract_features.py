@@ -1,10 +1,18 @@
 import logging
+import time
 from uuid import uuid4
 
 from extractors.paths import UastPathsBagExtractor
+from transformers.cached_uast2bag_features import CachedUast2BagFeatures
+from transformers.cost_balancer import CostBalancer
+from transformers.metered import MeteredModer, MeteredUastDeserializer, PartitionTimer, \
+    RowMeter
+from transformers.pooled_uast_extractor import PooledUastExtractor
+from transformers.uast_deduplicator import UastDeduplicator
 from transformers.vocabulary2id import Vocabulary2Id
-from sourced.ml.transformers import UastDeserializer, Uast2BagFeatures, create_uast_source, \
-    UastRow2Document, Moder
+from utils.metrics import metrics_accumulator
+from sourced.ml.transformers import Uast2BagFeatures, create_file_source, \
+    create_uast_source, UastRow2Document
 from sourced.ml.utils.engine import pipeline_graph, pause
 
 
@@ -12,18 +20,78 @@ from sourced.ml.utils.engine import pipeline_graph, pause
 def code2vec_extract_features(args):
     log = logging.getLogger("code2vec")
     session_name = "code2vec-%s" % uuid4()
-    root, start_point = create_uast_source(args, session_name)
+    # with --parse-workers the files are parsed by the pools of PooledUastExtractor instead of
+    # one at a time by the engine
+    if args.parse_workers is None:
+        root, start_point = create_uast_source(args, session_name)
+    else:
+        root, start_point = create_file_source(args, session_name)
+    sc = root.session.sparkContext
+    metrics = metrics_accumulator(sc)
+    if args.parse_workers is not None:
+        start_point = start_point.link(PooledUastExtractor(
+            args.parse_endpoint, metrics, args.parse_workers, args.parse_in_flight,
+            dict(args.parse_timeouts), args.parse_timeout, args.parse_retries,
+            args.parse_connections))
 
-    res = start_point \
-        .link(Moder("func")) \
-        .link(UastRow2Document()) \
-        .link(UastDeserializer()) \
-        .link(Uast2BagFeatures([UastPathsBagExtractor(args.max_length, args.max_width)])) \
-        .link(Vocabulary2Id(root.session.sparkContext, args.output)) \
+    extractor = UastPathsBagExtractor(args.max_length, args.max_width, args.hash_paths, metrics,
+                                      args.max_leaves, args.max_contexts, args.time_budget,
+                                      args.path_tokens)
+    uasts = start_point \
+        .link(MeteredModer("func", metrics)) \
+        .link(RowMeter(metrics, "moder.functions")) \
+        .link(UastRow2Document())
+    deduplicator = None
+    if args.dedup:
+        deduplicator = UastDeduplicator(metrics)
+        uasts = uasts.link(deduplicator)
+    balancer = None
+    if args.balance:
+        balancer = CostBalancer(metrics, args.balance_partitions)
+        uasts = uasts.link(balancer)
+    cache = None
+    if args.cache is not None:
+        cache = CachedUast2BagFeatures([extractor], args.cache, args.cache_size << 20, sc,
+                                       metrics, args.zero_copy)
+        bags = uasts.link(cache)
+    elif args.zero_copy:
+        # the extractor decodes the serialized UASTs itself
+        bags = uasts.link(Uast2BagFeatures([extractor]))
+    else:
+        bags = uasts \
+            .link(MeteredUastDeserializer(metrics)) \
+            .link(Uast2BagFeatures([extractor]))
+    timer = PartitionTimer(metrics, "extract")
+    start = time.perf_counter()
+    bags \
+        .link(timer) \
+        .link(Vocabulary2Id(sc, args.output, args.hash_paths, args.min_count,
+                            args.max_vocab_size, args.drop_oov, args.sharded, metrics,
+                            deduplicator, args.count_duplicates)) \
         .execute()
+    if deduplicator is not None:
+        deduplicator.unpersist()
+    if balancer is not None:
+        balancer.report(timer)
+        balancer.unpersist()
 
-    # TODO: Add rest of data pipeline: extract distinct paths and terminal nodes for embedding mapping
-    # TODO: Add transformer to write bags and vocabs to a model
-    # TODO: Add ML pipeline
+    metrics = metrics.value
+    metrics.count("pipeline.seconds", time.perf_counter() - start)
+    if cache is not None:
+        # counted in a transformation, a partition computed twice is counted twice
+        metrics \
+            .count("cache.approx_hits", cache.approx_hits.value) \
+            .count("cache.approx_misses", cache.approx_misses.value)
+    log.info("Extraction metrics:\n%s", metrics.summary())
+    counters = metrics.counters
+    if counters["parse.wall_seconds"] > 0:
+        log.info("Parsed %d files, %d failed: %.1f files/s per partition, %.1f ms per file, "
+                 "%.1f requests in flight on average", counters["parse.files"],
+                 counters["parse.failed"],
+                 counters["parse.files"] / counters["parse.wall_seconds"],
+                 1000 * counters["parse.seconds"] / max(counters["parse.files"], 1),
+                 counters["parse.seconds"] / counters["parse.wall_seconds"])
+    if args.metrics is not None:
+        metrics.dump(args.metrics)
 
     pipeline_graph(args, log, root)
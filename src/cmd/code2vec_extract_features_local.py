@@ -0,0 +1,36 @@
+import logging
+import time
+
+from local.extraction import extract, list_repository_files
+from local.vocabulary import LocalVocabulary
+from utils.metrics import Metrics
+
+
+def code2vec_extract_features_local(args):
+    logging.basicConfig(level=args.log_level)
+    log = logging.getLogger("code2vec")
+    files = list_repository_files(args.input)
+    log.info("Extracting path contexts from %d files", len(files))
+
+    start = time.time()
+    vocabulary = LocalVocabulary()
+    metrics = Metrics()
+    n_docs = n_contexts = 0
+    for path, docs, file_metrics in extract(
+            files, args.max_length, args.max_width, args.mode, args.bblfsh, args.processes,
+            args.chunk_size, args.max_leaves, args.max_contexts, args.time_budget,
+            args.path_tokens):
+        metrics.add(file_metrics)
+        for doc, path_contexts in docs:
+            vocabulary.add(doc, path_contexts)
+            n_docs += 1
+            n_contexts += len(path_contexts)
+    elapsed = time.time() - start
+    log.info("Extracted %d path contexts from %d documents in %.1fs: %.1f files/s, "
+             "%.1f contexts/s", n_contexts, n_docs, elapsed, len(files) / max(elapsed, 1e-9),
+             n_contexts / max(elapsed, 1e-9))
+    log.info("Extraction metrics:\n%s", metrics.summary())
+
+    vocabulary \
+        .build(args.min_count, args.max_vocab_size, args.drop_oov) \
+        .save(args.output)
@@ -0,0 +1,40 @@
+import logging
+import os
+import time
+
+from algorithms.uast_to_bag_paths import PATH_SEP
+from models.code2vec import Code2Vec
+from models.vector_index import index_path, write_index
+from serving.embedder import document_vectors
+from training.loader import corpus_vocabulary, load_corpus
+
+
+def code2vec_index(args):
+    logging.basicConfig(level=args.log_level)
+    log = logging.getLogger("code2vec")
+    model = Code2Vec().load(args.model)
+    corpus = load_corpus(args.input)
+
+    start = time.time()
+    if args.kind == "docs":
+        names, vectors = document_vectors(model, corpus, args.batch_size, args.max_contexts,
+                                          args.seed)
+        log.info("Computed %d document vectors in %.1fs", len(names), time.time() - start)
+    else:
+        vocabulary = corpus_vocabulary(corpus)
+        if args.kind == "paths":
+            names, vectors = [PATH_SEP.join(path) for path in vocabulary.index2path], \
+                model.path_embeddings
+        else:
+            names, vectors = list(vocabulary.index2value), model.value_embeddings
+        if len(names) != len(vectors):
+            raise ValueError("The vocabulary has %d %s but the model %d embeddings" % (
+                len(names), args.kind, len(vectors)))
+
+    output = args.output or index_path(args.model, args.kind)
+    start = time.time()
+    manifest = write_index(output, vectors, names, args.lists, args.sample, args.iterations,
+                           args.seed, meta={"kind": args.kind,
+                                            "model": os.path.abspath(args.model)})
+    log.info("Indexed %d %s in %d lists in %.1fs: %s", manifest["size"], args.kind,
+             manifest["lists"], time.time() - start, output)
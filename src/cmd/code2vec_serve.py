@@ -0,0 +1,37 @@
+import logging
+import sys
+
+from algorithms.uast_to_bag_paths import Uast2BagOfPaths
+from models.code2vec import Code2Vec
+from serving.embedder import Code2VecEmbedder
+from serving.server import EmbeddingService, make_http_server, serve_lines
+from training.loader import corpus_vocabulary, load_corpus
+
+
+def code2vec_serve(args):
+    logging.basicConfig(level=args.log_level)
+    log = logging.getLogger("code2vec")
+    vocabulary = corpus_vocabulary(load_corpus(args.features))
+    model = Code2Vec().load(args.model)
+    uast2paths = Uast2BagOfPaths(args.max_length, args.max_width, max_leaves=args.max_leaves,
+                                 max_contexts=args.max_contexts, time_budget=args.time_budget,
+                                 path_tokens=args.path_tokens)
+    embedder = Code2VecEmbedder(vocabulary, model, uast2paths, args.max_model_contexts)
+    service = EmbeddingService(embedder, args.max_batch, args.max_delay / 1000, args.bblfsh)
+    log.info("Loaded %d values, %d paths and %d labels", len(embedder.value2index),
+             len(embedder.path2index), len(model.labels))
+    try:
+        if args.stdin:
+            serve_lines(service, sys.stdin, sys.stdout, args.workers)
+        else:
+            server = make_http_server(service, args.host, args.port)
+            log.info("Listening on http://%s:%d", *server.server_address[:2])
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+    finally:
+        service.close()
+        log.info("Served %s", service.stats())
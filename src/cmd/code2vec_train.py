@@ -0,0 +1,33 @@
+import logging
+import time
+
+from models.code2vec import Code2Vec
+from training.loader import load_corpus
+from training.trainer import Code2VecTrainer, latest_checkpoint
+
+
+def code2vec_train(args):
+    logging.basicConfig(level=args.log_level)
+    log = logging.getLogger("code2vec")
+    if args.resume and args.checkpoint_dir is None:
+        raise ValueError("--resume requires --checkpoint-dir")
+    corpus = load_corpus(args.input)
+
+    model = None
+    if args.resume:
+        path = latest_checkpoint(args.checkpoint_dir)
+        if path is not None:
+            model = Code2Vec().load(path)
+            log.info("Resuming from %s after %d epochs", path, model.epoch)
+
+    trainer = Code2VecTrainer(corpus, args.label_pattern, args.value_dim, args.path_dim,
+                              args.code_dim, args.batch_size, args.max_contexts,
+                              args.learning_rate, args.threads, args.seed, model,
+                              args.shuffle_buffer, args.loader_workers, args.prefetch)
+    start = time.time()
+    model = trainer.train(args.epochs, args.checkpoint_dir, args.checkpoint_every)
+    log.info("Trained in %.1fs with %d threads", time.time() - start, trainer.threads)
+
+    # the state of the optimizer is only kept in the checkpoints
+    model.optimizer = None
+    model.save(args.output)
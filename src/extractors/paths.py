@@ -1,3 +1,5 @@
+import json
+
 from algorithms.uast_to_bag_paths import Uast2BagOfPaths
 from sourced.ml.extractors import BagsExtractor, register_extractor
 
@@ -7,9 +9,30 @@ class UastPathsBagExtractor(BagsExtractor):
     NAME = "code2vec"
     NAMESPACE = "v."
 
-    def __init__(self, max_length=5, max_width=5, **kwargs):
+    def __init__(self, max_length=5, max_width=5, hashed=False, metrics=None, max_leaves=None,
+                 max_contexts=None, time_budget=None, path_tokens=("internal_type",), **kwargs):
         super().__init__(**kwargs)
-        self.uast2paths = Uast2BagOfPaths(max_length, max_width)
+        self.uast2paths = Uast2BagOfPaths(max_length, max_width, hashed, metrics, max_leaves,
+                                          max_contexts, time_budget, path_tokens)
 
     def uast_to_bag(self, uast):
         return self.uast2paths(uast)
+
+    def extract_cacheable(self, uast):
+        """
+        Same as extract() but also tells whether the bag can be cached: the bag of a UAST which
+        hit the time budget depends on the load of the machine, see CachedUast2BagFeatures.
+        :return: list of (key, value) and whether the bag can be cached
+        """
+        limits = {}
+        bag = [(self.NAMESPACE + key, val * self.weight)
+               for key, val in self.uast2paths(uast, limits).items()]
+        return bag, not limits.get("time_budget", False)
+
+    @property
+    def cache_namespace(self) -> str:
+        """
+        Identifies the bags extracted with the current options, see CachedUast2BagFeatures.
+        """
+        return "%s:%s:%s" % (self.NAME, self.weight,
+                             json.dumps(self.uast2paths.options, sort_keys=True))
@@ -0,0 +1,150 @@
+import logging
+import os
+from hashlib import sha1
+from multiprocessing import Pool
+from typing import Iterable, List, Tuple
+
+import bblfsh
+
+from algorithms.uast_to_bag_paths import Uast2BagOfPaths
+from utils.metrics import Metrics
+
+UAST_EXTENSION = ".uast"
+# separators of the document names, see sourced.ml.transformers.UastRow2Document
+REPO_PATH_SEP = "//"
+PATH_BLOB_SEP = "@"
+
+_worker = {}
+
+
+def list_files(inputs: Iterable[str]) -> List[str]:
+    """
+    :param inputs: files and directories, the latter are walked recursively
+    :return: sorted list of files
+    """
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names)
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def list_repository_files(inputs: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    :param inputs: files and directories, the latter are walked recursively
+    :return: sorted list of (repository, path) where the repository is the input directory, or \
+             the directory of an input file, and path is relative to it
+    """
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            repository = os.path.normpath(path)
+            files.extend((repository, os.path.relpath(file, repository))
+                         for file in list_files([path]))
+        else:
+            files.append(os.path.split(os.path.normpath(path)))
+    return sorted(files)
+
+
+def blob_id(data: bytes) -> str:
+    """
+    :return: hash of the contents of a file like the blob ids of git and the engine
+    """
+    return sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def document_name(repository: str, path: str, blob: str) -> str:
+    """
+    :return: name of a document like UastRow2Document: repository//path@blob
+    """
+    return repository + REPO_PATH_SEP + path + PATH_BLOB_SEP + blob
+
+
+def _init_worker(uast2paths: Uast2BagOfPaths, mode: str, bblfsh_endpoint: str):
+    _worker.update(uast2paths=uast2paths, mode=mode, bblfsh_endpoint=bblfsh_endpoint,
+                   client=None, moder=None, log=logging.getLogger("extract-local"))
+
+
+def _read_uast(path: str) -> Tuple[bblfsh.Node, str]:
+    """
+    Reads a serialized UAST (*.uast) or parses a source file with the Babelfish server.
+    :return: the UAST and the blob id of the file
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(UAST_EXTENSION):
+        return bblfsh.Node.FromString(data), blob_id(data)
+    if _worker["client"] is None:
+        _worker["client"] = bblfsh.BblfshClient(_worker["bblfsh_endpoint"])
+    response = _worker["client"].parse(path)
+    if response.status != 0:
+        raise ValueError("; ".join(response.errors))
+    return response.uast, blob_id(data)
+
+
+def _split(repository: str, path: str, blob: str, uast: bblfsh.Node):
+    """
+    Splits the UAST into documents and names them like Moder and UastRow2Document do.
+    """
+    if _worker["mode"] == "file":
+        yield document_name(repository, path, blob), uast
+        return
+    if _worker["moder"] is None:
+        from sourced.ml.transformers import Moder
+        _worker["moder"] = Moder(_worker["mode"])
+    for func, name in _worker["moder"].extract_functions_from_uast(uast):
+        yield document_name(repository, path, blob + "_%s:%d" % (
+            name, func.start_position.line)), func
+
+
+def extract_file(file: Tuple[str, str]):
+    """
+    :param file: (repository, path), see list_repository_files()
+    :return: path, the list of (doc, [distinct path contexts]) extracted from it and the \
+             Metrics of the extraction. The documents of a serialized UAST are named after \
+             the source file, without UAST_EXTENSION.
+    """
+    repository, path = file
+    full_path = os.path.join(repository, path)
+    metrics = Metrics()
+    try:
+        uast, blob = _read_uast(full_path)
+    except Exception as e:
+        _worker["log"].warning("Failed to read %s: %s", full_path, e)
+        return full_path, [], metrics.count("source.failed_files")
+    if path.endswith(UAST_EXTENSION):
+        path = path[:-len(UAST_EXTENSION)]
+    docs = [(doc, list(set(_worker["uast2paths"].extract(uast, metrics))))
+            for doc, uast in _split(repository, path, blob, uast)]
+    return full_path, docs, metrics.count("source.files")
+
+
+def extract(files: List[Tuple[str, str]], max_length: int, max_width: int, mode: str="func",
+            bblfsh_endpoint: str="localhost:9432", processes: int=None, chunk_size: int=16,
+            max_leaves: int=None, max_contexts: int=None, time_budget: float=None,
+            path_tokens=("internal_type",)):
+    """
+    Extracts the path contexts of the files in a pool of processes.
+    :param files: (repository, path) of the serialized UASTs (*.uast) or of the source files \
+                  to parse with Babelfish, see list_repository_files()
+    :param max_length: max path length
+    :param max_width: max path width
+    :param mode: "file" or "func", see Moder
+    :param bblfsh_endpoint: address of the Babelfish server to parse the source files
+    :param processes: number of worker processes, all the CPUs by default
+    :param chunk_size: number of files sent to a worker at once
+    :param max_leaves: see Uast2BagOfPaths
+    :param max_contexts: see Uast2BagOfPaths
+    :param time_budget: see Uast2BagOfPaths
+    :param path_tokens: see Uast2BagOfPaths
+    :return: generator of (path, [(doc, [path contexts]), ...], Metrics) in the order of files
+    """
+    uast2paths = Uast2BagOfPaths(max_length, max_width, max_leaves=max_leaves,
+                                 max_contexts=max_contexts, time_budget=time_budget,
+                                 path_tokens=path_tokens)
+    with Pool(processes, initializer=_init_worker,
+              initargs=(uast2paths, mode, bblfsh_endpoint)) as pool:
+        yield from pool.imap(extract_file, files, chunksize=chunk_size)
@@ -0,0 +1,114 @@
+from array import array
+from typing import Iterable
+
+import numpy as np
+
+from models.code2vec_features import Code2VecFeatures
+from transformers.vocabulary2id import OOV
+
+
+class LocalVocabulary(object):
+    """
+    In-memory counterpart of Vocabulary2Id for the extraction without Spark: it counts values and
+    paths, prunes them with the same rules and builds the same Code2VecFeatures model.
+
+    Values and paths get provisional ids as they are seen, so documents are stored as int32
+    triples right away and only remapped once after pruning.
+    """
+
+    def __init__(self):
+        self._value2id = {}
+        self._path2id = {}
+        self._value_freqs = array("q")
+        self._path_freqs = array("q")
+        self._docs = []
+        self._doc_sizes = array("q")
+        self._contexts = array("i")
+
+    def _id(self, token2id: dict, freqs: array, token) -> int:
+        i = token2id.get(token)
+        if i is None:
+            i = token2id[token] = len(token2id)
+            freqs.append(0)
+        freqs[i] += 1
+        return i
+
+    def add(self, doc: str, path_contexts: Iterable[tuple]):
+        """
+        :param doc: document name
+        :param path_contexts: distinct (u, path, v) of the document
+        """
+        size = 0
+        for u, path, v in path_contexts:
+            self._contexts.extend((self._id(self._value2id, self._value_freqs, u),
+                                   self._id(self._path2id, self._path_freqs, path),
+                                   self._id(self._value2id, self._value_freqs, v)))
+            size += 1
+        if size > 0:
+            self._docs.append(doc)
+            self._doc_sizes.append(size)
+
+    @staticmethod
+    def _prune(freqs: np.ndarray, min_count: int, max_vocab_size: int, drop_oov: bool):
+        """
+        :return: mapping from provisional to final ids (-1 for dropped), the provisional ids \
+                 which are kept in the order of their final ids and the final freqs
+        """
+        kept = np.flatnonzero(freqs >= min_count)
+        if max_vocab_size is not None and len(kept) > max_vocab_size:
+            kept = kept[np.argsort(-freqs[kept], kind="stable")[:max_vocab_size]]
+            kept.sort()
+        mapping = np.full(len(freqs), -1, dtype=np.int32)
+        mapping[kept] = np.arange(len(kept), dtype=np.int32)
+        kept_freqs = freqs[kept]
+        if len(kept) < len(freqs) and not drop_oov:
+            mapping[mapping < 0] = len(kept)
+            kept_freqs = np.append(kept_freqs, freqs.sum() - kept_freqs.sum())
+        return mapping, kept, kept_freqs
+
+    def build(self, min_count: int=1, max_vocab_size: int=None,
+              drop_oov: bool=False) -> Code2VecFeatures:
+        """
+        :param min_count: minimum frequency of the values and paths to keep
+        :param max_vocab_size: maximum number of values and of paths to keep
+        :param drop_oov: drop the path contexts with pruned values or paths instead of mapping \
+                         them to the OOV id
+        """
+        value_mapping, kept_values, value_freqs = self._prune(
+            np.frombuffer(self._value_freqs, dtype=np.int64), min_count, max_vocab_size, drop_oov)
+        path_mapping, kept_paths, path_freqs = self._prune(
+            np.frombuffer(self._path_freqs, dtype=np.int64), min_count, max_vocab_size, drop_oov)
+
+        # provisional ids follow the insertion order of the dicts
+        values, paths = list(self._value2id), list(self._path2id)
+        index2value = [values[i] for i in kept_values]
+        index2path = [paths[i] for i in kept_paths]
+        if len(value_freqs) > len(kept_values):
+            index2value.append(OOV)
+        if len(path_freqs) > len(kept_paths):
+            index2path.append((OOV,))
+
+        contexts = np.frombuffer(self._contexts, dtype=np.int32).reshape(-1, 3)
+        contexts = np.stack([value_mapping[contexts[:, 0]], path_mapping[contexts[:, 1]],
+                             value_mapping[contexts[:, 2]]], axis=1)
+        doc_ids = np.repeat(np.arange(len(self._docs)), np.frombuffer(self._doc_sizes,
+                                                                      dtype=np.int64))
+        keep = (contexts >= 0).all(axis=1)
+        contexts, doc_ids = contexts[keep], doc_ids[keep]
+        if not drop_oov and (len(kept_values) < len(value_freqs) or
+                             len(kept_paths) < len(path_freqs)):
+            # distinct path contexts of a document can map to the same OOV ids, they are kept
+            # once like in Vocabulary2Id
+            unique = np.unique(np.column_stack([doc_ids, contexts]), axis=0)
+            doc_ids, contexts = unique[:, 0], unique[:, 1:]
+        sizes = np.bincount(doc_ids, minlength=len(self._docs))
+        docs = [doc for doc, size in zip(self._docs, sizes) if size > 0]
+        offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+        np.cumsum(sizes[sizes > 0], out=offsets[1:])
+
+        return Code2VecFeatures().construct(
+            value2index={v: i for i, v in enumerate(index2value)},
+            path2index={p: i for i, p in enumerate(index2path)},
+            value2freq=dict(zip(index2value, value_freqs.tolist())),
+            path2freq=dict(zip(index2path, path_freqs.tolist())),
+            docs=docs, doc_offsets=offsets, contexts=contexts.astype(np.int32))
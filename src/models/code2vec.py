@@ -0,0 +1,83 @@
+from modelforge import register_model, Model
+
+import numpy as np
+
+from models.code2vec_features import _load_strings, _merge_strings, _split_strings
+
+WEIGHTS = ("value_embeddings", "path_embeddings", "transform", "attention", "label_embeddings")
+
+
+@register_model
+class Code2Vec(Model):
+    """
+    Code2Vec model - weights of the code2vec attention network trained on Code2VecFeatures.
+
+    The values and the paths have the IDs of the Code2VecFeatures model used for training. A path
+    context is embedded as tanh([value_embeddings[u], path_embeddings[p], value_embeddings[v]] @
+    transform), the code vector is the sum of the path context embeddings weighted by the softmax
+    of their dot products with attention, and label_embeddings score the labels.
+
+    Checkpoints also carry the state of the optimizer and the number of finished epochs.
+    """
+    NAME = "code2vec"
+
+    def construct(self, value_embeddings, path_embeddings, transform, attention,
+                  label_embeddings, labels, epoch=0, optimizer=None):
+        """
+        :param value_embeddings: float32 array of shape (number of values, value dim)
+        :param path_embeddings: float32 array of shape (number of paths, path dim)
+        :param transform: float32 array of shape (2 * value dim + path dim, code dim)
+        :param attention: float32 array of shape (code dim,)
+        :param label_embeddings: float32 array of shape (number of labels, code dim)
+        :param labels: list of the labels ordered by ID
+        :param epoch: number of finished training epochs
+        :param optimizer: state of the optimizer to resume training, see training.optimizer.Adam
+        """
+        self.value_embeddings = value_embeddings
+        self.path_embeddings = path_embeddings
+        self.transform = transform
+        self.attention = attention
+        self.label_embeddings = label_embeddings
+        self.labels = labels
+        self.epoch = epoch
+        self.optimizer = optimizer
+        return self
+
+    @property
+    def weights(self) -> dict:
+        """
+        Dict name -> array of the trainable weights, see WEIGHTS.
+        """
+        return {name: getattr(self, name) for name in WEIGHTS}
+
+    @property
+    def code_dim(self) -> int:
+        return len(self.attention)
+
+    def _load_tree(self, tree):
+        optimizer = None
+        if "optimizer" in tree:
+            optimizer = {"step": int(tree["optimizer"]["step"]),
+                         "moments": {key: np.array(value) for key, value
+                                     in tree["optimizer"]["moments"].items()}}
+        self.construct(labels=_split_strings(_load_strings(tree["labels"])),
+                       epoch=int(tree["epoch"]), optimizer=optimizer,
+                       **{name: np.array(tree[name]) for name in WEIGHTS})
+
+    def _generate_tree(self):
+        tree = dict(self.weights)
+        tree["labels"] = _merge_strings(self.labels)
+        tree["epoch"] = self.epoch
+        if self.optimizer is not None:
+            tree["optimizer"] = self.optimizer
+        return tree
+
+    def dump(self):
+        return "Number of values: %s\n" \
+               "Number of paths: %s\n" \
+               "Number of labels: %s\n" \
+               "Code vector dimension: %s\n" \
+               "Epochs: %s\n" \
+               "First 10 labels: %s" % \
+               (len(self.value_embeddings), len(self.path_embeddings), len(self.labels),
+                self.code_dim, self.epoch, self.labels[:10])
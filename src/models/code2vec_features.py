@@ -1,35 +1,196 @@
-from modelforge import register_model, Model
-from itertools import islice
+from modelforge import register_model, Model, merge_strings
+
+import numpy as np
+
+from algorithms.uast_to_bag_paths import PATH_SEP
+
+
+def _merge_strings(strings: list) -> dict:
+    if len(strings) == 0:
+        return {"strings": np.array([b""]), "lengths": np.array([], dtype=np.uint8), "str": True}
+    return merge_strings(strings)
+
+
+def _split_strings(subtree: dict) -> list:
+    # same as modelforge.split_strings() but the offsets do not overflow the dtype of lengths
+    strings = subtree["strings"][0]
+    if subtree["str"]:
+        strings = strings.decode("utf-8")
+    ends = np.cumsum(subtree["lengths"], dtype=np.int64).tolist()
+    return [strings[start:end] for start, end in zip([0] + ends, ends)]
+
+
+def _load_strings(subtree: dict) -> dict:
+    return {"strings": np.asarray(subtree["strings"]), "lengths": np.asarray(subtree["lengths"]),
+            "str": bool(subtree.get("str", True))}
 
 
 @register_model
 class Code2VecFeatures(Model):
     """
     Code2VecFeatures model - path contexts from source code.
+
+    The vocabularies and the path contexts are stored as contiguous arrays: values and paths
+    ordered by ID with their frequencies, and the path contexts in CSR form (document offsets plus
+    an int32 array of (value, path, value) triples). The dicts and lists exposed by the properties
+    are built on first access.
     """
     NAME = "code2vec_features"
 
-    def construct(self, value2index, path2index, value2freq, path2freq, path_contexts):
+    def construct(self, value2index, path2index, value2freq, path2freq, path_contexts=None,
+                  docs=None, doc_offsets=None, contexts=None, doc_counts=None):
+        """
+        The path contexts are given either as a list of (doc, [path_context_1, ...]) or already
+        packed in CSR form with docs, doc_offsets and contexts. doc_counts is the number of
+        identical documents each document stands for if they were deduplicated.
+        """
+        self._reset()
         self._value2index = value2index
         self._path2index = path2index
         self._value2freq = value2freq
         self._path2freq = path2freq
         self._path_contexts = path_contexts
+        self._docs = docs
+        self._doc_offsets = doc_offsets
+        self._contexts = contexts
+        self._doc_counts = doc_counts
         return self
 
+    def _reset(self):
+        self._value2index = self._path2index = self._value2freq = self._path2freq = None
+        self._path_contexts = None
+        self._index2value = self._index2path = self._value_freqs = self._path_freqs = None
+        self._docs = self._doc_offsets = self._contexts = self._doc_counts = None
+        self._tree = None
+
     def _load_tree(self, tree):
-        self.construct(
-            value2index=tree["value2index"],
-            path2index={tuple(val[0]): key for (key, val) in tree["index2path_freq"].items()},
-            value2freq=tree["value2freq"],
-            path2freq={tuple(val[0]): val[1] for (_, val) in tree["index2path_freq"].items()},
-            path_contexts=tree["path_contexts"])
+        if "index2path_freq" in tree:
+            # the original layout with the vocabularies as dicts
+            self.construct(
+                value2index=tree["value2index"],
+                path2index={tuple(val[0]): key for (key, val) in tree["index2path_freq"].items()},
+                value2freq=tree["value2freq"],
+                path2freq={tuple(val[0]): val[1] for (_, val) in tree["index2path_freq"].items()},
+                path_contexts=tree["path_contexts"])
+            return
+        self._reset()
+        # the strings are only split when needed, modelforge already decompressed the arrays so
+        # they are referenced instead of copied
+        self._tree = {key: _load_strings(tree[key]) for key in ("values", "paths", "docs")}
+        self._value_freqs = np.asarray(tree["value_freqs"])
+        self._path_freqs = np.asarray(tree["path_freqs"])
+        self._doc_offsets = np.asarray(tree["doc_offsets"])
+        self._contexts = np.asarray(tree["contexts"])
+        if "doc_counts" in tree:
+            self._doc_counts = np.asarray(tree["doc_counts"])
+
+    @property
+    def index2value(self):
+        """
+        List of the values ordered by ID.
+        """
+        if self._index2value is None:
+            if self._tree is not None:
+                self._index2value = _split_strings(self._tree["values"])
+            else:
+                self._index2value = [None] * len(self._value2index)
+                for value, i in self._value2index.items():
+                    self._index2value[i] = value
+        return self._index2value
+
+    @property
+    def index2path(self):
+        """
+        List of the paths ordered by ID.
+        """
+        if self._index2path is None:
+            if self._tree is not None:
+                self._index2path = [tuple(path.split(PATH_SEP))
+                                    for path in _split_strings(self._tree["paths"])]
+            else:
+                self._index2path = [None] * len(self._path2index)
+                for path, i in self._path2index.items():
+                    self._index2path[i] = path
+        return self._index2path
+
+    @property
+    def value_freqs(self):
+        """
+        Array with the frequency of each value ID.
+        """
+        if self._value_freqs is None:
+            self._value_freqs = np.array([self._value2freq[v] for v in self.index2value],
+                                         dtype=np.int64)
+        return self._value_freqs
+
+    @property
+    def path_freqs(self):
+        """
+        Array with the frequency of each path ID.
+        """
+        if self._path_freqs is None:
+            self._path_freqs = np.array([self._path2freq[p] for p in self.index2path],
+                                        dtype=np.int64)
+        return self._path_freqs
+
+    @property
+    def docs(self):
+        """
+        List with the document names.
+        """
+        if self._docs is None:
+            if self._tree is not None:
+                self._docs = _split_strings(self._tree["docs"])
+            else:
+                self._build_csr()
+        return self._docs
+
+    @property
+    def doc_offsets(self):
+        """
+        Array of the offsets of the contexts of each document: those of the i-th document are
+        contexts[doc_offsets[i]:doc_offsets[i + 1]].
+        """
+        if self._doc_offsets is None:
+            self._build_csr()
+        return self._doc_offsets
+
+    @property
+    def contexts(self):
+        """
+        int32 array of shape (number of path contexts, 3) with (value, path, value) IDs.
+        """
+        if self._contexts is None:
+            self._build_csr()
+        return self._contexts
+
+    @property
+    def doc_counts(self):
+        """
+        int64 array with the number of identical documents each document stands for, all ones
+        unless the documents were deduplicated.
+        """
+        if self._doc_counts is None:
+            return np.ones(len(self.docs), dtype=np.int64)
+        return self._doc_counts
+
+    def _build_csr(self):
+        docs, offsets, contexts = [], [0], []
+        for doc, path_contexts in self._path_contexts:
+            docs.append(doc)
+            contexts.extend(path_contexts)
+            offsets.append(len(contexts))
+        self._docs = docs
+        self._doc_offsets = np.array(offsets, dtype=np.int64)
+        self._contexts = np.array(contexts, dtype=np.int32).reshape(-1, 3)
 
     @property
     def value2index(self):
         """
         Dict mapping value -> ID.
         """
+        if self._value2index is None:
+            self._value2index = {v: i for i, v in enumerate(self.index2value)}
         return self._value2index
 
     @property
@@ -37,6 +198,8 @@ class Code2VecFeatures(Model):
         """
         Dict mapping path -> ID.
         """
+        if self._path2index is None:
+            self._path2index = {p: i for i, p in enumerate(self.index2path)}
         return self._path2index
 
     @property
@@ -44,6 +207,8 @@ class Code2VecFeatures(Model):
         """
          Dict mapping value -> frequency.
         """
+        if self._value2freq is None:
+            self._value2freq = dict(zip(self.index2value, self._value_freqs.tolist()))
         return self._value2freq
 
     @property
@@ -51,6 +216,8 @@ class Code2VecFeatures(Model):
         """
          Dict mapping path -> frequency.
         """
+        if self._path2freq is None:
+            self._path2freq = dict(zip(self.index2path, self._path_freqs.tolist()))
         return self._path2freq
 
     @property
@@ -58,49 +225,63 @@ class Code2VecFeatures(Model):
         """
         List with the processed source code identifiers.
         """
+        if self._path_contexts is None:
+            offsets, contexts = self._doc_offsets, self._contexts
+            self._path_contexts = [
+                (doc, [tuple(pc) for pc in contexts[offsets[i]:offsets[i + 1]].tolist()])
+                for i, doc in enumerate(self.docs)]
         return self._path_contexts
 
     def value2index_items(self):
         """
         Returns the tuples belonging to value -> index mapping.
         """
-        return self._value2index.items()
+        return self.value2index.items()
 
     def path2index_items(self):
         """
         Returns the tuples belonging to path -> index mapping.
         """
-        return self._path2index.items()
+        return self.path2index.items()
 
     def value2freq_items(self):
         """
         Returns the tuples belonging to value -> freq mapping.
         """
-        return self._value2freq.items()
+        return self.value2freq.items()
 
     def path2freq_items(self):
         """
         Returns the tuples belonging to path -> freq mapping.
         """
-        return self._path2freq.items()
+        return self.path2freq.items()
 
     def _generate_tree(self):
-        return {"value2index": self._value2index,
-                "index2path_freq": {val: (key, self._path2freq[key])
-                                    for (key, val) in self._path2index.items()},
-                "value2freq": self._value2freq,
-                "path_contexts": self._path_contexts}
+        tree = {"values": _merge_strings(self.index2value),
+                "value_freqs": self.value_freqs,
+                "paths": _merge_strings([PATH_SEP.join(p) for p in self.index2path]),
+                "path_freqs": self.path_freqs,
+                "docs": _merge_strings(self.docs),
+                "doc_offsets": self.doc_offsets,
+                "contexts": self.contexts}
+        if self._doc_counts is not None:
+            tree["doc_counts"] = self._doc_counts
+        return tree
 
     def dump(self):
         return "Number of values: %s\n" \
                "Number of paths: %s\n" \
+               "Number of documents: %s\n" \
+               "Number of path contexts: %s\n" \
                "First 10 value -> ID: %s\n" \
                "First 10 path -> ID: %s\n" \
                "First 10 value -> frequency: %s\n" \
                "First 10 path -> frequency: %s" % \
-               (len(self._value2index),
-                len(self._path2index),
-                list(islice(self.value2index_items(), 10)),
-                list(islice(self.path2index_items(), 10)),
-                list(islice(self.value2freq_items(), 10)),
-                list(islice(self.path2freq_items(), 10)))
+               (len(self.value_freqs),
+                len(self.path_freqs),
+                len(self.doc_offsets) - 1,
+                len(self.contexts),
+                [(v, i) for i, v in enumerate(self.index2value[:10])],
+                [(p, i) for i, p in enumerate(self.index2path[:10])],
+                list(zip(self.index2value[:10], self.value_freqs[:10].tolist())),
+                list(zip(self.index2path[:10], self.path_freqs[:10].tolist())))
@@ -0,0 +1,134 @@
+import json
+import os
+from typing import List
+
+import numpy as np
+
+from models.code2vec_features import Code2VecFeatures
+
+MANIFEST = "shards.json"
+VOCABULARY = "vocabulary.asdf"
+
+
+def shard_name(index: int) -> str:
+    return "part-%05d" % index
+
+
+def write_shard(directory: str, index: int, docs: List[str], doc_offsets: np.ndarray,
+                contexts: np.ndarray, doc_counts: np.ndarray=None):
+    """
+    Writes a CSR block of path contexts as columnar arrays:
+        <name>.docs.json: list of document names
+        <name>.offsets.npy: int64 array, contexts of the i-th document are in [offsets[i], \
+offsets[i + 1])
+        <name>.contexts.npy: int32 array of shape (number of contexts, 3)
+        <name>.counts.npy: int64 array with the multiplicity of each document, only if the \
+documents were deduplicated
+    :param directory: output directory, it must be reachable by every executor
+    :param index: index of the partition
+    :param docs: document names
+    :param doc_offsets: offsets of the contexts of each document
+    :param contexts: int32 array of (value, path, value) IDs
+    :param doc_counts: number of identical documents each document stands for
+    :return: description of the shard for the manifest
+    """
+    name = shard_name(index)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name + ".docs.json"), "w") as f:
+        json.dump(docs, f)
+    np.save(os.path.join(directory, name + ".offsets.npy"), doc_offsets)
+    np.save(os.path.join(directory, name + ".contexts.npy"), contexts)
+    shard = {"name": name, "docs": len(docs), "contexts": len(contexts)}
+    if doc_counts is not None:
+        np.save(os.path.join(directory, name + ".counts.npy"), doc_counts)
+        shard["counts"] = True
+    return shard
+
+
+def write_manifest(directory: str, shards: list):
+    """
+    :param directory: output directory
+    :param shards: descriptions returned by write_shard()
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump({"vocabulary": VOCABULARY,
+                   "shards": sorted(shards, key=lambda s: s["name"])}, f, indent=2)
+
+
+class PathContextShards(object):
+    """
+    Reader of the path contexts written by write_shard(). Shards are loaded one at a time and
+    memory-mapped by default, so the corpus can be larger than RAM.
+    """
+
+    def __init__(self, directory: str, mmap: bool=True):
+        """
+        :param directory: directory with the manifest, the vocabulary and the shards
+        :param mmap: memory-map the arrays instead of reading them
+        """
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        self._vocabulary_path = os.path.join(directory, manifest["vocabulary"])
+        self._shards = manifest["shards"]
+        self._mmap_mode = "r" if mmap else None
+        self._vocabulary = None
+
+    @property
+    def vocabulary(self) -> Code2VecFeatures:
+        """
+        Code2VecFeatures model with the vocabularies and no path contexts, loaded on first access.
+        """
+        if self._vocabulary is None:
+            self._vocabulary = Code2VecFeatures().load(self._vocabulary_path)
+        return self._vocabulary
+
+    @property
+    def n_contexts(self) -> int:
+        return sum(s["contexts"] for s in self._shards)
+
+    def __len__(self) -> int:
+        return sum(s["docs"] for s in self._shards)
+
+    @property
+    def n_shards(self) -> int:
+        return len(self._shards)
+
+    def shard(self, index: int, doc_counts: bool=False):
+        """
+        Loads a single shard.
+        :param index: index of the shard in the manifest
+        :param doc_counts: append the multiplicity of the documents to the tuple, all ones \
+                           if they were not deduplicated
+        :return: (docs, offsets, contexts), see write_shard()
+        """
+        shard = self._shards[index]
+        prefix = os.path.join(self.directory, shard["name"])
+        with open(prefix + ".docs.json") as f:
+            docs = json.load(f)
+        block = (docs,
+                 np.load(prefix + ".offsets.npy", mmap_mode=self._mmap_mode),
+                 np.load(prefix + ".contexts.npy", mmap_mode=self._mmap_mode))
+        if doc_counts:
+            if shard.get("counts"):
+                counts = np.load(prefix + ".counts.npy", mmap_mode=self._mmap_mode)
+            else:
+                counts = np.ones(len(docs), dtype=np.int64)
+            block += (counts,)
+        return block
+
+    def shards(self, doc_counts: bool=False):
+        """
+        Generator of (docs, offsets, contexts) for every shard, see shard().
+        """
+        for index in range(len(self._shards)):
+            yield self.shard(index, doc_counts)
+
+    def __iter__(self):
+        """
+        Generator of (doc, contexts) where contexts is an int32 array of shape (n, 3).
+        """
+        for docs, offsets, contexts in self.shards():
+            for i, doc in enumerate(docs):
+                yield doc, contexts[offsets[i]:offsets[i + 1]]
@@ -0,0 +1,162 @@
+import json
+import os
+from typing import List
+
+import numpy as np
+
+from algorithms.vector_search import assign, exact_search, ivf_search, normalize, \
+    spherical_kmeans
+
+INDEX_MANIFEST = "index.json"
+
+
+def index_path(model_path: str, kind: str) -> str:
+    """
+    :return: default directory of the index of a model, next to it
+    """
+    return "%s.%s.index" % (os.path.splitext(model_path)[0], kind)
+
+
+def default_lists(n: int) -> int:
+    """
+    :return: number of IVF lists for n vectors, 0 for an exact index below 10000 vectors
+    """
+    return 0 if n < 10000 else int(4 * np.sqrt(n))
+
+
+def write_index(directory: str, vectors: np.ndarray, names: List[str], n_lists: int=None,
+                sample: int=256, iterations: int=20, seed: int=0, meta: dict=None) -> dict:
+    """
+    Writes a cosine similarity index of the vectors as columnar arrays:
+        index.json: manifest with the size, the dimension, the number of lists and 'meta'
+        names.json: list of the names of the vectors
+        vectors.npy: float32 unit vectors, sorted by list if there are lists
+        rows.npy: int64 array, position of every stored vector in the original order
+        centroids.npy: float32 unit centroids of the lists, only if there are lists
+        lists.npy: int64 array, the vectors of the i-th list are [lists[i], lists[i + 1])
+    :param directory: output directory
+    :param vectors: array of shape (n, dim)
+    :param names: name of every vector
+    :param n_lists: number of IVF lists, 0 for an exact index, see default_lists() if None
+    :param sample: number of vectors per list used to train the centroids
+    :param iterations: number of k-means iterations
+    :param seed: seed of the sampling and of the k-means
+    :param meta: extra entries of the manifest
+    :return: manifest
+    """
+    if len(vectors) != len(names):
+        raise ValueError("%d vectors but %d names" % (len(vectors), len(names)))
+    vectors = normalize(vectors)
+    if n_lists is None:
+        n_lists = default_lists(len(vectors))
+    n_lists = min(n_lists, len(vectors))
+    os.makedirs(directory, exist_ok=True)
+    rows = np.arange(len(vectors))
+    if n_lists > 0:
+        rnd = np.random.RandomState(seed)
+        training = vectors
+        if len(vectors) > sample * n_lists:
+            training = vectors[np.sort(rnd.choice(len(vectors), sample * n_lists,
+                                                  replace=False))]
+        centroids = spherical_kmeans(training, n_lists, iterations, seed)
+        labels = assign(vectors, centroids)
+        rows = np.argsort(labels, kind="stable")
+        lists = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=lists[1:])
+        np.save(os.path.join(directory, "centroids.npy"), centroids)
+        np.save(os.path.join(directory, "lists.npy"), lists)
+        vectors = vectors[rows]
+    np.save(os.path.join(directory, "vectors.npy"), vectors)
+    np.save(os.path.join(directory, "rows.npy"), rows)
+    with open(os.path.join(directory, "names.json"), "w") as f:
+        json.dump(names, f)
+    manifest = dict(meta or {}, size=len(vectors), dim=vectors.shape[1], lists=n_lists)
+    with open(os.path.join(directory, INDEX_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class VectorIndex(object):
+    """
+    Reader of the index written by write_index(). The vectors are memory-mapped by default, so
+    only the lists which are searched are read from disk.
+
+    search() scans the lists of the n_probe centroids closest to every query, or all the vectors
+    if the index has no lists; exact_search() always scans all of them.
+    """
+
+    def __init__(self, directory: str, mmap: bool=True):
+        """
+        :param directory: directory written by write_index()
+        :param mmap: memory-map the arrays instead of reading them
+        """
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_MANIFEST)) as f:
+            self.manifest = json.load(f)
+        mmap_mode = "r" if mmap else None
+
+        def load(name):
+            return np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+
+        self.vectors = load("vectors")
+        self.rows = load("rows")
+        self.centroids = self.lists = None
+        if self.manifest["lists"] > 0:
+            # the centroids are read by every query
+            self.centroids = np.load(os.path.join(directory, "centroids.npy"))
+            self.lists = np.load(os.path.join(directory, "lists.npy"))
+        self._names = None
+        self._positions = None
+
+    def __len__(self) -> int:
+        return self.manifest["size"]
+
+    @property
+    def dim(self) -> int:
+        return self.manifest["dim"]
+
+    @property
+    def names(self) -> List[str]:
+        """
+        Name of every vector in the original order, loaded on first access.
+        """
+        if self._names is None:
+            with open(os.path.join(self.directory, "names.json")) as f:
+                self._names = json.load(f)
+        return self._names
+
+    def vector(self, row: int) -> np.ndarray:
+        """
+        :return: unit vector of the given row in the original order
+        """
+        if self._positions is None:
+            self._positions = np.empty(len(self.rows), dtype=np.int64)
+            self._positions[self.rows] = np.arange(len(self.rows))
+        return np.array(self.vectors[self._positions[row]])
+
+    def search(self, queries: np.ndarray, k: int=10, n_probe: int=8):
+        """
+        :param queries: array of shape (queries, dim) or (dim,)
+        :param k: number of neighbours
+        :param n_probe: number of lists to search per query
+        :return: rows in the original order of the k nearest vectors of every query and their \
+                 cosine similarities, padded with -1 and -inf if less than k vectors were found
+        """
+        queries = normalize(np.atleast_2d(queries))
+        if self.lists is None or n_probe >= len(self.centroids):
+            return self.exact_search(queries, k)
+        positions, scores = ivf_search(self.vectors, self.lists, self.centroids, queries, k,
+                                       n_probe)
+        return np.where(positions >= 0, self.rows[positions], -1), scores
+
+    def exact_search(self, queries: np.ndarray, k: int=10):
+        """
+        Same as search() but scans all the vectors.
+        """
+        queries = normalize(np.atleast_2d(queries))
+        positions, scores = exact_search(self.vectors, queries, k)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        padded = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows[:, :positions.shape[1]] = self.rows[positions]
+        padded[:, :positions.shape[1]] = scores
+        return rows, padded
@@ -0,0 +1,153 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from algorithms.uast_to_bag_paths import Uast2BagOfPaths
+from models.code2vec import Code2Vec
+from models.code2vec_features import Code2VecFeatures
+from training.loader import Corpus, corpus_blocks, corpus_docs, pad_batch
+from training.network import code_vectors
+from transformers.vocabulary2id import OOV
+from utils.metrics import Metrics
+
+
+def sample_contexts(contexts: np.ndarray, max_contexts: int, seed: int=0) -> np.ndarray:
+    """
+    :param contexts: int32 array of shape (number of path contexts, 3)
+    :param max_contexts: maximum number of path contexts to keep
+    :param seed: seed of the sampling
+    :return: sorted distinct path contexts, a sample which only depends on the seed and on the \
+             path contexts if there are more than max_contexts
+    """
+    contexts = np.unique(contexts, axis=0)
+    if len(contexts) > max_contexts:
+        rnd = np.random.RandomState(seed)
+        contexts = contexts[np.sort(rnd.choice(len(contexts), max_contexts, replace=False))]
+    return contexts
+
+
+def document_vectors(model: Code2Vec, corpus: Corpus, batch_size: int=256,
+                     max_contexts: int=200, seed: int=0) -> Tuple[List[str], np.ndarray]:
+    """
+    Computes the code vectors of the documents of a corpus like Code2VecEmbedder does for UASTs.
+    :param model: trained Code2Vec model
+    :param corpus: Code2VecFeatures model or PathContextShards with the IDs of the model, see \
+                   training.loader
+    :param batch_size: number of documents per batch, the documents of every block are sorted \
+                       by size to reduce the padding
+    :param max_contexts: see sample_contexts()
+    :param seed: see sample_contexts()
+    :return: names of the documents with path contexts and float32 array of their code vectors
+    """
+    docs = corpus_docs(corpus)
+    weights = model.weights
+    names, vectors = [], []
+    first = 0
+    for block in corpus_blocks(corpus):
+        offsets, contexts = block()
+        present = np.flatnonzero(offsets[1:] > offsets[:-1])
+        bags = [sample_contexts(contexts[offsets[i]:offsets[i + 1]], max_contexts, seed)
+                for i in present]
+        order = np.argsort([len(bag) for bag in bags], kind="stable")
+        block_vectors = np.empty((len(bags), model.code_dim), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            block_vectors[batch] = code_vectors(weights,
+                                                *pad_batch([bags[i] for i in batch]))[0]
+        names.extend(docs[first + i] for i in present)
+        vectors.append(block_vectors)
+        first += len(offsets) - 1
+    if not vectors:
+        return names, np.empty((0, model.code_dim), dtype=np.float32)
+    return names, np.concatenate(vectors)
+
+
+class Code2VecEmbedder(object):
+    """
+    Computes the code vectors of UASTs with a trained Code2Vec model.
+
+    The vocabularies and the weights are loaded once. The path contexts of a UAST are extracted
+    by the given Uast2BagOfPaths, which must be configured like the extraction of the training
+    features, and mapped to the IDs of the vocabulary: unknown values and paths take the OOV ID
+    if the vocabulary has one, otherwise their path contexts are dropped. contexts() runs on the
+    caller's thread while embed() takes whole batches so that the network runs once per batch.
+    """
+
+    def __init__(self, vocabulary: Code2VecFeatures, model: Code2Vec,
+                 uast2paths: Uast2BagOfPaths, max_contexts: int=200, seed: int=0):
+        """
+        :param vocabulary: Code2VecFeatures model used to train the Code2Vec model, only its \
+                           vocabularies are used
+        :param model: trained Code2Vec model
+        :param uast2paths: extracts the path contexts of the UASTs
+        :param max_contexts: see sample_contexts()
+        :param seed: see sample_contexts()
+        """
+        self.value2index = vocabulary.value2index
+        self.path2index = vocabulary.path2index
+        if len(self.value2index) != len(model.value_embeddings) or \
+                len(self.path2index) != len(model.path_embeddings):
+            raise ValueError("The vocabularies do not match the embeddings of the model: "
+                             "%d values and %d paths against %d and %d" % (
+                                 len(self.value2index), len(self.path2index),
+                                 len(model.value_embeddings), len(model.path_embeddings)))
+        self.model = model
+        self.uast2paths = uast2paths
+        self.max_contexts = max_contexts
+        self.seed = seed
+        self._weights = model.weights
+        self._oov_value = self.value2index.get(OOV)
+        self._oov_path = self.path2index.get((OOV,))
+
+    @property
+    def code_dim(self) -> int:
+        return self.model.code_dim
+
+    def contexts(self, uast, metrics: Metrics=None) -> np.ndarray:
+        """
+        :param uast: UAST root node or serialized UAST, see Uast2BagOfPaths.extract()
+        :param metrics: Metrics where to record the extraction
+        :return: int32 array of shape (number of path contexts, 3) with the (value, path, \
+                 value) IDs of the UAST, see sample_contexts()
+        """
+        value2index, path2index = self.value2index, self.path2index
+        oov_value, oov_path = self._oov_value, self._oov_path
+        path_contexts = self.uast2paths.extract(uast, metrics)
+        ids = []
+        for u, path, v in path_contexts:
+            u, path, v = value2index.get(u, oov_value), path2index.get(path, oov_path), \
+                value2index.get(v, oov_value)
+            if u is not None and path is not None and v is not None:
+                ids.append((u, path, v))
+        if metrics is not None:
+            metrics.count("embed.dropped_contexts", len(path_contexts) - len(ids))
+        return sample_contexts(np.array(ids, dtype=np.int32).reshape(-1, 3), self.max_contexts,
+                               self.seed)
+
+    def embed(self, bags: Sequence[np.ndarray]) -> np.ndarray:
+        """
+        :param bags: path contexts of every UAST, see contexts()
+        :return: float32 array of shape (len(bags), code dim) with the code vectors, zero for \
+                 the UASTs without path contexts
+        """
+        vectors = np.zeros((len(bags), self.code_dim), dtype=np.float32)
+        present = [i for i, bag in enumerate(bags) if len(bag) > 0]
+        if present:
+            vectors[present] = code_vectors(self._weights,
+                                            *pad_batch([bags[i] for i in present]))[0]
+        return vectors
+
+    def predict(self, vectors: np.ndarray, top: int=5) -> List[List[tuple]]:
+        """
+        :param vectors: code vectors, see embed()
+        :param top: number of labels per vector
+        :return: list of the (label, probability) of the most likely labels of every vector
+        """
+        logits = vectors @ self.model.label_embeddings.T
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        best = np.argsort(-probs, axis=1, kind="stable")[:, :top]
+        labels = self.model.labels
+        return [[(labels[i], float(row[i])) for i in indices]
+                for row, indices in zip(probs, best)]
@@ -0,0 +1,293 @@
+import base64
+import binascii
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, TextIO
+
+import numpy as np
+
+from serving.embedder import Code2VecEmbedder
+from utils.metrics import Metrics
+
+
+class LatencyStats(object):
+    """
+    Thread-safe percentiles of the latencies of the last 'window' requests.
+    """
+
+    def __init__(self, window: int=10000):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+            self.count += 1
+
+    def summary(self) -> dict:
+        """
+        :return: dict with the number of requests and the p50, p99 and max latencies in ms
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            count = self.count
+        if len(latencies) == 0:
+            return {"requests": count}
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        return {"requests": count, "p50_ms": float(p50), "p99_ms": float(p99),
+                "max_ms": float(latencies.max() * 1000)}
+
+
+class MicroBatcher(object):
+    """
+    Groups the items submitted concurrently into batches which a single worker thread passes to
+    'func'. A batch is closed when it has max_batch items or max_delay seconds after its first
+    item arrived, so an isolated request waits at most max_delay.
+    """
+
+    def __init__(self, func: Callable[[list], list], max_batch: int=32,
+                 max_delay: float=0.002):
+        """
+        :param func: maps a list of items to the list of their results
+        :param max_batch: maximum number of items per batch
+        :param max_delay: seconds to wait for more items after the first one of a batch
+        """
+        self.func = func
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.metrics = Metrics()
+        self._metrics_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, item) -> Future:
+        """
+        :return: Future of the result of the item
+        """
+        if self._closed:
+            raise RuntimeError("The batcher is closed")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def counters(self) -> dict:
+        """
+        :return: copy of the "batch" counters: batches, items and seconds
+        """
+        with self._metrics_lock:
+            return dict(self.metrics.counters)
+
+    def close(self):
+        """
+        Processes the pending items and stops the worker thread.
+        """
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+    def _run(self):
+        closing = False
+        while not closing:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.perf_counter() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            start = time.perf_counter()
+            try:
+                results = self.func([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            with self._metrics_lock:
+                self.metrics \
+                    .count("batch.batches") \
+                    .count("batch.items", len(batch)) \
+                    .count("batch.seconds", time.perf_counter() - start) \
+                    .observe("batch.size", len(batch))
+
+
+class EmbeddingService(object):
+    """
+    Answers embedding requests: the path contexts are extracted on the thread of the request
+    and the code vectors of concurrent requests are computed together by a MicroBatcher.
+
+    A request is a dict with either "uast", the base64 of a serialized UAST, or "source", the
+    code to parse with Babelfish, with an optional "filename" and "language". The response has
+    the code "vector", the number of path "contexts" and, if "top" is set, the most likely
+    "labels" with their probabilities.
+    """
+
+    def __init__(self, embedder: Code2VecEmbedder, max_batch: int=32, max_delay: float=0.002,
+                 bblfsh_endpoint: str="localhost:9432", latency_window: int=10000):
+        """
+        :param embedder: Code2VecEmbedder which computes the code vectors
+        :param max_batch: see MicroBatcher
+        :param max_delay: see MicroBatcher
+        :param bblfsh_endpoint: address of the Babelfish server to parse the source code
+        :param latency_window: number of recent requests in the latency percentiles
+        """
+        self.embedder = embedder
+        self.batcher = MicroBatcher(embedder.embed, max_batch, max_delay)
+        self.bblfsh_endpoint = bblfsh_endpoint
+        self.latency = LatencyStats(latency_window)
+        self.metrics = Metrics()
+        self._metrics_lock = threading.Lock()
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _parse(self, request: dict):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import bblfsh
+                    self._client = bblfsh.BblfshClient(self.bblfsh_endpoint)
+        response = self._client.parse(request.get("filename", ""),
+                                      language=request.get("language"),
+                                      contents=request["source"])
+        if response.status != 0:
+            raise ValueError("; ".join(response.errors))
+        return response.uast
+
+    def embed(self, request: dict) -> dict:
+        """
+        :param request: see the class docstring
+        :return: response, see the class docstring
+        :raise ValueError: if the request is invalid or its source code cannot be parsed
+        """
+        start = time.perf_counter()
+        if "uast" in request:
+            try:
+                uast = base64.b64decode(request["uast"], validate=True)
+            except binascii.Error as e:
+                raise ValueError("Invalid base64 UAST: %s" % e) from None
+        elif "source" in request:
+            uast = self._parse(request)
+        else:
+            raise ValueError("The request has neither \"uast\" nor \"source\"")
+        metrics = Metrics()
+        contexts = self.embedder.contexts(uast, metrics)
+        vector = self.batcher.submit(contexts).result()
+        response = {"vector": vector.tolist(), "contexts": len(contexts)}
+        if request.get("top"):
+            response["labels"] = self.embedder.predict(vector[None], int(request["top"]))[0]
+        elapsed = time.perf_counter() - start
+        self.latency.record(elapsed)
+        with self._metrics_lock:
+            self.metrics.add(metrics.count("embed.requests").count("embed.seconds", elapsed))
+        return response
+
+    def stats(self) -> dict:
+        """
+        :return: latency percentiles, counters of the requests and of the batches
+        """
+        stats = self.latency.summary()
+        with self._metrics_lock:
+            stats.update(self.metrics.counters)
+        stats.update(self.batcher.counters())
+        if stats.get("batch.batches"):
+            stats["batch.mean_size"] = stats["batch.items"] / stats["batch.batches"]
+        return stats
+
+    def close(self):
+        self.batcher.close()
+
+
+def make_http_server(service: EmbeddingService, host: str="localhost",
+                     port: int=8080) -> ThreadingHTTPServer:
+    """
+    Creates the HTTP server of the service, every connection is handled by its own thread:
+        POST /embed with the JSON request, see EmbeddingService
+        GET /stats with the latency percentiles and the counters
+    """
+    log = logging.getLogger("code2vec-serve")
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # the headers and the body are separate writes, Nagle would delay the body
+        disable_nagle_algorithm = True
+
+        def _reply(self, code: int, body: dict):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._reply(200, service.stats())
+            else:
+                self._reply(404, {"error": "Unknown path %s" % self.path})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path != "/embed":
+                self._reply(404, {"error": "Unknown path %s" % self.path})
+                return
+            try:
+                self._reply(200, service.embed(json.loads(body)))
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": str(e)})
+            except Exception as e:
+                log.exception("Failed to embed a request")
+                self._reply(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            log.debug(format, *args)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def serve_lines(service: EmbeddingService, lines: Iterable[str], output: TextIO,
+                workers: int=8):
+    """
+    Answers the JSON requests of every line with a JSON line in the same order. Up to 'workers'
+    requests are processed concurrently so that they share batches.
+    """
+    pending = queue.Queue(2 * workers)
+
+    def handle(line: str) -> dict:
+        try:
+            return service.embed(json.loads(line))
+        except Exception as e:
+            return {"error": str(e)}
+
+    def write():
+        while True:
+            future = pending.get()
+            if future is None:
+                return
+            output.write(json.dumps(future.result()) + "\n")
+            output.flush()
+
+    writer = threading.Thread(target=write, name="serve-lines-writer", daemon=True)
+    writer.start()
+    with ThreadPoolExecutor(workers) as pool:
+        for line in lines:
+            if line.strip():
+                pending.put(pool.submit(handle, line))
+        pending.put(None)
+        writer.join()
@@ -0,0 +1,209 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Sequence, Union
+
+import numpy as np
+
+from models.code2vec_features import Code2VecFeatures
+from models.path_context_shards import MANIFEST, PathContextShards
+
+Corpus = Union[Code2VecFeatures, PathContextShards]
+
+
+def load_corpus(path: str, mmap: bool=True) -> Corpus:
+    """
+    :param path: Code2VecFeatures model or directory written by extract --sharded
+    :param mmap: memory-map the shards
+    """
+    if os.path.isfile(os.path.join(path, MANIFEST)):
+        return PathContextShards(path, mmap)
+    return Code2VecFeatures().load(path)
+
+
+def corpus_vocabulary(corpus: Corpus) -> Code2VecFeatures:
+    """
+    :return: Code2VecFeatures with the vocabularies of the corpus
+    """
+    return corpus.vocabulary if isinstance(corpus, PathContextShards) else corpus
+
+
+def corpus_docs(corpus: Corpus) -> List[str]:
+    """
+    :return: names of all the documents in the order of corpus_blocks()
+    """
+    if isinstance(corpus, PathContextShards):
+        return [doc for docs, _, _ in corpus.shards() for doc in docs]
+    return corpus.docs
+
+
+def corpus_blocks(corpus: Corpus) -> List[Callable]:
+    """
+    :return: list of functions which return the (doc_offsets, contexts) of every block of \
+             documents: the whole model or every shard
+    """
+    if isinstance(corpus, PathContextShards):
+        return [lambda index=index: corpus.shard(index)[1:] for index in range(corpus.n_shards)]
+    return [lambda: (corpus.doc_offsets, corpus.contexts)]
+
+
+def pad_batch(bags: Sequence[np.ndarray]):
+    """
+    Pads the path contexts of several documents to the size of the largest one.
+    :param bags: int32 arrays of shape (number of path contexts, 3), at least one
+    :return: int32 array (documents, width, 3) and bool mask (documents, width)
+    """
+    width = max(len(bag) for bag in bags)
+    contexts = np.zeros((len(bags), width, 3), dtype=np.int32)
+    mask = np.zeros((len(bags), width), dtype=bool)
+    for row, bag in enumerate(bags):
+        contexts[row, :len(bag)] = bag
+        mask[row, :len(bag)] = True
+    return contexts, mask
+
+
+class BatchLoader(object):
+    """
+    Prepares the padded batches of path contexts of every epoch ahead of time in background
+    threads, so that the training does not wait for them.
+
+    The blocks are visited in random order and the documents of each block in random order too.
+    They go through a shuffle buffer of bounded size which mixes the blocks, so only the buffer
+    and the batches being prepared are held in memory besides the (memory-mapped) blocks. Every
+    window of 'bucket' batches drawn from the buffer is sorted by size and cut into batches,
+    which are padded to their largest document to reduce the padding, and the batches of the
+    window are shuffled. Documents with more than bag_size path contexts are subsampled in every
+    epoch. The batches only depend on the seed and on the epoch, not on the number of workers.
+    """
+
+    def __init__(self, blocks: Sequence[Callable], labels: Sequence[np.ndarray],
+                 batch_size: int=256, bag_size: int=200, shuffle_buffer: int=None,
+                 workers: int=2, prefetch: int=4, bucket: int=64, seed: int=0):
+        """
+        :param blocks: functions which return the (doc_offsets, contexts) of every block, see \
+                       corpus_blocks()
+        :param labels: label IDs of the documents of every block, negative to skip a document
+        :param batch_size: number of documents per batch
+        :param bag_size: maximum number of path contexts per document
+        :param shuffle_buffer: number of documents in the shuffle buffer, unbounded if None
+        :param workers: number of threads which subsample and pad the batches
+        :param prefetch: maximum number of windows of batches prepared in advance
+        :param bucket: number of batches per window which are sorted by size
+        :param seed: seed of the shuffling and of the subsampling
+        """
+        self.blocks = blocks
+        self.labels = labels
+        self.batch_size = batch_size
+        self.bag_size = bag_size
+        self.shuffle_buffer = shuffle_buffer
+        self.workers = workers
+        self.prefetch = prefetch
+        self.bucket = bucket
+        self.seed = seed
+        self._size = sum(len(self._usable(block()[0], block_labels))
+                         for block, block_labels in zip(blocks, labels))
+
+    def __len__(self) -> int:
+        """
+        :return: number of documents with a label and path contexts
+        """
+        return self._size
+
+    @staticmethod
+    def _usable(doc_offsets: np.ndarray, labels: np.ndarray) -> np.ndarray:
+        return np.flatnonzero((labels >= 0) & (doc_offsets[1:] > doc_offsets[:-1]))
+
+    def epoch(self, epoch: int):
+        """
+        :param epoch: number of the epoch, which seeds its shuffling
+        :return: generator of (int32 array (batch size, width, 3), bool mask (batch size, \
+                 width), label IDs), width is at most bag_size
+        """
+        rnd = np.random.RandomState([self.seed, epoch])
+        windows = queue.Queue(self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    windows.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce(pool):
+            try:
+                for window in self._windows(rnd):
+                    if not put(pool.submit(self._batches, window, rnd.randint(1 << 31))):
+                        return
+                put(None)
+            except BaseException as e:
+                put(e)
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            producer = threading.Thread(target=produce, args=(pool,), daemon=True)
+            producer.start()
+            try:
+                while True:
+                    item = windows.get()
+                    if item is None:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    yield from item.result()
+            finally:
+                stop.set()
+                producer.join()
+
+    def _windows(self, rnd: np.random.RandomState):
+        """
+        Streams the documents through the shuffle buffer.
+        :return: generator of lists of (label, contexts) of 'bucket' batches
+        """
+        window_size = self.batch_size * self.bucket
+        buffer, window = [], []
+        for block_index in rnd.permutation(len(self.blocks)):
+            doc_offsets, contexts = self.blocks[block_index]()
+            labels = self.labels[block_index]
+            for doc in rnd.permutation(self._usable(doc_offsets, labels)):
+                buffer.append((labels[doc], contexts[doc_offsets[doc]:doc_offsets[doc + 1]]))
+                if self.shuffle_buffer is None or len(buffer) < self.shuffle_buffer:
+                    continue
+                i = rnd.randint(len(buffer))
+                buffer[i], buffer[-1] = buffer[-1], buffer[i]
+                window.append(buffer.pop())
+                if len(window) == window_size:
+                    yield window
+                    window = []
+        for i in rnd.permutation(len(buffer)):
+            window.append(buffer[i])
+            if len(window) == window_size:
+                yield window
+                window = []
+        if window:
+            yield window
+
+    def _batches(self, window: list, seed: int) -> list:
+        """
+        Sorts a window of documents by size, cuts it into batches and pads them.
+        :return: list of batches, see epoch()
+        """
+        rnd = np.random.RandomState(seed)
+        bag_size = self.bag_size
+        sizes = np.array([min(len(contexts), bag_size) for _, contexts in window])
+        order = np.argsort(sizes, kind="stable")
+        batches = []
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            bags = []
+            for i in batch:
+                contexts = window[i][1]
+                if len(contexts) > bag_size:
+                    picked = rnd.choice(len(contexts), bag_size, replace=False)
+                    contexts = contexts[np.sort(picked)]
+                bags.append(contexts)
+            batches.append(pad_batch(bags) +
+                           (np.array([window[i][0] for i in batch], dtype=np.int64),))
+        return [batches[i] for i in rnd.permutation(len(batches))]
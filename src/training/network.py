@@ -0,0 +1,129 @@
+"""
+Vectorized forward and backward passes of the code2vec attention network over padded batches.
+
+A batch is a (documents, contexts, 3) int32 array of (value, path, value) IDs with a boolean mask
+of the same first two dimensions, the padded contexts are masked out of the attention.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Gradients(NamedTuple):
+    """
+    Gradients of a batch: dense arrays for the small weights and (rows, gradients) pairs for the
+    embeddings, where rows may repeat.
+    """
+    transform: np.ndarray
+    attention: np.ndarray
+    label_embeddings: np.ndarray
+    value_rows: np.ndarray
+    value_grads: np.ndarray
+    path_rows: np.ndarray
+    path_grads: np.ndarray
+
+
+def init_weights(n_values: int, n_paths: int, n_labels: int, value_dim: int, path_dim: int,
+                 code_dim: int, seed: int=0) -> dict:
+    """
+    :return: dict name -> float32 array, see models.code2vec.WEIGHTS
+    """
+    rnd = np.random.RandomState(seed)
+    context_dim = 2 * value_dim + path_dim
+
+    def uniform(shape, fan_in, fan_out):
+        limit = np.sqrt(6 / (fan_in + fan_out))
+        return rnd.uniform(-limit, limit, shape).astype(np.float32)
+
+    return {"value_embeddings": uniform((n_values, value_dim), n_values, value_dim),
+            "path_embeddings": uniform((n_paths, path_dim), n_paths, path_dim),
+            "transform": uniform((context_dim, code_dim), context_dim, code_dim),
+            "attention": uniform((code_dim,), code_dim, 1),
+            "label_embeddings": uniform((n_labels, code_dim), n_labels, code_dim)}
+
+
+def code_vectors(weights: dict, contexts: np.ndarray, mask: np.ndarray):
+    """
+    Forward pass up to the code vectors.
+    :param weights: see init_weights()
+    :param contexts: int32 array of shape (documents, contexts, 3)
+    :param mask: bool array of shape (documents, contexts), False for the padding
+    :return: code vectors (documents, code dim), attention weights (documents, contexts), \
+             context embeddings (documents, contexts, code dim) and the concatenated input \
+             embeddings (documents, contexts, context dim)
+    """
+    values, paths = weights["value_embeddings"], weights["path_embeddings"]
+    inputs = np.concatenate((values[contexts[..., 0]], paths[contexts[..., 1]],
+                             values[contexts[..., 2]]), axis=-1)
+    embeddings = np.tanh(inputs @ weights["transform"])
+    scores = embeddings @ weights["attention"]
+    scores[~mask] = -np.inf
+    scores -= scores.max(axis=1, keepdims=True)
+    alpha = np.exp(scores)
+    alpha /= alpha.sum(axis=1, keepdims=True)
+    vectors = (alpha[:, None, :] @ embeddings)[:, 0]
+    return vectors, alpha, embeddings, inputs
+
+
+def forward_backward(weights: dict, contexts: np.ndarray, mask: np.ndarray, labels: np.ndarray,
+                     scale: float):
+    """
+    Computes the softmax cross entropy of the labels and its gradients.
+    :param weights: see init_weights()
+    :param contexts: int32 array of shape (documents, contexts, 3)
+    :param mask: bool array of shape (documents, contexts), every row has at least one True
+    :param labels: int array with the label ID of every document
+    :param scale: factor of the gradients, e.g. 1 / total batch size when a batch is split
+    :return: sum of the losses, number of correct predictions and Gradients
+    """
+    vectors, alpha, embeddings, inputs = code_vectors(weights, contexts, mask)
+    label_embeddings, attention = weights["label_embeddings"], weights["attention"]
+    logits = vectors @ label_embeddings.T
+    logits -= logits.max(axis=1, keepdims=True)
+    probs = np.exp(logits)
+    probs /= probs.sum(axis=1, keepdims=True)
+    rows = np.arange(len(labels))
+    loss = -np.log(np.maximum(probs[rows, labels], 1e-30)).sum()
+    correct = int((probs.argmax(axis=1) == labels).sum())
+
+    grad_logits = probs
+    grad_logits[rows, labels] -= 1
+    grad_logits *= scale
+    grad_labels = grad_logits.T @ vectors
+    grad_vectors = grad_logits @ label_embeddings
+    # softmax of the attention
+    grad_alpha = (embeddings @ grad_vectors[:, :, None])[..., 0]
+    grad_scores = alpha * (grad_alpha - (alpha * grad_alpha).sum(axis=1, keepdims=True))
+    grad_attention = np.tensordot(grad_scores, embeddings, axes=([0, 1], [0, 1]))
+    grad_embeddings = alpha[..., None] * grad_vectors[:, None, :] + \
+        grad_scores[..., None] * attention
+    # tanh
+    grad_embeddings *= 1 - embeddings * embeddings
+    context_dim = inputs.shape[-1]
+    grad_transform = inputs.reshape(-1, context_dim).T @ \
+        grad_embeddings.reshape(-1, grad_embeddings.shape[-1])
+    grad_inputs = grad_embeddings[mask] @ weights["transform"].T
+    value_dim = weights["value_embeddings"].shape[1]
+    path_end = context_dim - value_dim
+    masked = contexts[mask]
+    return loss, correct, Gradients(
+        transform=grad_transform,
+        attention=grad_attention,
+        label_embeddings=grad_labels,
+        value_rows=np.concatenate((masked[:, 0], masked[:, 2])),
+        value_grads=np.concatenate((grad_inputs[:, :value_dim], grad_inputs[:, path_end:])),
+        path_rows=masked[:, 1],
+        path_grads=grad_inputs[:, value_dim:path_end])
+
+
+def sum_rows(rows: np.ndarray, grads: np.ndarray):
+    """
+    Sums the gradients of the same rows.
+    :return: sorted distinct rows and their summed gradients
+    """
+    if len(rows) == 0:
+        return rows, grads
+    order = np.argsort(rows, kind="stable")
+    rows = rows[order]
+    starts = np.flatnonzero(np.concatenate(([True], rows[1:] != rows[:-1])))
+    return rows[starts], np.add.reduceat(grads[order], starts, axis=0)
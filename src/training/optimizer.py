@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class Adam(object):
+    """
+    Adam optimizer which updates the weights in place. Embeddings are updated lazily: only the
+    rows with gradients and their moments are touched, so a step costs the size of the batch
+    rather than the size of the vocabulary.
+    """
+
+    def __init__(self, learning_rate: float=0.001, beta1: float=0.9, beta2: float=0.999,
+                 epsilon: float=1e-8, state: dict=None):
+        """
+        :param learning_rate: step size
+        :param beta1: decay of the first moments
+        :param beta2: decay of the second moments
+        :param epsilon: added to the square root of the second moments
+        :param state: state() of a previous optimizer to resume from
+        """
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.step = 0
+        self.moments = {}
+        if state is not None:
+            self.step = state["step"]
+            self.moments = dict(state["moments"])
+
+    def state(self) -> dict:
+        """
+        :return: dict with the step and the moments of every weight, "<name>.m" and "<name>.v"
+        """
+        return {"step": self.step, "moments": self.moments}
+
+    def next_step(self):
+        """
+        Starts a new step, must be called once before the updates of every batch.
+        """
+        self.step += 1
+
+    def _moments(self, name: str, weight: np.ndarray):
+        m = self.moments.get(name + ".m")
+        if m is None:
+            m = self.moments[name + ".m"] = np.zeros_like(weight)
+            self.moments[name + ".v"] = np.zeros_like(weight)
+        return m, self.moments[name + ".v"]
+
+    def _rate(self) -> float:
+        return float(self.learning_rate * np.sqrt(1 - self.beta2 ** self.step) /
+                     (1 - self.beta1 ** self.step))
+
+    def update(self, name: str, weight: np.ndarray, grad: np.ndarray):
+        """
+        Dense update of a weight.
+        """
+        m, v = self._moments(name, weight)
+        m *= self.beta1
+        m += (1 - self.beta1) * grad
+        v *= self.beta2
+        v += (1 - self.beta2) * grad * grad
+        weight -= self._rate() * m / (np.sqrt(v) + self.epsilon)
+
+    def update_rows(self, name: str, weight: np.ndarray, rows: np.ndarray, grads: np.ndarray):
+        """
+        Lazy update of the given distinct rows of a weight.
+        """
+        m, v = self._moments(name, weight)
+        row_m = self.beta1 * m[rows] + (1 - self.beta1) * grads
+        row_v = self.beta2 * v[rows] + (1 - self.beta2) * grads * grads
+        m[rows] = row_m
+        v[rows] = row_v
+        weight[rows] -= self._rate() * row_m / (np.sqrt(row_v) + self.epsilon)
@@ -0,0 +1,201 @@
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+
+from models.code2vec import Code2Vec
+from training.loader import BatchLoader, Corpus, corpus_blocks, corpus_docs, corpus_vocabulary
+from training.network import forward_backward, init_weights, sum_rows
+from training.optimizer import Adam
+from utils.metrics import Metrics
+
+# the documents of Moder("func") are named <file path>_<function name>:<line>
+LABEL_PATTERN = r"\.[^./_]*_([^./]+):\d+$"
+CHECKPOINT_PREFIX = "checkpoint-"
+
+
+def extract_labels(docs: List[str], pattern: str=LABEL_PATTERN):
+    """
+    Takes the label of every document from its name.
+    :param docs: document names
+    :param pattern: regular expression whose first group is the label, the documents which \
+                    do not match are skipped
+    :return: indices of the labeled documents, their label IDs and the list of the labels
+    """
+    regexp = re.compile(pattern)
+    label2id = {}
+    indices, label_ids = [], []
+    for i, doc in enumerate(docs):
+        match = regexp.search(doc)
+        if match is None:
+            continue
+        indices.append(i)
+        label_ids.append(label2id.setdefault(match.group(1), len(label2id)))
+    return np.array(indices, dtype=np.int64), np.array(label_ids, dtype=np.int64), \
+        list(label2id)
+
+
+class Code2VecTrainer(object):
+    """
+    Trains the code2vec attention network on the path contexts of a Code2VecFeatures model or
+    of PathContextShards to predict the labels of the documents, see training.network. The
+    batches are prepared in the background by a BatchLoader.
+
+    Every batch is split between 'threads' threads which run the forward and backward passes on
+    their share concurrently, NumPy releases the GIL in the heavy kernels. The gradients are then
+    summed and applied with Adam, so the result does not depend on the number of threads.
+    BLAS should be single-threaded (e.g. OPENBLAS_NUM_THREADS=1) to avoid oversubscription.
+    """
+
+    def __init__(self, corpus: Corpus, label_pattern: str=LABEL_PATTERN,
+                 value_dim: int=128, path_dim: int=128, code_dim: int=None,
+                 batch_size: int=256, max_contexts: int=200, learning_rate: float=0.001,
+                 threads: int=None, seed: int=0, model: Code2Vec=None,
+                 shuffle_buffer: int=None, loader_workers: int=2, prefetch: int=4):
+        """
+        :param corpus: Code2VecFeatures model or PathContextShards, see training.loader
+        :param label_pattern: see extract_labels()
+        :param value_dim: dimension of the value embeddings
+        :param path_dim: dimension of the path embeddings
+        :param code_dim: dimension of the code vectors, 2 * value_dim + path_dim by default
+        :param batch_size: number of documents per batch
+        :param max_contexts: maximum number of path contexts per document, the others are \
+                             subsampled in every epoch
+        :param learning_rate: learning rate of Adam
+        :param threads: number of threads, all the CPUs by default
+        :param seed: seed of the initialization and of the shuffling, which is reseeded in \
+                     every epoch so that resumed runs shuffle like uninterrupted ones
+        :param model: Code2Vec checkpoint to resume from, its labels must be the ones of \
+                      the corpus
+        :param shuffle_buffer: see BatchLoader
+        :param loader_workers: number of threads of the BatchLoader
+        :param prefetch: see BatchLoader
+        """
+        self._log = logging.getLogger("code2vec-train")
+        self.threads = threads or os.cpu_count() or 1
+
+        docs = corpus_docs(corpus)
+        indices, label_ids, label_names = extract_labels(docs, label_pattern)
+        doc_labels = np.full(len(docs), -1, dtype=np.int64)
+        doc_labels[indices] = label_ids
+        blocks = corpus_blocks(corpus)
+        block_ends = np.cumsum([len(block()[0]) - 1 for block in blocks])
+        self.loader = BatchLoader(blocks, np.split(doc_labels, block_ends[:-1]), batch_size,
+                                  max_contexts, shuffle_buffer, loader_workers, prefetch,
+                                  seed=seed)
+        if len(self.loader) == 0:
+            raise ValueError("No document with path contexts matches %s" % label_pattern)
+        self._log.info("%d labeled documents with %d distinct labels, %d skipped",
+                       len(self.loader), len(label_names), len(docs) - len(self.loader))
+
+        if model is None:
+            vocabulary = corpus_vocabulary(corpus)
+            weights = init_weights(
+                len(vocabulary.value_freqs), len(vocabulary.path_freqs), len(label_names),
+                value_dim, path_dim, code_dim or 2 * value_dim + path_dim, seed)
+            model = Code2Vec().construct(labels=label_names, **weights)
+        elif model.labels != label_names:
+            raise ValueError("The labels of the checkpoint do not match the corpus")
+        self.model = model
+        self.optimizer = Adam(learning_rate, state=model.optimizer)
+
+    def train(self, epochs: int, checkpoint_dir: str=None, checkpoint_every: int=1) -> Code2Vec:
+        """
+        Runs the epochs which are left to reach 'epochs'.
+        :param epochs: total number of epochs
+        :param checkpoint_dir: where to save a Code2Vec checkpoint after every \
+                               'checkpoint_every' epochs, disabled if None
+        :param checkpoint_every: number of epochs between the checkpoints
+        :return: the trained Code2Vec model, with the state of the optimizer
+        """
+        with ThreadPoolExecutor(self.threads) as pool:
+            while self.model.epoch < epochs:
+                metrics = self.train_epoch(pool)
+                self.model.epoch += 1
+                counters = metrics.counters
+                self._log.info(
+                    "Epoch %d: loss %.4f, accuracy %.3f, %.1f contexts/s, %.1f documents/s, "
+                    "%.1f%% of the time waiting for the batches",
+                    self.model.epoch, counters["train.loss"] / counters["train.documents"],
+                    counters["train.correct"] / counters["train.documents"],
+                    counters["train.contexts"] / counters["train.seconds"],
+                    counters["train.documents"] / counters["train.seconds"],
+                    100 * counters["train.wait_seconds"] / counters["train.seconds"])
+                if checkpoint_dir is not None and self.model.epoch % checkpoint_every == 0:
+                    self.checkpoint(checkpoint_dir)
+        self.model.optimizer = self.optimizer.state()
+        return self.model
+
+    def train_epoch(self, pool: ThreadPoolExecutor) -> Metrics:
+        """
+        :return: Metrics of the "train" stage: loss, correct, documents, contexts, seconds and \
+                 wait_seconds, the time spent waiting for the loader
+        """
+        metrics = Metrics()
+        start = time.perf_counter()
+        batches = self.loader.epoch(self.model.epoch)
+        while True:
+            wait_start = time.perf_counter()
+            batch = next(batches, None)
+            metrics.count("train.wait_seconds", time.perf_counter() - wait_start)
+            if batch is None:
+                break
+            contexts, mask, labels = batch
+            loss, correct = self.step(pool, contexts, mask, labels)
+            metrics.count("train.loss", loss) \
+                .count("train.correct", correct) \
+                .count("train.documents", len(labels)) \
+                .count("train.contexts", int(mask.sum()))
+        return metrics.count("train.seconds", time.perf_counter() - start)
+
+    def step(self, pool: ThreadPoolExecutor, contexts: np.ndarray, mask: np.ndarray,
+             labels: np.ndarray):
+        """
+        Trains on a single batch.
+        :return: sum of the losses and number of correct predictions
+        """
+        weights = self.model.weights
+        scale = 1 / len(labels)
+        shares = np.array_split(np.arange(len(labels)), min(self.threads, len(labels)))
+        results = list(pool.map(
+            lambda share: forward_backward(weights, contexts[share], mask[share],
+                                           labels[share], scale), shares))
+        grads = [result[2] for result in results]
+        optimizer = self.optimizer
+        optimizer.next_step()
+        for name in ("transform", "attention", "label_embeddings"):
+            optimizer.update(name, weights[name],
+                             sum(getattr(grad, name) for grad in grads))
+        for name, rows, row_grads in (("value_embeddings", "value_rows", "value_grads"),
+                                      ("path_embeddings", "path_rows", "path_grads")):
+            optimizer.update_rows(name, weights[name], *sum_rows(
+                np.concatenate([getattr(grad, rows) for grad in grads]),
+                np.concatenate([getattr(grad, row_grads) for grad in grads])))
+        return sum(result[0] for result in results), sum(result[1] for result in results)
+
+    def checkpoint(self, checkpoint_dir: str) -> str:
+        """
+        Saves the model with the state of the optimizer.
+        :return: path of the checkpoint
+        """
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        path = os.path.join(checkpoint_dir, "%s%04d.asdf" % (CHECKPOINT_PREFIX, self.model.epoch))
+        self.model.optimizer = self.optimizer.state()
+        self.model.save(path)
+        self._log.info("Saved %s", path)
+        return path
+
+
+def latest_checkpoint(checkpoint_dir: str):
+    """
+    :return: path of the checkpoint with the most epochs in the directory or None
+    """
+    if not os.path.isdir(checkpoint_dir):
+        return None
+    names = sorted(name for name in os.listdir(checkpoint_dir)
+                   if name.startswith(CHECKPOINT_PREFIX))
+    return os.path.join(checkpoint_dir, names[-1]) if names else None
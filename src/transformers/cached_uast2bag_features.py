@@ -0,0 +1,227 @@
+import pickle
+import sqlite3
+import time
+from contextlib import contextmanager
+from hashlib import blake2b
+from typing import Iterable
+
+from pyspark import RDD, Row
+from sourced.ml.transformers import Uast2BagFeatures
+from sourced.ml.utils import EngineConstants
+
+from utils.metrics import Metrics
+
+
+class BagsCache(object):
+    """
+    Content-addressed store of the bags extracted from serialized UASTs, backed by a local SQLite
+    database shared by the tasks of an executor. Once the stored bags exceed max_size bytes, the
+    least recently used are evicted.
+
+    No transaction stays open while a task extracts bags, otherwise the other tasks which share
+    the file would wait for it: the connection is in autocommit mode so every bag is written in
+    its own transaction, the reads do not write and the times of use of the hits are buffered
+    and flushed in a single short transaction every FLUSH_EVERY hits. The eviction runs in a
+    short transaction too, every EVICT_EVERY writes and when the cache is closed.
+    """
+    FLUSH_EVERY = 1000
+    EVICT_EVERY = 1000
+
+    def __init__(self, path: str, max_size: int, timeout: float=60):
+        """
+        :param path: path to the SQLite database, it is created if it does not exist
+        :param max_size: maximum size of the stored bags in bytes
+        :param timeout: seconds to wait for the lock of the database held by another task
+        """
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._db = None
+        self._used = {}
+        self._writes = 0
+
+    @staticmethod
+    def key(namespace: str, uast: bytes) -> bytes:
+        """
+        :param namespace: identifies the extraction options, see cache_namespace
+        :param uast: serialized UAST
+        """
+        h = blake2b(namespace.encode(), digest_size=16)
+        h.update(uast)
+        return h.digest()
+
+    def __enter__(self):
+        self._db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS bags (key BLOB PRIMARY KEY, bag BLOB NOT "
+                         "NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS bags_used ON bags (used)")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.flush()
+            self.evict()
+        finally:
+            self._db.close()
+            self._db = None
+
+    def get(self, key: bytes):
+        """
+        :return: the cached bag or None if it is not cached
+        """
+        row = self._db.execute("SELECT bag FROM bags WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._used[key] = time.time()
+        if len(self._used) >= self.FLUSH_EVERY:
+            self.flush()
+        return pickle.loads(row[0])
+
+    def put(self, key: bytes, bag: list):
+        data = pickle.dumps(bag, protocol=pickle.HIGHEST_PROTOCOL)
+        self._db.execute("INSERT OR REPLACE INTO bags VALUES (?, ?, ?, ?)",
+                         (key, data, len(data), time.time()))
+        self._used.pop(key, None)
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self.flush()
+            self.evict()
+
+    def flush(self):
+        """
+        Writes the buffered times of use of the hits.
+        """
+        if not self._used:
+            return
+        with self._transaction():
+            self._db.executemany("UPDATE bags SET used = ? WHERE key = ?",
+                                 [(used, key) for key, used in self._used.items()])
+        self._used.clear()
+
+    def evict(self):
+        """
+        Removes the least recently used bags until the stored ones fit in max_size.
+        """
+        with self._transaction():
+            size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM bags").fetchone()[0]
+            if size <= self.max_size:
+                return
+            evicted = []
+            for key, bag_size in self._db.execute("SELECT key, size FROM bags ORDER BY used"):
+                if size <= self.max_size:
+                    break
+                evicted.append((key,))
+                size -= bag_size
+            self._db.executemany("DELETE FROM bags WHERE key = ?", evicted)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Groups the statements in a transaction which takes the write lock from the start, so
+        that it cannot fail to upgrade a read lock.
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+
+class CachedUast2BagFeatures(Uast2BagFeatures):
+    """
+    Replaces UastDeserializer -> Uast2BagFeatures and caches the bags of every serialized UAST in
+    a BagsCache on each executor. Cache hits are neither deserialized nor extracted again.
+    The extractors must define cache_namespace. The bags are not cached if an extractor defines
+    extract_cacheable() and it tells so, e.g. when a UAST hit the time budget.
+
+    approx_hits and approx_misses count the UASTs found and not found in the cache. They are
+    updated in a transformation, so a partition which Spark computes again (task retries,
+    speculation, RDDs evicted before reuse) is counted again: treat them as approximate.
+    """
+
+    def __init__(self, extractors: Iterable, path: str, max_size: int, sc, metrics=None,
+                 zero_copy: bool=False, **kwargs):
+        """
+        :param extractors: bags extractors to apply
+        :param path: path to the cache on the local filesystem of each executor
+        :param max_size: maximum size of the cache in bytes
+        :param sc: Spark context to create the approximate hit/miss accumulators
+        :param metrics: accumulator of Metrics where to record the "deserialize" stage of the \
+                        cache misses
+        :param zero_copy: pass the serialized UASTs of the cache misses to the extractors \
+                          instead of deserializing them, see FlatTree.from_bytes()
+        """
+        super().__init__(extractors, **kwargs)
+        self.path = path
+        self.max_size = max_size
+        self.metrics = metrics
+        self.zero_copy = zero_copy
+        self.approx_hits = sc.accumulator(0)
+        self.approx_misses = sc.accumulator(0)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        from bblfsh import Node
+        self.parse_uast = Node.FromString
+
+    def __call__(self, rows: RDD):
+        return rows.mapPartitions(self.process_partition)
+
+    def process_partition(self, rows: Iterable[Row]):
+        namespace = ";".join(extractor.cache_namespace for extractor in self.extractors)
+        uast_column = EngineConstants.Columns.Uast
+        with BagsCache(self.path, self.max_size) as cache:
+            for row in rows:
+                doc = row[self.Columns.document]
+                for i, uast in enumerate(row[uast_column] or []):
+                    key = cache.key(namespace, uast)
+                    bag = cache.get(key)
+                    if bag is None:
+                        self.approx_misses.add(1)
+                        if not self.zero_copy:
+                            uast = self._deserialize(uast, doc, i)
+                            if uast is None:
+                                continue
+                        bag, cacheable = self._extract(uast)
+                        if cacheable:
+                            cache.put(key, bag)
+                    else:
+                        self.approx_hits.add(1)
+                    for feature, val in bag:
+                        yield (feature, doc), val
+
+    def _extract(self, uast):
+        """
+        :return: the features of all the extractors and whether they can be cached
+        """
+        bag, cacheable = [], True
+        for extractor in self.extractors:
+            extract_cacheable = getattr(extractor, "extract_cacheable", None)
+            if extract_cacheable is None:
+                bag.extend(extractor.extract(uast))
+                continue
+            features, complete = extract_cacheable(uast)
+            bag.extend(features)
+            cacheable = cacheable and complete
+        return bag, cacheable
+
+    def _deserialize(self, uast: bytes, doc: str, i: int):
+        """
+        :return: the deserialized UAST or None if it is broken
+        """
+        start = time.perf_counter()
+        try:
+            node = self.parse_uast(uast)
+        except:  # noqa
+            self._log.error("\nBabelfish Error: Failed to parse uast for document "
+                            "%s for uast #%s" % (doc, i))
+            return None
+        if self.metrics is not None:
+            self.metrics.add(Metrics()
+                             .count("deserialize.uasts")
+                             .count("deserialize.bytes", len(uast))
+                             .count("deserialize.seconds", time.perf_counter() - start))
+        return node
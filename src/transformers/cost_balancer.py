@@ -0,0 +1,157 @@
+from operator import add
+from typing import Iterable, Sequence
+
+import numpy as np
+from pyspark import RDD, Row, StorageLevel
+from sourced.ml.transformers import Transformer
+from sourced.ml.utils import EngineConstants
+
+from transformers.metered import PartitionTimer
+from utils.metrics import Metrics
+
+
+def uast_cost(uast) -> int:
+    """
+    Estimated cost of the path extraction of a UAST. The number of leaf pairs grows with
+    leaves × max_width and max_width is the same for all the UASTs, so the cost is the size of
+    the serialized UAST, or the number of nodes of a bblfsh.Node, which grow with the leaves.
+    """
+    if isinstance(uast, (bytes, bytearray)):
+        return len(uast)
+    n = 0
+    stack = [uast]
+    while stack:
+        node = stack.pop()
+        n += 1
+        stack.extend(node.children)
+    return n
+
+
+def cost_targets(costs: Sequence[float], offset: float, share: float,
+                 n_partitions: int) -> np.ndarray:
+    """
+    Range partitioning by cost: a document goes to the partition i such that the middle of its
+    cost in the prefix sum of the costs of all the documents falls in [i * share, (i + 1) * share).
+    :param costs: costs of consecutive documents
+    :param offset: total cost of the documents before them
+    :param share: cost per partition, i.e. total cost / n_partitions
+    :param n_partitions: number of partitions
+    :return: partition of every document
+    """
+    costs = np.asarray(costs, dtype=np.float64)
+    middles = offset + np.cumsum(costs) - costs / 2
+    return np.minimum((middles // share).astype(np.int64), n_partitions - 1)
+
+
+def spread(values: Sequence[float]) -> dict:
+    """
+    :return: p50, p99 and max of the values with the ratio of the max to the mean, which is the \
+             slowdown of a stage caused by its slowest partition
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0 or values.sum() == 0:
+        return {"p50": 0.0, "p99": 0.0, "max": 0.0, "max/mean": 1.0}
+    p50, p99 = np.percentile(values, [50, 99])
+    return {"p50": float(p50), "p99": float(p99), "max": float(values.max()),
+            "max/mean": float(values.max() / values.mean())}
+
+
+class CostBalancer(Transformer):
+    """
+    Redistributes the documents so that the partitions have about the same estimated cost of
+    path extraction, see uast_cost(), instead of the same number of documents. Otherwise the
+    partitions which get the largest functions after Moder("func") hold up the whole stage.
+
+    The partitions are consecutive ranges of the prefix sum of the costs, see cost_targets(),
+    so only the sums of the costs of the input partitions go through the driver, and a document
+    which costs more than the share of a partition gets a partition of its own.
+
+    Goes between UastRow2Document (or UastDeduplicator) and the deserialization of the UASTs.
+    The spread of the costs of the partitions before and after is logged and recorded in the
+    "balance" stage of the metrics. The input partitions are never extracted, so only their
+    estimated cost can be compared with the balanced ones; see report() for the measured time of
+    the balanced partitions.
+    """
+
+    def __init__(self, metrics=None, partitions: int=None, **kwargs):
+        """
+        :param metrics: accumulator of Metrics where to record the "balance" stage
+        :param partitions: number of output partitions, the same as the input by default
+        """
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        self.partitions = partitions
+        self.before = self.after = None
+        self._costed = None
+
+    def __call__(self, rows: RDD):
+        # the documents are read three times: for the costs of the input partitions, for the
+        # costs of the output partitions and for the shuffle. The closures must not reference
+        # self, which holds the persisted RDD.
+        row_cost = self.cost
+        self._costed = rows \
+            .map(lambda row: (row_cost(row), row)) \
+            .persist(StorageLevel.MEMORY_AND_DISK)
+        self.before = self._costed \
+            .mapPartitions(lambda pairs: [sum(cost for cost, _ in pairs)]) \
+            .collect()
+        n_partitions = self.partitions or len(self.before)
+        share = max(sum(self.before) / n_partitions, 1)
+        offsets = np.concatenate(([0], np.cumsum(self.before)))
+
+        def assign(index: int, pairs: Iterable[tuple]):
+            position = offsets[index]
+            for cost, row in pairs:
+                yield cost_targets([cost], position, share, n_partitions)[0], (cost, row)
+                position += cost
+
+        assigned = self._costed.mapPartitionsWithIndex(assign)
+        after = dict(assigned.map(lambda pair: (pair[0], pair[1][0])).reduceByKey(add).collect())
+        self.after = [after.get(i, 0) for i in range(n_partitions)]
+        self._log.info("Estimated cost per partition before balancing: %s", spread(self.before))
+        self._log.info("Estimated cost per partition after balancing: %s", spread(self.after))
+        if self.metrics is not None:
+            metrics = Metrics() \
+                .count("balance.partitions_before", len(self.before)) \
+                .count("balance.partitions_after", n_partitions) \
+                .count("balance.cost", sum(self.before)) \
+                .count("balance.max_over_mean_before", spread(self.before)["max/mean"]) \
+                .count("balance.max_over_mean_after", spread(self.after)["max/mean"])
+            for name, costs in (("before", self.before), ("after", self.after)):
+                for cost in costs:
+                    metrics.observe("balance.partition_cost_" + name, cost)
+            self.metrics.add(metrics)
+        return assigned \
+            .partitionBy(n_partitions, lambda partition: partition) \
+            .map(lambda pair: pair[1][1])
+
+    def report(self, timer: PartitionTimer):
+        """
+        Logs and records the spread of the measured time of the balanced partitions, once the
+        pipeline has run, next to the spread of their estimated cost.
+        :param timer: PartitionTimer on the balanced partitions, e.g. around the extraction
+        """
+        if self.after is None:
+            return
+        measured = spread(timer.partition_seconds())
+        self._log.info("Measured seconds per partition after balancing: %s, estimated cost "
+                       "max/mean %.2f before and %.2f after", measured,
+                       spread(self.before)["max/mean"], spread(self.after)["max/mean"])
+        if self.metrics is not None:
+            self.metrics.add(Metrics().count("balance.measured_max_over_mean_after",
+                                             measured["max/mean"]))
+
+    def unpersist(self):
+        """
+        Releases the documents once the pipeline has run.
+        """
+        if self._costed is not None:
+            self._costed.unpersist()
+            self._costed = None
+
+    @staticmethod
+    def cost(row: Row) -> int:
+        """
+        :return: estimated cost of all the UASTs of the document
+        """
+        return sum(uast_cost(uast) for uast in row[EngineConstants.Columns.Uast] or [])
@@ -0,0 +1,132 @@
+import time
+
+from pyspark import AccumulatorParam, RDD, Row
+from pyspark.sql import DataFrame
+from sourced.ml.transformers import Moder, Transformer, UastDeserializer
+from sourced.ml.utils import EngineConstants
+
+from utils.metrics import Metrics
+
+
+class RowMeter(Transformer):
+    """
+    Pass-through stage which counts the rows flowing between two stages of the pipeline.
+    """
+
+    def __init__(self, metrics, name: str, **kwargs):
+        """
+        :param metrics: accumulator of Metrics, see utils.metrics.metrics_accumulator()
+        :param name: counter to increment for every row, e.g. "source.files"
+        """
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        self.name = name
+
+    def __call__(self, rows: RDD):
+        return rows.mapPartitions(self.process_partition)
+
+    def process_partition(self, rows):
+        n = 0
+        for row in rows:
+            n += 1
+            yield row
+        self.metrics.add(Metrics().count(self.name, n))
+
+
+class MeteredModer(Moder):
+    """
+    Moder which counts the files it receives. The engine gives a DataFrame, which Moder turns
+    into an RDD of rows anyway, so the files are counted on that RDD without another conversion.
+    """
+
+    def __init__(self, mode: str, metrics, name: str="source.files", **kwargs):
+        """
+        :param mode: see Moder
+        :param metrics: accumulator of Metrics, see utils.metrics.metrics_accumulator()
+        :param name: counter to increment for every file
+        """
+        super().__init__(mode, **kwargs)
+        self.metrics = metrics
+        self.name = name
+
+    def __call__(self, rows: DataFrame) -> RDD:
+        files = RowMeter(self.metrics, self.name)(rows.rdd)
+        return getattr(self, "call_" + self.mode)(files)
+
+
+class MeteredUastDeserializer(UastDeserializer):
+    """
+    UastDeserializer which records the number of UASTs, their size in bytes and the time spent
+    deserializing them in the "deserialize" stage.
+    """
+
+    def __init__(self, metrics, **kwargs):
+        """
+        :param metrics: accumulator of Metrics, see utils.metrics.metrics_accumulator()
+        """
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    def deserialize_uast(self, row: Row):
+        uasts = row[EngineConstants.Columns.Uast] or []
+        start = time.perf_counter()
+        row = super().deserialize_uast(row)
+        self.metrics.add(Metrics()
+                         .count("deserialize.rows")
+                         .count("deserialize.uasts", len(uasts))
+                         .count("deserialize.bytes", sum(len(uast) for uast in uasts))
+                         .count("deserialize.seconds", time.perf_counter() - start))
+        return row
+
+
+class PartitionSecondsParam(AccumulatorParam):
+    """
+    Accumulates dicts partition index -> seconds. A partition which is computed again replaces
+    its previous time instead of adding to it.
+    """
+
+    def zero(self, value: dict):
+        return {}
+
+    def addInPlace(self, value1: dict, value2: dict):
+        value1.update(value2)
+        return value1
+
+
+class PartitionTimer(Transformer):
+    """
+    Pass-through stage which records the time spent in every partition, from the first row
+    pulled to the last one, i.e. including the stages before it up to the previous shuffle.
+    """
+
+    def __init__(self, metrics, name: str, **kwargs):
+        """
+        :param metrics: accumulator of Metrics, see utils.metrics.metrics_accumulator()
+        :param name: stage of the metrics: "<name>.partitions", "<name>.partition_seconds" \
+                     and the histogram "<name>.partition_ms"
+        """
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        self.name = name
+        self.seconds = None
+
+    def __call__(self, rows: RDD):
+        self.seconds = rows.context.accumulator({}, PartitionSecondsParam())
+        return rows.mapPartitionsWithIndex(self.process_partition)
+
+    def process_partition(self, index: int, rows):
+        start = time.perf_counter()
+        yield from rows
+        elapsed = time.perf_counter() - start
+        self.seconds.add({index: elapsed})
+        self.metrics.add(Metrics()
+                         .count(self.name + ".partitions")
+                         .count(self.name + ".partition_seconds", elapsed)
+                         .observe(self.name + ".partition_ms", int(elapsed * 1000)))
+
+    def partition_seconds(self) -> list:
+        """
+        :return: measured time of every partition, once the pipeline has run
+        """
+        seconds = self.seconds.value if self.seconds is not None else {}
+        return [seconds[i] for i in sorted(seconds)]
@@ -0,0 +1,79 @@
+from typing import Dict, Iterable, List
+
+from pyspark import Row
+from pyspark.sql import DataFrame
+from pyspark.sql.types import ArrayType, BinaryType, StructField, StructType
+from sourced.ml.transformers import Transformer
+from sourced.ml.utils import EngineConstants
+
+from utils.parsing import ParserPool
+
+
+class PooledUastExtractor(Transformer):
+    """
+    Parses the files of the rows with a ParserPool in every partition and sets their serialized
+    UAST in the "uast" column (array<binary>) like the UAST extraction of the engine, so that the
+    DataFrame can be passed to Moder. The files which fail to parse are dropped. The metrics of
+    the pools are added to the "parse" stage, see ParserPool.
+    """
+
+    def __init__(self, endpoint: str, metrics, workers: int=16, max_in_flight: int=None,
+                 timeouts: Dict[str, float]=None, default_timeout: float=60, retries: int=2,
+                 connections: int=1, **kwargs):
+        """
+        :param endpoint: address of the Babelfish server
+        :param metrics: accumulator of Metrics, see utils.metrics.metrics_accumulator()
+        :param workers: number of concurrent requests per partition
+        :param max_in_flight: see ParserPool
+        :param timeouts: dict language -> timeout in seconds
+        :param default_timeout: timeout in seconds of the other languages
+        :param retries: maximum number of retries of a file
+        :param connections: number of gRPC channels per partition
+        """
+        super().__init__(**kwargs)
+        self.endpoint = endpoint
+        self.metrics = metrics
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.timeouts = timeouts
+        self.default_timeout = default_timeout
+        self.retries = retries
+        self.connections = connections
+
+    def __call__(self, files: DataFrame) -> DataFrame:
+        """
+        :param files: DataFrame of the engine or of create_file_source() with the path and the \
+                      content of the files, and their language if it is known
+        :return: DataFrame with the same columns and the "uast" column
+        """
+        columns = EngineConstants.Columns
+        fields = [field for field in files.schema.fields if field.name != columns.Uast]
+        schema = StructType(fields + [StructField(columns.Uast, ArrayType(BinaryType()))])
+        names = [field.name for field in fields]
+        return files.rdd \
+            .mapPartitions(lambda rows: self.parse_partition(rows, names)) \
+            .toDF(schema)
+
+    def parse_partition(self, rows: Iterable[Row], names: List[str]):
+        """
+        :param rows: rows of the files
+        :param names: columns of the rows to keep
+        :return: tuples of the values of the kept columns followed by the list with the \
+                 serialized UAST
+        """
+        columns = EngineConstants.Columns
+        lang = columns.Lang in names
+        with ParserPool(self.endpoint, self.workers, self.max_in_flight, self.timeouts,
+                        self.default_timeout, self.retries,
+                        connections=self.connections) as pool:
+            try:
+                for row, result in pool.parse_all(
+                        rows, lambda row: (row[columns.Path], row[columns.Content],
+                                           row[columns.Lang] if lang else None)):
+                    if result.uast is None:
+                        self._log.warning("Failed to parse %s: %s", row[columns.Path],
+                                          result.error)
+                        continue
+                    yield tuple(row[name] for name in names) + ([result.uast],)
+            finally:
+                self.metrics.add(pool.metrics)
@@ -0,0 +1,113 @@
+import time
+from typing import Iterable
+
+from pyspark import RDD, Row, StorageLevel
+from sourced.ml.transformers import Transformer, Uast2BagFeatures
+from sourced.ml.utils import EngineConstants
+
+from algorithms.uast_fingerprint import uast_fingerprint
+from utils.metrics import Metrics
+
+
+class UastDeduplicator(Transformer):
+    """
+    Keeps a single document of every group of documents with the same UASTs, so that the path
+    contexts of duplicated code (vendored files, forks, generated code) are extracted only once.
+    Documents are compared with uast_fingerprint(), which ignores the positions of the nodes, and
+    the one with the smallest name represents its group.
+
+    Only the fingerprints and the keys of the documents are shuffled to find the representatives,
+    then the rows of the duplicates are dropped where they are, so the UASTs never leave their
+    partition.
+
+    Goes between UastRow2Document and the deserialization of the UASTs. Once the pipeline runs,
+    doc_counts is the RDD of (document, number of documents it stands for).
+    """
+
+    def __init__(self, metrics=None, **kwargs):
+        """
+        :param metrics: accumulator of Metrics where to record the "dedup" stage
+        """
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        self.doc_counts = None
+        self._rows = None
+        self._groups = None
+        self._representatives = None
+
+    def __call__(self, rows: RDD):
+        # the fingerprinted rows are read twice: for the groups and for the extraction
+        self._rows = rows \
+            .mapPartitionsWithIndex(self.fingerprint_partition) \
+            .persist(StorageLevel.MEMORY_AND_DISK)
+        # doc_counts is read after the extraction
+        self._groups = self._rows \
+            .keys() \
+            .mapValues(lambda key: (key, 1)) \
+            .reduceByKey(self._merge_duplicates) \
+            .persist(StorageLevel.MEMORY_AND_DISK)
+        self.doc_counts = self._groups.values().map(lambda group: (group[0][0], group[1]))
+        # the rows of the fingerprints without duplicates are all kept
+        self._representatives = rows.context.broadcast(dict(
+            self._groups
+            .filter(lambda group: group[1][1] > 1)
+            .mapValues(lambda group: group[0])
+            .collect()))
+        return self._rows.mapPartitions(self._unique_partition)
+
+    def __getstate__(self):
+        # the methods run on the executors pickle self, which must not carry the RDDs
+        state = super().__getstate__()
+        state["doc_counts"] = state["_rows"] = state["_groups"] = None
+        return state
+
+    def unpersist(self):
+        """
+        Releases the fingerprinted rows and the groups once the pipeline has run.
+        """
+        for rdd in (self._rows, self._groups):
+            if rdd is not None:
+                rdd.unpersist()
+        self._rows = self._groups = None
+        if self._representatives is not None:
+            self._representatives.destroy()
+            self._representatives = None
+
+    @staticmethod
+    def fingerprint(row: Row) -> bytes:
+        """
+        :return: fingerprint of all the UASTs of the document
+        """
+        return b"".join(uast_fingerprint(uast)
+                        for uast in row[EngineConstants.Columns.Uast] or [])
+
+    def fingerprint_partition(self, index: int, rows: Iterable[Row]):
+        """
+        :return: generator of ((fingerprint, key), row) where key is (document, partition index, \
+                 position in the partition), unique even if several rows have the same name
+        """
+        document = Uast2BagFeatures.Columns.document
+        start = time.perf_counter()
+        n = 0
+        for row in rows:
+            yield (self.fingerprint(row), (row[document], index, n)), row
+            n += 1
+        if self.metrics is not None:
+            self.metrics.add(Metrics()
+                             .count("dedup.documents", n)
+                             .count("dedup.seconds", time.perf_counter() - start))
+
+    @staticmethod
+    def _merge_duplicates(x, y):
+        return min(x[0], y[0]), x[1] + y[1]
+
+    def _unique_partition(self, rows):
+        representatives = self._representatives.value
+        n = 0
+        for (fingerprint, key), row in rows:
+            representative = representatives.get(fingerprint)
+            if representative is None or representative == key:
+                n += 1
+                yield row
+        if self.metrics is not None:
+            self.metrics.add(Metrics().count("dedup.unique", n))
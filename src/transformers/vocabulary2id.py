@@ -1,31 +1,132 @@
 import operator
+import os
+import time
+from array import array
+from collections import Counter
 
-from pyspark import RDD, Row
+import numpy as np
+from pyspark import RDD, StorageLevel
+from pyspark.broadcast import Broadcast
+from algorithms.uast_to_bag_paths import CONTEXT_PREFIX, VALUE_PREFIX, PATH_PREFIX, PATH_SEP, \
+    parse_context_key, parse_table_key
 from models.code2vec_features import Code2VecFeatures
+from models.path_context_shards import VOCABULARY, write_manifest, write_shard
+from utils.metrics import Metrics
 
 from ast import literal_eval as make_tuple
 from sourced.ml.transformers import Transformer
 
 
+OOV = "<OOV>"
+
+
 class Vocabulary2Id(Transformer):
-    def __init__(self, sc, output: str, **kwargs):
+    def __init__(self, sc, output: str, hashed: bool=False, min_count: int=1,
+                 max_vocab_size: int=None, drop_oov: bool=False, sharded: bool=False,
+                 metrics=None, deduplicator=None, count_duplicates: bool=False, **kwargs):
+        """
+        :param sc: Spark context
+        :param output: path where to save the Code2VecFeatures model
+        :param hashed: rows come from UastPathsBagExtractor in hashed mode
+        :param min_count: minimum frequency of the values and paths to keep
+        :param max_vocab_size: maximum number of values and of paths to keep, the most \
+                               frequent ones are kept
+        :param drop_oov: drop the path contexts with pruned values or paths instead of mapping \
+                         them to the OOV id
+        :param sharded: treat output as a directory and write the path contexts of every \
+                        partition to a separate shard, see models.path_context_shards
+        :param metrics: Metrics or accumulator of Metrics where to record the "vocabulary" stage
+        :param deduplicator: UastDeduplicator earlier in the pipeline, the model records how \
+                             many documents each one stands for
+        :param count_duplicates: the frequencies of the values and paths count every duplicate \
+                                 of a document instead of only one, requires deduplicator
+        """
+        if count_duplicates and deduplicator is None:
+            raise ValueError("count_duplicates requires a deduplicator")
         super().__init__(**kwargs)
         self.output = output
         self.sc = sc
+        self.hashed = hashed
+        self.min_count = min_count
+        self.max_vocab_size = max_vocab_size
+        self.drop_oov = drop_oov
+        self.sharded = sharded
+        self.metrics = metrics
+        self.deduplicator = deduplicator
+        self.count_duplicates = count_duplicates
 
     def __call__(self, rows: RDD):
-        value2index, path2index, value2freq, path2freq = self.build_vocabularies(rows)
+        start = time.perf_counter()
+        # the path contexts are read twice, for the vocabulary and to resolve their ids, and
+        # the rows hold the side table in hashed mode: they are persisted so that the UASTs are
+        # not extracted again
+        if self.hashed:
+            rows = rows.persist(StorageLevel.MEMORY_AND_DISK)
+        contexts = self.parse_contexts(rows).persist(StorageLevel.MEMORY_AND_DISK)
+        doc_counts = self.deduplicator.doc_counts if self.deduplicator is not None else None
+        vocabulary = self.build_vocabulary(
+            contexts, rows, doc_counts if self.count_duplicates else None)
+
+        # the driver saves the pruned vocabulary in the model, it is streamed one partition at a
+        # time into the dicts of the model. The path contexts are keyed by the texts in text
+        # mode, so those dicts are broadcast as they are to resolve the ids without another
+        # shuffle; only the hashed mode needs a separate map from the hashes to the ids.
+        value2index, path2index, value2freq, path2freq = {}, {}, {}, {}
+        hash2id = {VALUE_PREFIX: {}, PATH_PREFIX: {}} if self.hashed else None
+        oov = {}
+        for (prefix, key), (text, freq, i) in vocabulary.toLocalIterator():
+            if prefix == PATH_PREFIX:
+                path2index[text], path2freq[text] = i, freq
+            else:
+                value2index[text], value2freq[text] = i, freq
+            if key is None:
+                oov[prefix] = i
+            elif hash2id is not None:
+                hash2id[prefix][key] = i
+        key2id = self.sc.broadcast(hash2id if hash2id is not None else
+                                   {VALUE_PREFIX: value2index, PATH_PREFIX: path2index})
+        del hash2id
+        doc2path_contexts = self.build_doc2pc(
+            key2id, contexts, doc_counts, oov.get(VALUE_PREFIX), oov.get(PATH_PREFIX))
 
-        doc2path_contexts = self.build_doc2pc(value2index, path2index, rows)
+        if self.sharded:
+            output = self.output
+            shards = doc2path_contexts \
+                .mapPartitionsWithIndex(
+                    lambda i, part: [write_shard(output, i, *block) for block in part]) \
+                .collect()
+            write_manifest(output, shards)
+            docs, doc_offsets, contexts_array, doc_counts = self._concatenate([])
+            output = os.path.join(output, VOCABULARY)
+            n_docs = sum(shard["docs"] for shard in shards)
+            n_contexts = sum(shard["contexts"] for shard in shards)
+        else:
+            docs, doc_offsets, contexts_array, doc_counts = \
+                self._concatenate(doc2path_contexts.collect())
+            output = self.output
+            n_docs, n_contexts = len(docs), len(contexts_array)
 
-        doc2path_contexts = doc2path_contexts.collect()
+        key2id.unpersist(blocking=True)
+        contexts.unpersist()
+        if self.hashed:
+            rows.unpersist()
 
         Code2VecFeatures().construct(value2index=value2index,
                                      path2index=path2index,
                                      value2freq=value2freq,
                                      path2freq=path2freq,
-                                     path_contexts=doc2path_contexts).save(
-            self.output)
+                                     docs=docs,
+                                     doc_offsets=doc_offsets,
+                                     contexts=contexts_array,
+                                     doc_counts=doc_counts).save(output)
+
+        if self.metrics is not None:
+            self.metrics.add(Metrics()
+                             .count("vocabulary.values", len(value2index))
+                             .count("vocabulary.paths", len(path2index))
+                             .count("vocabulary.documents", n_docs)
+                             .count("vocabulary.contexts", n_contexts)
+                             .count("vocabulary.seconds", time.perf_counter() - start))
 
     @staticmethod
     def _unstringify_path_context(row):
@@ -35,61 +136,290 @@ class Vocabulary2Id(Transformer):
         """
         return make_tuple(row[0][0][2:])
 
-    def build_vocabularies(self, rows: RDD):
+    def parse_contexts(self, rows: RDD):
         """
-        Process rows to gather values and paths with their frequencies.
+        Parses every row only once.
         :param rows: row structure is ((key, doc), val) where:
             * key: str with the path context
             * doc: file name
             * val: number of occurrences of key in doc
+        :return: RDD of (doc, (u, path, v)) where u, path and v are the texts of the path \
+                 context or their hashes in hashed mode
+        """
+        if self.hashed:
+            return rows \
+                .filter(lambda row: row[0][0][2] == CONTEXT_PREFIX) \
+                .map(lambda row: (row[0][1], parse_context_key(row[0][0][2:])))
+        return rows.map(lambda row: (row[0][1], Vocabulary2Id._unstringify_path_context(row)))
+
+    def build_vocabulary(self, contexts: RDD, rows: RDD, doc_counts: RDD=None):
+        """
+        Gathers values and paths with their frequencies and assigns them ids in a single shuffle,
+        only small aggregates like the number of elements per partition reach the driver.
+        :param contexts: output of parse_contexts()
+        :param rows: the original rows, which hold the side table in hashed mode
+        :param doc_counts: RDD of (doc, multiplicity) to weight the path contexts of every \
+                           document, see UastDeduplicator
+        :return: RDD of ((prefix, key), (text, freq, id)) where prefix is VALUE_PREFIX or \
+                 PATH_PREFIX and key is what parse_contexts() emits for that value or path
+        """
+
+        def _flatten_context(context):
+            (u, path, v), count = context[1]
+            return [((VALUE_PREFIX, u), count), ((PATH_PREFIX, path), count),
+                    ((VALUE_PREFIX, v), count)]
+
+        if doc_counts is not None:
+            weighted = contexts.join(doc_counts)
+        else:
+            weighted = contexts.mapValues(lambda context: (context, 1))
+        freqs = weighted.flatMap(_flatten_context)
+
+        if self.hashed:
+            # the texts from the side table are gathered in the same shuffle as the frequencies
+            def _parse_text(key, text):
+                if key[0] == PATH_PREFIX:
+                    return key, (tuple(text.split(PATH_SEP)), 0)
+                return key, (text, 0)
+
+            def _merge_entries(x, y):
+                return x[0] if x[0] is not None else y[0], x[1] + y[1]
+
+            texts = rows \
+                .filter(lambda row: row[0][0][2] != CONTEXT_PREFIX) \
+                .map(lambda row: _parse_text(*parse_table_key(row[0][0][2:])))
+            vocabulary = freqs \
+                .mapValues(lambda count: (None, count)) \
+                .union(texts) \
+                .reduceByKey(_merge_entries) \
+                .filter(lambda x: x[1][0] is not None and x[1][1] > 0)
+        else:
+            vocabulary = freqs \
+                .reduceByKey(operator.add) \
+                .map(lambda x: (x[0], (x[0][1], x[1])))
+
+        vocabulary, oov = self._prune(vocabulary)
+        if oov:
+            vocabulary = vocabulary.union(self.sc.parallelize(oov, 1))
+
+        return self._index(vocabulary)
+
+    def _prune(self, vocabulary: RDD):
+        """
+        Applies min_count and max_vocab_size to the values and paths separately. The number of
+        elements, their occurrences and their estimated bytes in the model and in the broadcast
+        ids before and after pruning come from a single histogram of the frequencies, they are
+        logged and recorded in the metrics.
+        :param vocabulary: RDD of ((prefix, key), (text, freq))
+        :return: the kept vocabulary and its OOV entries, which sum the frequencies of the \
+                 pruned values and paths unless drop_oov is set
         """
+        if self.min_count <= 1 and self.max_vocab_size is None:
+            return vocabulary, []
 
-        def _flatten_row(row: Row):
-            # 2: removes the namespace v. from the string to parse it as tuple
-            k = Vocabulary2Id._unstringify_path_context(row)
-            return [(k[0], 1), (k[1], 1), (k[2], 1)]
+        hashed = self.hashed
+        # (prefix, freq) -> [number of elements, model bytes, broadcast bytes]
+        histogram = vocabulary \
+            .map(lambda x: ((x[0][0], x[1][1]),
+                            (1,) + Vocabulary2Id._entry_bytes(x[1][0], hashed))) \
+            .reduceByKey(lambda x, y: (x[0] + y[0], x[1] + y[1], x[2] + y[2])) \
+            .collect()
 
-        rows = rows \
-            .flatMap(_flatten_row) \
-            .reduceByKey(operator.add) \
-            .persist()
+        # the least frequent kept frequency and how many elements with it fit
+        min_count = self.min_count
+        cutoffs = {}
+        if self.max_vocab_size is not None:
+            for prefix in (VALUE_PREFIX, PATH_PREFIX):
+                kept = 0
+                for freq, (count, _, _) in sorted(
+                        ((f, c) for (p, f), c in histogram if p == prefix and f >= min_count),
+                        reverse=True):
+                    if kept + count > self.max_vocab_size:
+                        cutoffs[prefix] = (freq, self.max_vocab_size - kept)
+                        break
+                    kept += count
 
-        values = rows.filter(lambda x: type(x[0]) == str).collect()
-        paths = rows.filter(lambda x: type(x[0]) == tuple).collect()
+        if min_count > 1:
+            vocabulary = vocabulary.filter(lambda x: x[1][1] >= min_count)
+        if cutoffs:
+            above = vocabulary.filter(lambda x: x[0][0] not in cutoffs or
+                                      x[1][1] > cutoffs[x[0][0]][0])
+            ties = self._number(vocabulary.filter(lambda x: x[0][0] in cutoffs and
+                                                  x[1][1] == cutoffs[x[0][0]][0])) \
+                .filter(lambda x: x[1] < cutoffs[x[0][0][0]][1]) \
+                .keys()
+            vocabulary = above.union(ties)
 
-        value2index = {w: id for id, (w, _) in enumerate(values)}
-        path2index = {w: id for id, (w, _) in enumerate(paths)}
-        value2freq = {w: freq for _, (w, freq) in enumerate(values)}
-        path2freq = {w: freq for _, (w, freq) in enumerate(paths)}
+        oov = []
+        metrics = Metrics()
+        for prefix, name, text in ((VALUE_PREFIX, "values", OOV), (PATH_PREFIX, "paths", (OOV,))):
+            # number of elements, occurrences, model bytes and broadcast bytes
+            before, after = np.zeros(4), np.zeros(4)
+            for (p, freq), (count, model_bytes, broadcast_bytes) in histogram:
+                if p != prefix:
+                    continue
+                totals = np.array([count, freq * count, model_bytes, broadcast_bytes],
+                                  dtype=float)
+                before += totals
+                if freq < min_count or prefix in cutoffs and freq < cutoffs[prefix][0]:
+                    continue
+                if prefix in cutoffs and freq == cutoffs[prefix][0]:
+                    # the ties are assumed to take the average size
+                    totals *= cutoffs[prefix][1] / count
+                after += totals
+            self._log.info("Kept %d of %d %s (%.1f%%) covering %.1f%% of the occurrences, "
+                           "%.1f of %.1f MB in the model, %.1f of %.1f MB broadcast",
+                           after[0], before[0], name, 100 * after[0] / max(before[0], 1),
+                           100 * after[1] / max(before[1], 1), after[2] / 2 ** 20,
+                           before[2] / 2 ** 20, after[3] / 2 ** 20, before[3] / 2 ** 20)
+            for stat, i in (("model_bytes", 2), ("broadcast_bytes", 3)):
+                metrics.count("vocabulary.%s_%s_before" % (name, stat), int(before[i]))
+                metrics.count("vocabulary.%s_%s_after" % (name, stat), int(after[i]))
+            if not self.drop_oov and after[0] < before[0]:
+                oov.append(((prefix, None), (text, int(before[1] - after[1]))))
+        if self.metrics is not None:
+            self.metrics.add(metrics)
 
-        rows.unpersist()
+        return vocabulary, oov
 
-        return value2index, path2index, value2freq, path2freq
+    @staticmethod
+    def _entry_bytes(text, hashed: bool):
+        """
+        Estimates the size of a value or a path: the saved model stores its UTF-8 text with the
+        length and the int64 frequency, the broadcast maps its key (a hash in hashed mode) to an
+        id.
+        :param text: value or tuple with the tokens of the path
+        :param hashed: the keys are hashes instead of the texts
+        :return: (model bytes, broadcast bytes)
+        """
+        if type(text) == tuple:
+            size = sum(len(token.encode("utf-8")) for token in text) + max(len(text) - 1, 0)
+        else:
+            size = len(text.encode("utf-8"))
+        return size + 4 + 8, (8 if hashed else size) + 4
 
-    def build_doc2pc(self, value2index: dict, path2index: dict, rows: RDD):
+    @staticmethod
+    def _number(rdd: RDD):
         """
-        Process rows and build elements (doc, [path_context_1, path_context_2, ...])
-        :param value2index_freq: value -> id
-        :param path2index_freq: path -> id
+        Same as zipWithIndex() but the values and the paths are numbered independently.
+        Only the number of elements of each kind per partition reaches the driver.
+        :param rdd: RDD of ((prefix, key), ...)
+        :return: RDD of (((prefix, key), ...), number)
         """
+        counts = rdd \
+            .mapPartitions(lambda part: [Counter(x[0][0] for x in part)]) \
+            .collect()
+        offsets, total = [], Counter()
+        for count in counts:
+            offsets.append(dict(total))
+            total.update(count)
+
+        def _assign_numbers(index, part):
+            next_number = dict(offsets[index])
+            for x in part:
+                i = next_number.get(x[0][0], 0)
+                next_number[x[0][0]] = i + 1
+                yield x, i
 
-        bc_value2index = self.sc.broadcast(value2index)
-        bc_path2index = self.sc.broadcast(path2index)
+        return rdd.mapPartitionsWithIndex(_assign_numbers)
 
-        def _doc2pc(row: Row):
-            (u, path, v), doc = Vocabulary2Id._unstringify_path_context(row), row[0][1]
+    @staticmethod
+    def _index(vocabulary: RDD):
+        """
+        Assigns ids to the vocabulary, the values and the paths are numbered independently.
+        """
+        return Vocabulary2Id._number(vocabulary).map(lambda x: (x[0][0], x[0][1] + (x[1],)))
 
-            return doc, (bc_value2index.value[u], bc_path2index.value[path],
-                         bc_value2index.value[v])
+    def build_doc2pc(self, key2id: Broadcast, contexts: RDD, doc_counts: RDD=None,
+                     oov_value: int=None, oov_path: int=None):
+        """
+        Process contexts and build one CSR block (docs, doc_offsets, contexts, doc_counts) per
+        partition:
+            * docs: list of document names
+            * doc_offsets: int64 array, the path contexts of docs[i] are \
+                           contexts[doc_offsets[i]:doc_offsets[i + 1]]
+            * contexts: int32 array of shape (number of path contexts, 3)
+            * doc_counts: int64 array with the multiplicity of docs[i], None without doc_counts
+        The ids are resolved map-side, then the distinct path contexts of every document are
+        grouped in a single shuffle. Pruned values and paths take the OOV id, or their path
+        contexts are dropped if drop_oov is set.
+        :param key2id: broadcast dict prefix -> dict key -> id, where prefix is VALUE_PREFIX or \
+                       PATH_PREFIX and key is what parse_contexts() emits
+        :param contexts: output of parse_contexts()
+        :param doc_counts: RDD of (doc, multiplicity), see UastDeduplicator
+        :param oov_value: id of the pruned values, None to drop their path contexts
+        :param oov_path: id of the pruned paths, None to drop their path contexts
+        """
+        def _resolve(part):
+            values, paths = key2id.value[VALUE_PREFIX], key2id.value[PATH_PREFIX]
+            for doc, (u, path, v) in part:
+                triple = (values.get(u, oov_value), paths.get(path, oov_path),
+                          values.get(v, oov_value))
+                if None not in triple:
+                    yield doc, triple
 
-        rows = rows \
-            .map(_doc2pc) \
-            .distinct() \
-            .combineByKey(lambda value: [value],
-                          lambda x, value: x + [value],
-                          lambda x, y: x + y)
+        def _add(combiner, value):
+            # the multiplicity of the document is an int, summed over the groups with the
+            # same name, the path contexts are triples of ids
+            if isinstance(value, tuple):
+                combiner[0].add(value)
+            else:
+                combiner[1] += value
+            return combiner
 
-        bc_value2index.unpersist(blocking=True)
-        bc_path2index.unpersist(blocking=True)
+        def _merge(x, y):
+            x[0].update(y[0])
+            x[1] += y[1]
+            return x
 
-        return rows
+        resolved = contexts.mapPartitions(_resolve)
+        if doc_counts is not None:
+            resolved = resolved.union(doc_counts)
+        return resolved \
+            .combineByKey(lambda value: _add([set(), 0], value), _add, _merge) \
+            .mapPartitions(self._pack)
+
+    @staticmethod
+    def _pack(part):
+        """
+        Packs the (doc, [{(u, path, v), ...}, multiplicity]) elements of a partition into a CSR
+        block. The multiplicity is 0 if the document is not in doc_counts.
+        """
+        doc2contexts, doc2count = {}, {}
+        for doc, (triples, count) in part:
+            if triples:
+                doc2contexts[doc] = array("i", [i for triple in triples for i in triple])
+                if count:
+                    doc2count[doc] = count
+        if not doc2contexts:
+            return
+        doc_counts = None
+        if doc2count:
+            doc_counts = np.array([doc2count.get(doc, 1) for doc in doc2contexts], dtype=np.int64)
+
+        offsets = np.zeros(len(doc2contexts) + 1, dtype=np.int64)
+        np.cumsum([len(c) // 3 for c in doc2contexts.values()], out=offsets[1:])
+        yield list(doc2contexts), offsets, np.concatenate(
+            [np.frombuffer(c, dtype=np.int32) for c in doc2contexts.values()]).reshape(-1, 3), \
+            doc_counts
+
+    @staticmethod
+    def _concatenate(blocks: list):
+        """
+        Merges the CSR blocks built by build_doc2pc() into a single one.
+        """
+        docs = [doc for block_docs, _, _, _ in blocks for doc in block_docs]
+        offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+        contexts = np.empty((0, 3), dtype=np.int32)
+        doc_counts = None
+        if blocks:
+            np.cumsum(np.concatenate([np.diff(block_offsets)
+                                      for _, block_offsets, _, _ in blocks]),
+                      out=offsets[1:])
+            contexts = np.concatenate([block_contexts for _, _, block_contexts, _ in blocks])
+            if any(block_counts is not None for _, _, _, block_counts in blocks):
+                doc_counts = np.concatenate([
+                    block_counts if block_counts is not None else
+                    np.ones(len(block_docs), dtype=np.int64)
+                    for block_docs, _, _, block_counts in blocks])
+        return docs, offsets, contexts, doc_counts
@@ -0,0 +1,114 @@
+"""
+Stub Babelfish server for developing and benchmarking the parsing without a real deployment.
+
+It speaks the gRPC protocol of Babelfish, so bblfsh.BblfshClient and ParserPool talk to it like
+to the real server. Every line of a file becomes a "Line" node with a "Token" leaf per word.
+The latency of the responses and transient failures can be simulated.
+
+Usage (from src/): python -m utils.bblfsh_stub --port 9432 --latency 0.05
+"""
+import argparse
+import importlib
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import grpc
+from bblfsh.aliases import Node, ParseResponse
+from bblfsh.sdkversion import VERSION
+
+_protocol_grpc = importlib.import_module(
+    "bblfsh.gopkg.in.bblfsh.sdk.%s.protocol.generated_pb2_grpc" % VERSION)
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+def stub_uast(contents: str) -> Node:
+    """
+    :return: UAST with a "Line" node per non-empty line and a "Token" leaf per word
+    """
+    root = Node(internal_type="File")
+    for number, line in enumerate(contents.splitlines(), 1):
+        words = line.split()
+        if not words:
+            continue
+        node = root.children.add()
+        node.internal_type = "Line"
+        node.start_position.line = number
+        for word in words:
+            leaf = node.children.add()
+            leaf.internal_type = "Token"
+            leaf.token = word
+    return root
+
+
+class StubProtocolService(_protocol_grpc.ProtocolServiceServicer):
+    """
+    Parse() sleeps 'latency' seconds (or the one of the language) per request. The first
+    'failures' requests of every file fail with UNAVAILABLE and the files of the languages in
+    'unsupported' get an error response.
+    """
+
+    def __init__(self, latency: float=0.01, language_latency: Dict[str, float]=None,
+                 failures: int=0, unsupported=()):
+        self.latency = latency
+        self.language_latency = language_latency or {}
+        self.failures = failures
+        self.unsupported = set(unsupported)
+        self.requests = Counter()
+        self._lock = threading.Lock()
+
+    def Parse(self, request, context):
+        with self._lock:
+            self.requests[request.filename] += 1
+            attempt = self.requests[request.filename]
+        if attempt <= self.failures:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "stub failure %d" % attempt)
+        time.sleep(self.language_latency.get(request.language, self.latency))
+        if request.language in self.unsupported:
+            return ParseResponse(status=STATUS_ERROR, filename=request.filename,
+                                 errors=["unsupported language %s" % request.language])
+        return ParseResponse(status=STATUS_OK, filename=request.filename,
+                             language=request.language, uast=stub_uast(request.content))
+
+
+def serve_stub(port: int=0, workers: int=64, **kwargs):
+    """
+    Starts a stub server on localhost.
+    :param port: port to listen on, a free one if 0
+    :param workers: number of requests served concurrently
+    :param kwargs: see StubProtocolService
+    :return: started grpc server, its endpoint and the StubProtocolService
+    """
+    server = grpc.server(ThreadPoolExecutor(workers))
+    service = StubProtocolService(**kwargs)
+    _protocol_grpc.add_ProtocolServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("localhost:%d" % port)
+    server.start()
+    return server, "localhost:%d" % port, service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=9432, help="Port to listen on.")
+    parser.add_argument("--workers", type=int, default=64,
+                        help="Number of requests served concurrently.")
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds per request.")
+    parser.add_argument("--failures", type=int, default=0,
+                        help="Number of UNAVAILABLE errors before every file is parsed.")
+    args = parser.parse_args()
+    server, endpoint, _ = serve_stub(args.port, args.workers, latency=args.latency,
+                                     failures=args.failures)
+    print("Listening on %s" % endpoint)
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        server.stop(0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import json
+from collections import defaultdict
+
+from pyspark import AccumulatorParam
+
+
+class Metrics(object):
+    """
+    Counters and histograms of the extraction. Instances are merged with add(), which lets them
+    be the value of a Spark accumulator (see metrics_accumulator()) and gives them the same
+    interface as the accumulator itself, so the code which records metrics works with both.
+
+    Counters are named "<stage>.<counter>", e.g. "extract.leaves". Histograms have power of 2
+    buckets: bucket i counts the observations in [2^(i-1), 2^i), bucket 0 counts the zeros.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.histograms = {}
+
+    def count(self, name: str, value=1):
+        self.counters[name] += value
+        return self
+
+    def observe(self, name: str, value: int):
+        buckets = self.histograms.setdefault(name, [])
+        bucket = int(value).bit_length()
+        if len(buckets) <= bucket:
+            buckets.extend([0] * (bucket + 1 - len(buckets)))
+        buckets[bucket] += 1
+        return self
+
+    def add(self, other: "Metrics"):
+        """
+        Merges other into self.
+        """
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        for name, other_buckets in other.histograms.items():
+            buckets = self.histograms.setdefault(name, [])
+            if len(buckets) < len(other_buckets):
+                buckets.extend([0] * (len(other_buckets) - len(buckets)))
+            for i, count in enumerate(other_buckets):
+                buckets[i] += count
+        return self
+
+    def stages(self) -> dict:
+        """
+        :return: dict stage -> {counter: value}
+        """
+        stages = defaultdict(dict)
+        for name, value in sorted(self.counters.items()):
+            stage, counter = name.split(".", 1)
+            stages[stage][counter] = value
+        return dict(stages)
+
+    @staticmethod
+    def bucket_bounds(i: int):
+        """
+        :return: the interval [low, high) of the i-th histogram bucket
+        """
+        return (0, 1) if i == 0 else (1 << (i - 1), 1 << i)
+
+    def summary(self) -> str:
+        lines = []
+        for stage, counters in self.stages().items():
+            lines.append("%s: %s" % (stage, ", ".join(
+                "%s %s" % (counter, "%.3f" % value if isinstance(value, float) else value)
+                for counter, value in counters.items())))
+        for name, buckets in sorted(self.histograms.items()):
+            lines.append("%s: %s" % (name, ", ".join(
+                "[%d, %d) %d" % (self.bucket_bounds(i) + (count,))
+                for i, count in enumerate(buckets) if count)))
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {"stages": self.stages(),
+                "histograms": {name: [{"low": low, "high": high, "count": count}
+                                      for (low, high), count in
+                                      ((self.bucket_bounds(i), count)
+                                       for i, count in enumerate(buckets))]
+                               for name, buckets in sorted(self.histograms.items())}}
+
+    def dump(self, path: str):
+        """
+        Writes the metrics as JSON.
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class MetricsParam(AccumulatorParam):
+    def zero(self, value: Metrics):
+        return Metrics()
+
+    def addInPlace(self, value1: Metrics, value2: Metrics):
+        return value1.add(value2)
+
+
+def metrics_accumulator(sc):
+    """
+    :param sc: Spark context
+    :return: accumulator of Metrics
+    """
+    return sc.accumulator(Metrics(), MetricsParam())
@@ -0,0 +1,184 @@
+"""
+Concurrent parsing of source files with a Babelfish server.
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import count
+from typing import Callable, Dict, Iterable, NamedTuple
+
+from utils.metrics import Metrics
+
+# gRPC status codes which will not change by retrying the same request
+PERMANENT_CODES = frozenset(("INVALID_ARGUMENT", "NOT_FOUND", "PERMISSION_DENIED",
+                             "UNAUTHENTICATED", "UNIMPLEMENTED"))
+TIMEOUT_CODE = "DEADLINE_EXCEEDED"
+_END = object()
+
+
+class ParseResult(NamedTuple):
+    """
+    Outcome of the parsing of a file: the serialized UAST, or None and the error.
+    """
+    uast: bytes
+    error: str
+    attempts: int
+    seconds: float
+
+
+def bblfsh_client(endpoint: str):
+    import bblfsh
+    return bblfsh.BblfshClient(endpoint)
+
+
+def status_code(error: Exception) -> str:
+    """
+    :return: name of the gRPC status code of the error or the name of its type
+    """
+    code = getattr(error, "code", None)
+    if callable(code):
+        try:
+            return code().name
+        except Exception:
+            pass
+    return type(error).__name__
+
+
+class ParserPool(object):
+    """
+    Parses files with a Babelfish server from a pool of threads, so that many requests are in
+    flight at once over the multiplexed gRPC connections instead of one at a time.
+
+    Every request has the timeout of its language. The requests which fail with a transient
+    gRPC error are retried with exponential backoff, timeouts only if retry_timeouts is set
+    since a file which is too slow to parse usually stays so. Files which the server cannot
+    parse are not retried.
+
+    The "parse" stage of the metrics counts the files, failed, retries, timeouts, bytes (of
+    the sources), uast_bytes, seconds (sum of the latencies) and wall_seconds of parse_all(),
+    with a histogram of the latencies in ms.
+    """
+
+    def __init__(self, endpoint: str="localhost:9432", workers: int=16,
+                 max_in_flight: int=None, timeouts: Dict[str, float]=None,
+                 default_timeout: float=60, retries: int=2, backoff: float=0.5,
+                 retry_timeouts: bool=False, connections: int=1,
+                 client_factory: Callable=bblfsh_client):
+        """
+        :param endpoint: address of the Babelfish server
+        :param workers: number of threads, i.e. of concurrent requests
+        :param max_in_flight: maximum number of files submitted by parse_all() and not \
+                              consumed yet, 2 * workers by default
+        :param timeouts: dict language -> timeout in seconds
+        :param default_timeout: timeout in seconds of the other languages
+        :param retries: maximum number of retries of a file
+        :param backoff: seconds before the first retry, doubled after every retry
+        :param retry_timeouts: also retry the requests which timed out
+        :param connections: number of clients, i.e. of gRPC channels, used in turn
+        :param client_factory: creates a client with the interface of bblfsh.BblfshClient \
+                               from the endpoint
+        """
+        self.workers = workers
+        self.max_in_flight = max_in_flight or 2 * workers
+        self.timeouts = {language.lower(): timeout
+                         for language, timeout in (timeouts or {}).items()}
+        self.default_timeout = default_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_timeouts = retry_timeouts
+        self.metrics = Metrics()
+        self._clients = [client_factory(endpoint) for _ in range(connections)]
+        self._turn = count()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="bblfsh")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def timeout(self, language: str) -> float:
+        return self.timeouts.get((language or "").lower(), self.default_timeout)
+
+    def parse(self, path: str, contents, language: str=None) -> ParseResult:
+        """
+        Parses a single file on the calling thread, with the retries.
+        :param path: path of the file, Babelfish guesses the language from it if not given
+        :param contents: source code, str or UTF-8 bytes
+        :param language: language of the file or None
+        """
+        if isinstance(contents, (bytes, bytearray)):
+            contents = bytes(contents).decode("utf-8", "replace")
+        client = self._clients[next(self._turn) % len(self._clients)]
+        timeout = self.timeout(language)
+        metrics = Metrics().count("parse.files").count("parse.bytes", len(contents))
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = client.parse(path, language=language, contents=contents,
+                                        timeout=timeout)
+            except Exception as e:
+                code = status_code(e)
+                if code == TIMEOUT_CODE:
+                    metrics.count("parse.timeouts")
+                transient = code not in PERMANENT_CODES and \
+                    (code != TIMEOUT_CODE or self.retry_timeouts)
+                if transient and attempt <= self.retries:
+                    metrics.count("parse.retries")
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+                    continue
+                result = ParseResult(None, "%s: %s" % (code, e), attempt,
+                                     time.perf_counter() - start)
+                break
+            if response.status != 0:
+                result = ParseResult(None, "; ".join(response.errors), attempt,
+                                     time.perf_counter() - start)
+            else:
+                uast = response.uast.SerializeToString()
+                metrics.count("parse.uast_bytes", len(uast))
+                result = ParseResult(uast, None, attempt, time.perf_counter() - start)
+            break
+        if result.uast is None:
+            metrics.count("parse.failed")
+        metrics.count("parse.seconds", result.seconds) \
+            .observe("parse.latency_ms", int(result.seconds * 1000))
+        with self._lock:
+            self.metrics.add(metrics)
+        return result
+
+    def parse_all(self, items: Iterable, request: Callable=lambda item: item):
+        """
+        Parses the files concurrently. The items are pulled lazily and at most max_in_flight of
+        them are pending, so a slow consumer holds back the reading of the input.
+        :param items: iterable of items to parse
+        :param request: maps an item to the (path, contents, language) arguments of parse()
+        :return: generator of (item, ParseResult) in the order of completion
+        """
+        start = time.perf_counter()
+        pending = {}
+        items = iter(items)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.max_in_flight:
+                    item = next(items, _END)
+                    if item is _END:
+                        exhausted = True
+                        break
+                    pending[self._executor.submit(self.parse, *request(item))] = item
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            with self._lock:
+                self.metrics.count("parse.wall_seconds", time.perf_counter() - start)
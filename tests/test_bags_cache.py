@@ -0,0 +1,164 @@
+import os
+import pickle
+import tempfile
+import threading
+import time
+import unittest
+
+from extractors.paths import UastPathsBagExtractor
+from transformers.cached_uast2bag_features import BagsCache, CachedUast2BagFeatures
+from trees import random_uast
+
+
+class Counter(object):
+    """
+    Stands for the accumulators of the SparkContext on the driver.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def add(self, term):
+        self.value += term
+
+
+class Context(object):
+    @staticmethod
+    def accumulator(value):
+        return Counter(value)
+
+
+class BagsCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory(prefix="test_bags_cache")
+        self.path = os.path.join(self.dir.name, "bags.sqlite")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def keys(self, cache: BagsCache) -> set:
+        return {key for key, in cache._db.execute("SELECT key FROM bags")}
+
+    def test_get_put(self):
+        with BagsCache(self.path, 1 << 20) as cache:
+            key = cache.key("ns", b"uast")
+            self.assertIsNone(cache.get(key))
+            cache.put(key, [("a", 1), ("b", 2)])
+            self.assertEqual(cache.get(key), [("a", 1), ("b", 2)])
+            self.assertIsNone(cache.get(cache.key("other", b"uast")))
+        with BagsCache(self.path, 1 << 20) as cache:
+            self.assertEqual(cache.get(key), [("a", 1), ("b", 2)])
+
+    def test_eviction(self):
+        bag = [("x" * 100, 1)]
+        size = len(pickle.dumps(bag, protocol=pickle.HIGHEST_PROTOCOL))
+        with BagsCache(self.path, 3 * size) as cache:
+            cache.EVICT_EVERY = 1
+            for key in (b"a", b"b", b"c"):
+                cache.put(key, bag)
+                time.sleep(0.01)
+            # "a" becomes the most recently used
+            self.assertEqual(cache.get(b"a"), bag)
+            cache.flush()
+            time.sleep(0.01)
+            cache.put(b"d", bag)
+            self.assertEqual(self.keys(cache), {b"a", b"c", b"d"})
+            cache.put(b"e", bag)
+            self.assertEqual(self.keys(cache), {b"a", b"d", b"e"})
+
+    def test_eviction_on_exit(self):
+        size = len(pickle.dumps([("x" * 100, 0)], protocol=pickle.HIGHEST_PROTOCOL))
+        with BagsCache(self.path, 2 * size) as cache:
+            for i in range(10):
+                cache.put(bytes([i]), [("x" * 100, i)])
+                time.sleep(0.01)
+            self.assertEqual(len(self.keys(cache)), 10)
+        with BagsCache(self.path, 1 << 20) as cache:
+            self.assertEqual(self.keys(cache), {bytes([8]), bytes([9])})
+
+    def test_gets_do_not_write(self):
+        with BagsCache(self.path, 1 << 20) as cache:
+            cache.put(b"a", [("a", 1)])
+        with BagsCache(self.path, 1 << 20, timeout=0.1) as reader, \
+                BagsCache(self.path, 1 << 20, timeout=0.1) as writer:
+            self.assertEqual(reader.get(b"a"), [("a", 1)])
+            # the reader does not hold the write lock after a hit
+            writer.put(b"b", [("b", 2)])
+            self.assertEqual(reader.get(b"b"), [("b", 2)])
+            reader.flush()
+            writer.put(b"c", [("c", 3)])
+
+    def test_threads(self):
+        errors = []
+        started = threading.Event()
+
+        def slow_task():
+            try:
+                with BagsCache(self.path, 1 << 20, timeout=1) as cache:
+                    cache.put(b"slow1", [("a", 1)])
+                    self.assertEqual(cache.get(b"slow1"), [("a", 1)])
+                    started.set()
+                    # a long extraction which must not block the other task
+                    time.sleep(2)
+                    cache.put(b"slow2", [("b", 2)])
+            except Exception as e:
+                errors.append(e)
+                started.set()
+
+        def fast_task():
+            try:
+                started.wait()
+                with BagsCache(self.path, 1 << 20, timeout=1) as cache:
+                    for i in range(20):
+                        cache.put(bytes([i]), [("c", i)])
+                        self.assertEqual(cache.get(bytes([i])), [("c", i)])
+                    self.assertEqual(cache.get(b"slow1"), [("a", 1)])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=slow_task), threading.Thread(target=fast_task)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        with BagsCache(self.path, 1 << 20) as cache:
+            self.assertEqual(len(self.keys(cache)), 22)
+
+
+class CachedUast2BagFeaturesTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory(prefix="test_bags_cache")
+        self.path = os.path.join(self.dir.name, "bags.sqlite")
+        self.rows = [{"document": "repo//f%d.py@%d" % (i, i),
+                      "uast": [random_uast(i, 50).SerializeToString()]}
+                     for i in range(3)]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def extract(self, extractor: UastPathsBagExtractor):
+        features = CachedUast2BagFeatures([extractor], self.path, 1 << 20, Context(),
+                                          zero_copy=True)
+        bags = sorted(features.process_partition(self.rows))
+        return bags, features.approx_hits.value, features.approx_misses.value
+
+    def test_hits_misses(self):
+        bags, hits, misses = self.extract(UastPathsBagExtractor(4, 3))
+        self.assertEqual((hits, misses), (0, 3))
+        expected = sorted((("v." + key, row["document"]), val)
+                          for row in self.rows for key, val in
+                          UastPathsBagExtractor(4, 3).uast2paths(row["uast"][0]).items())
+        self.assertEqual(bags, expected)
+        self.assertEqual(self.extract(UastPathsBagExtractor(4, 3)), (expected, 3, 0))
+
+    def test_namespace(self):
+        self.extract(UastPathsBagExtractor(4, 3))
+        bags, hits, misses = self.extract(UastPathsBagExtractor(5, 3))
+        self.assertEqual((hits, misses), (0, 3))
+        self.assertEqual(self.extract(UastPathsBagExtractor(5, 3)), (bags, 3, 0))
+        self.assertNotEqual(bags, self.extract(UastPathsBagExtractor(4, 3))[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+
+import numpy as np
+
+from training.loader import BatchLoader, pad_batch
+
+
+def corpus(seed: int=0, n_blocks: int=4, n_docs: int=30):
+    """
+    :return: blocks and labels for BatchLoader. The label of a document is its global number, \
+             which is also the first ID of all its path contexts; some documents are skipped or \
+             have no path contexts, some have more than 20.
+    """
+    rnd = np.random.RandomState(seed)
+    blocks, labels = [], []
+    doc = 0
+    for _ in range(n_blocks):
+        sizes = rnd.randint(0, 30, n_docs)
+        doc_offsets = np.zeros(n_docs + 1, dtype=np.int64)
+        np.cumsum(sizes, out=doc_offsets[1:])
+        contexts = rnd.randint(0, 1000, (doc_offsets[-1], 3)).astype(np.int32)
+        contexts[:, 1] = np.arange(len(contexts))
+        block_labels = np.arange(doc, doc + n_docs)
+        contexts[:, 0] = np.repeat(block_labels, sizes)
+        block_labels[rnd.rand(n_docs) < 0.1] = -1
+        blocks.append(lambda doc_offsets=doc_offsets, contexts=contexts: (doc_offsets, contexts))
+        labels.append(block_labels)
+        doc += n_docs
+    return blocks, labels
+
+
+def batches(loader: BatchLoader, epoch: int=0) -> list:
+    return [(contexts.tolist(), mask.tolist(), labels.tolist())
+            for contexts, mask, labels in loader.epoch(epoch)]
+
+
+class BatchLoaderTests(unittest.TestCase):
+    def setUp(self):
+        self.blocks, self.labels = corpus()
+        self.usable = {}
+        for block, labels in zip(self.blocks, self.labels):
+            doc_offsets, contexts = block()
+            for doc, label in enumerate(labels):
+                if label >= 0 and doc_offsets[doc + 1] > doc_offsets[doc]:
+                    self.usable[label] = contexts[doc_offsets[doc]:doc_offsets[doc + 1]]
+
+    def loader(self, **kwargs) -> BatchLoader:
+        params = dict(batch_size=8, bag_size=20, shuffle_buffer=25, bucket=3, seed=1)
+        params.update(kwargs)
+        return BatchLoader(self.blocks, self.labels, **params)
+
+    def test_len(self):
+        self.assertEqual(len(self.loader()), len(self.usable))
+
+    def test_workers(self):
+        expected = batches(self.loader(workers=1, prefetch=1))
+        for workers, prefetch in ((2, 4), (4, 1), (8, 16)):
+            self.assertEqual(batches(self.loader(workers=workers, prefetch=prefetch)), expected,
+                             (workers, prefetch))
+
+    def test_epochs(self):
+        loader = self.loader(workers=3)
+        first = batches(loader, 0)
+        self.assertEqual(batches(loader, 0), first)
+        self.assertNotEqual(batches(loader, 1), first)
+        self.assertNotEqual(batches(self.loader(seed=2), 0), first)
+
+    def test_every_document_once(self):
+        for shuffle_buffer in (None, 1, 25, 1000):
+            labels = [label for _, _, batch_labels in batches(
+                self.loader(shuffle_buffer=shuffle_buffer)) for label in batch_labels]
+            self.assertEqual(sorted(labels), sorted(self.usable), shuffle_buffer)
+
+    def test_batches(self):
+        n_batches = 0
+        for contexts, mask, labels in self.loader(workers=2).epoch(0):
+            n_batches += 1
+            self.assertEqual(contexts.dtype, np.int32)
+            self.assertEqual(labels.dtype, np.int64)
+            self.assertLessEqual(len(labels), 8)
+            self.assertLessEqual(contexts.shape[1], 20)
+            self.assertEqual(contexts.shape[:2], mask.shape)
+            for row, label in enumerate(labels):
+                bag = contexts[row][mask[row]]
+                self.assertFalse(contexts[row][~mask[row]].any())
+                original = self.usable[label]
+                self.assertEqual(len(bag), min(len(original), 20))
+                # subsampled path contexts keep their order
+                self.assertTrue((bag[:, 0] == label).all())
+                self.assertTrue((np.diff(bag[:, 1]) > 0).all())
+                self.assertTrue(np.isin(bag[:, 1], original[:, 1]).all())
+        self.assertGreaterEqual(n_batches, len(self.usable) // 8)
+
+    def test_subsampling_changes(self):
+        loader = self.loader(shuffle_buffer=None)
+
+        def bags(epoch):
+            result = {}
+            for contexts, mask, labels in loader.epoch(epoch):
+                for row, label in enumerate(labels):
+                    result[label] = contexts[row][mask[row]][:, 1].tolist()
+            return result
+
+        first, second = bags(0), bags(1)
+        large = [label for label, contexts in self.usable.items() if len(contexts) > 20]
+        self.assertTrue(large)
+        self.assertTrue(any(first[label] != second[label] for label in large))
+
+    def test_early_exit(self):
+        loader = self.loader(workers=2, prefetch=1, batch_size=2, bucket=1)
+        for i, _ in enumerate(loader.epoch(0)):
+            if i == 2:
+                break
+        # the producer stopped, another epoch runs normally
+        self.assertEqual(batches(loader, 0), batches(self.loader(
+            workers=1, prefetch=1, batch_size=2, bucket=1), 0))
+
+    def test_error(self):
+        calls = []
+        block = self.blocks[1]
+
+        def broken():
+            # the first call counts the documents in the constructor
+            calls.append(1)
+            if len(calls) > 1:
+                raise OSError("cannot read the shard")
+            return block()
+
+        self.blocks[1] = broken
+        with self.assertRaises(OSError):
+            batches(self.loader(workers=2))
+
+
+class PadBatchTests(unittest.TestCase):
+    def test_pad(self):
+        bags = [np.ones((2, 3), dtype=np.int32), np.full((4, 3), 2, dtype=np.int32)]
+        contexts, mask = pad_batch(bags)
+        self.assertEqual(contexts.shape, (2, 4, 3))
+        self.assertEqual(mask.tolist(), [[True, True, False, False], [True] * 4])
+        self.assertEqual(contexts[0].tolist(), [[1] * 3] * 2 + [[0] * 3] * 2)
+        self.assertEqual(contexts[1].tolist(), [[2] * 3] * 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from models.code2vec_features import Code2VecFeatures
+from transformers.vocabulary2id import Vocabulary2Id
+
+PATH_CONTEXTS = [("a", [(0, 0, 1), (1, 1, 2)]), ("b", [(2, 0, 2)]), ("c", []),
+                 ("é", [(0, 1, 0), (2, 1, 1), (1, 0, 0)])]
+
+
+def model(**kwargs) -> Code2VecFeatures:
+    return Code2VecFeatures().construct(
+        value2index={"x": 0, "y": 1, "z": 2}, path2index={("A",): 0, ("B", "C"): 1},
+        value2freq={"x": 4, "y": 4, "z": 4}, path2freq={("A",): 3, ("B", "C"): 4}, **kwargs)
+
+
+class CsrTests(unittest.TestCase):
+    def test_from_path_contexts(self):
+        features = model(path_contexts=PATH_CONTEXTS)
+        self.assertEqual(features.docs, ["a", "b", "c", "é"])
+        self.assertEqual(features.doc_offsets.tolist(), [0, 2, 3, 3, 6])
+        self.assertEqual(features.doc_offsets.dtype, np.int64)
+        self.assertEqual(features.contexts.dtype, np.int32)
+        self.assertEqual(features.contexts.tolist(),
+                         [list(pc) for _, pcs in PATH_CONTEXTS for pc in pcs])
+        self.assertEqual(features.doc_counts.tolist(), [1, 1, 1, 1])
+
+    def test_to_path_contexts(self):
+        source = model(path_contexts=PATH_CONTEXTS)
+        features = model(docs=source.docs, doc_offsets=source.doc_offsets,
+                         contexts=source.contexts)
+        self.assertEqual(features.path_contexts, PATH_CONTEXTS)
+
+    def test_empty(self):
+        features = model(path_contexts=[])
+        self.assertEqual(features.doc_offsets.tolist(), [0])
+        self.assertEqual(features.contexts.shape, (0, 3))
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory(prefix="test_code2vec_features") as tmpdir:
+            path = os.path.join(tmpdir, "features.asdf")
+            model(path_contexts=PATH_CONTEXTS, doc_counts=np.array([1, 3, 1, 2])).save(path)
+            features = Code2VecFeatures().load(path)
+            self.assertEqual(features.path_contexts, PATH_CONTEXTS)
+            self.assertEqual(features.doc_counts.tolist(), [1, 3, 1, 2])
+            self.assertEqual(features.index2path, [("A",), ("B", "C")])
+            self.assertEqual(features.value2freq, {"x": 4, "y": 4, "z": 4})
+
+
+class PackTests(unittest.TestCase):
+    def test_pack(self):
+        part = [("a", [{(0, 0, 1), (1, 1, 2)}, 0]), ("b", [set(), 3]), ("c", [{(2, 0, 2)}, 0])]
+        (docs, offsets, contexts, counts), = Vocabulary2Id._pack(iter(part))
+        # documents without path contexts are dropped
+        self.assertEqual(docs, ["a", "c"])
+        self.assertEqual(offsets.tolist(), [0, 2, 3])
+        self.assertEqual(contexts.dtype, np.int32)
+        self.assertEqual(sorted(map(tuple, contexts[:2].tolist())), [(0, 0, 1), (1, 1, 2)])
+        self.assertEqual(contexts[2:].tolist(), [[2, 0, 2]])
+        self.assertIsNone(counts)
+
+    def test_pack_counts(self):
+        part = [("a", [{(0, 0, 1)}, 2]), ("c", [{(2, 0, 2)}, 0])]
+        (_, _, _, counts), = Vocabulary2Id._pack(iter(part))
+        # the documents which are not in doc_counts stand for themselves
+        self.assertEqual(counts.tolist(), [2, 1])
+
+    def test_pack_empty(self):
+        self.assertEqual(list(Vocabulary2Id._pack(iter([("a", [set(), 2])]))), [])
+
+    def test_concatenate(self):
+        blocks = [(["a"], np.array([0, 2]), np.arange(6, dtype=np.int32).reshape(-1, 3), None),
+                  (["b", "c"], np.array([0, 1, 3]),
+                   np.arange(6, 15, dtype=np.int32).reshape(-1, 3), np.array([4, 1]))]
+        docs, offsets, contexts, counts = Vocabulary2Id._concatenate(blocks)
+        self.assertEqual(docs, ["a", "b", "c"])
+        self.assertEqual(offsets.tolist(), [0, 2, 3, 5])
+        self.assertEqual(contexts.tolist(), np.arange(15).reshape(-1, 3).tolist())
+        self.assertEqual(counts.tolist(), [1, 4, 1])
+        docs, offsets, contexts, counts = Vocabulary2Id._concatenate(blocks[:1])
+        self.assertIsNone(counts)
+        docs, offsets, contexts, counts = Vocabulary2Id._concatenate([])
+        self.assertEqual((docs, offsets.tolist(), contexts.shape), ([], [0], (0, 3)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from transformers.cost_balancer import cost_targets, spread
+
+
+def split(partitions: list, n_partitions: int) -> list:
+    """
+    Assigns the documents of the input partitions like CostBalancer: every input partition
+    starts at the sum of the costs of the previous ones.
+    :return: output partition of every document, for each input partition
+    """
+    sums = [sum(costs) for costs in partitions]
+    share = max(sum(sums) / n_partitions, 1)
+    offsets = np.concatenate(([0], np.cumsum(sums)))
+    return [list(cost_targets(costs, offset, share, n_partitions))
+            for costs, offset in zip(partitions, offsets)]
+
+
+class CostTargetsTests(unittest.TestCase):
+    def test_uniform(self):
+        self.assertEqual(list(cost_targets([1] * 8, 0, 2, 4)), [0, 0, 1, 1, 2, 2, 3, 3])
+
+    def test_offset(self):
+        self.assertEqual(list(cost_targets([1, 1], 4, 2, 4)), [2, 2])
+        # the rounding of the prefix sum never goes past the last partition
+        self.assertEqual(list(cost_targets([1, 1], 8, 2, 4)), [3, 3])
+
+    def test_input_partitions(self):
+        costs = [3, 1, 2, 2, 4, 1, 3]
+        whole = split([costs], 4)[0]
+        self.assertEqual(sum(split([costs[:2], costs[2:5], costs[5:]], 4), []), whole)
+        self.assertEqual(whole, sorted(whole))
+        totals = np.bincount(whole, weights=costs, minlength=4)
+        self.assertLessEqual(totals.max(), 2 * totals.mean())
+
+    def test_empty_partition(self):
+        self.assertEqual(list(cost_targets([], 10, 2, 4)), [])
+        self.assertEqual(split([[1, 1], [], [1, 1], []], 2), [[0, 0], [], [1, 1], []])
+
+    def test_huge_document(self):
+        targets = split([[1, 1], [100], [1, 1]], 4)
+        self.assertEqual(targets, [[0, 0], [2], [3, 3]])
+        # the huge document gets a partition of its own, the next one is left empty
+        self.assertNotIn(1, sum(targets, []))
+
+    def test_zero_costs(self):
+        self.assertEqual(split([[0, 0], [0]], 3), [[0, 0], [0]])
+
+
+class SpreadTests(unittest.TestCase):
+    def test_spread(self):
+        result = spread([1, 1, 1, 5])
+        self.assertEqual(result["max"], 5)
+        self.assertEqual(result["p50"], 1)
+        self.assertAlmostEqual(result["max/mean"], 2.5)
+
+    def test_empty(self):
+        self.assertEqual(spread([])["max/mean"], 1.0)
+        self.assertEqual(spread([0, 0])["max/mean"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import json
+import unittest
+
+import bblfsh
+
+from algorithms.structures.extended_node import ExtNode
+from trees import random_uast
+
+
+def chain(depth: int) -> bblfsh.Node:
+    """
+    :return: tree where every node but the leaf has a single child
+    """
+    root = node = bblfsh.Node(internal_type="File")
+    for i in range(depth):
+        node = node.children.add(internal_type="Block", token="t%d" % i)
+    return root
+
+
+class ToJsonTests(unittest.TestCase):
+    def test_same_as_json_dumps(self):
+        for seed in range(5):
+            tree, _ = ExtNode.extend_tree(random_uast(seed, n_nodes=30))
+            self.assertEqual(tree.to_json(),
+                             json.dumps(tree._as_dict(), indent=4, separators=(',', ': ')))
+            self.assertEqual(tree.to_json(indent=None), json.dumps(tree._as_dict()))
+            self.assertEqual(str(tree), tree.to_json())
+
+    def test_leaf(self):
+        node = ExtNode(bblfsh.Node(internal_type="Name", token="x"), 3, 0)
+        self.assertEqual(json.loads(node.to_json()),
+                         {"token": "x", "internal_type": "Name", "depth": 3, "numeration": 0})
+
+    def test_deep_tree(self):
+        depth = 20000
+        tree, leaves = ExtNode.extend_tree(chain(depth))
+        self.assertEqual(len(leaves), 1)
+        # the indented JSON of a chain grows with the square of the depth
+        text = tree.to_json(indent=None)
+        self.assertEqual(text.count('"children": ['), depth)
+        self.assertTrue(text.endswith("]}" * depth))
+        self.assertIn('{"token": "t%d", "internal_type": "Block", "depth": %d, "numeration": 0}'
+                      % (depth - 1, depth), text)
+
+    def test_repr(self):
+        tree, leaves = ExtNode.extend_tree(chain(20000))
+        self.assertEqual(repr(tree), "ExtNode(token='', internal_type='File', depth=0, "
+                                     "numeration=-1, children=1)")
+        self.assertEqual(repr(leaves[0]), "ExtNode(token='t19999', internal_type='Block', "
+                                          "depth=20000, numeration=0, children=0)")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import time
+import unittest
+
+import bblfsh
+import numpy as np
+
+from algorithms.path_contexts import get_pairs, node_to_internal_type, node_to_roles, \
+    to_path_contexts_multi
+from algorithms.structures.flat_tree import FlatTree
+from algorithms.uast_to_bag_paths import Uast2BagOfPaths
+from trees import random_uast
+
+
+class FromBytesTests(unittest.TestCase):
+    def assertSameTree(self, uast: bblfsh.Node):
+        expected = FlatTree.from_uast(uast)
+        tree = FlatTree.from_bytes(uast.SerializeToString())
+        self.assertEqual(len(tree), len(expected))
+        for name in ("parents", "depth", "leaves"):
+            np.testing.assert_array_equal(getattr(tree, name), getattr(expected, name), name)
+        np.testing.assert_array_equal(tree.log_parents, expected.log_parents)
+        for i, node in enumerate(expected.nodes):
+            self.assertEqual(tree.types[tree.type_ids[i]], node.internal_type)
+            self.assertEqual(tree.tokens[i], node.token)
+            self.assertEqual(tree.nodes[i].roles, list(node.roles))
+        return tree, expected
+
+    def test_random_trees(self):
+        for seed in range(40):
+            self.assertSameTree(random_uast(seed, n_nodes=5 + 10 * seed))
+
+    def test_single_node(self):
+        tree, _ = self.assertSameTree(bblfsh.Node())
+        self.assertEqual(tree.types, [""])
+        self.assertSameTree(bblfsh.Node(internal_type="File", token="x"))
+
+    def test_same_paths(self):
+        extractors = (node_to_internal_type, node_to_roles)
+        for seed in range(10):
+            uast = random_uast(seed)
+            expected = FlatTree.from_uast(uast)
+            tree = FlatTree.from_bytes(uast.SerializeToString())
+            self.assertEqual(
+                to_path_contexts_multi(tree, get_pairs(tree, 6, 6), extractors),
+                to_path_contexts_multi(expected, get_pairs(expected, 6, 6), extractors))
+
+    def test_bag(self):
+        extractor = Uast2BagOfPaths(5, 5, hashed=True, path_tokens=("internal_type", "roles"))
+        for seed in range(5):
+            uast = random_uast(seed)
+            self.assertEqual(extractor(uast.SerializeToString()), extractor(uast))
+
+    def test_truncated(self):
+        data = random_uast(0).SerializeToString()
+        with self.assertRaises((ValueError, IndexError)):
+            FlatTree.from_bytes(data[:len(data) // 2])
+        self.assertEqual(Uast2BagOfPaths(5, 5)(data[:len(data) // 2]), {})
+
+    def test_invalid_utf8(self):
+        uast = bblfsh.Node(internal_type="File")
+        for token in ("a", "XX", "b"):
+            uast.children.add(internal_type="Name", token=token)
+        data = uast.SerializeToString()
+        self.assertEqual(data.count(b"XX"), 1)
+        data = data.replace(b"XX", b"\xff\xfe")
+        with self.assertRaises(ValueError):
+            FlatTree.from_bytes(data)
+        # the UAST is skipped like those which bblfsh.Node.FromString() rejects
+        self.assertEqual(Uast2BagOfPaths(5, 5)(data), {})
+
+    def test_deadline(self):
+        uast = random_uast(0)
+        deadline = time.perf_counter() - 1
+        with self.assertRaises(TimeoutError):
+            FlatTree.from_uast(uast, deadline)
+        with self.assertRaises(TimeoutError):
+            FlatTree.from_bytes(uast.SerializeToString(), deadline, check_every=1)
+        future = time.perf_counter() + 3600
+        self.assertEqual(len(FlatTree.from_bytes(uast.SerializeToString(), future, 1)),
+                         len(FlatTree.from_uast(uast, future, 1)))
+
+    def test_max_leaves(self):
+        for seed in range(5):
+            uast = random_uast(seed)
+            full = FlatTree.from_uast(uast)
+            for max_leaves in (1, 7, len(full.leaves), len(full.leaves) + 1):
+                for tree in (FlatTree.from_uast(uast, max_leaves=max_leaves),
+                             FlatTree.from_bytes(uast.SerializeToString(),
+                                                 max_leaves=max_leaves)):
+                    # the nodes up to the last kept leaf in pre-order
+                    leaves = full.leaves[:max_leaves]
+                    np.testing.assert_array_equal(tree.leaves, leaves)
+                    np.testing.assert_array_equal(tree.parents, full.parents[:leaves[-1] + 1])
+                    self.assertEqual(list(get_pairs(tree, 5, 5)),
+                                     list(get_pairs(full, 5, 5, max_leaves=max_leaves)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from algorithms.uast_to_bag_paths import Uast2BagOfPaths
+from local.extraction import UAST_EXTENSION, blob_id, extract, list_repository_files
+from trees import random_uast
+
+
+class LocalExtractionTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory(prefix="test_local_extraction")
+        self.repository = os.path.join(self.dir.name, "repo")
+        os.makedirs(os.path.join(self.repository, "pkg"))
+        self.uasts = {"a.py": random_uast(0, 40), os.path.join("pkg", "b.py"): random_uast(1, 40)}
+        for path, uast in self.uasts.items():
+            with open(os.path.join(self.repository, path + UAST_EXTENSION), "wb") as f:
+                f.write(uast.SerializeToString())
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_list_repository_files(self):
+        single = os.path.join(self.repository, "a.py" + UAST_EXTENSION)
+        self.assertEqual(list_repository_files([self.repository + os.sep, single]), [
+            (self.repository, "a.py" + UAST_EXTENSION),
+            (self.repository, "a.py" + UAST_EXTENSION),
+            (self.repository, os.path.join("pkg", "b.py" + UAST_EXTENSION))])
+
+    def test_blob_id(self):
+        try:
+            expected = subprocess.run(["git", "hash-object", "--stdin"], input=b"x = 1\n",
+                                      stdout=subprocess.PIPE, check=True).stdout.decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            self.skipTest("git is not available")
+        self.assertEqual(blob_id(b"x = 1\n"), expected)
+
+    def test_document_names(self):
+        results = list(extract(list_repository_files([self.repository]), 4, 3, mode="file",
+                               processes=1))
+        self.assertEqual(len(results), 2)
+        uast2paths = Uast2BagOfPaths(4, 3)
+        for (full_path, docs, metrics), path in zip(results, sorted(self.uasts)):
+            self.assertEqual(full_path, os.path.join(self.repository, path + UAST_EXTENSION))
+            self.assertEqual(metrics.counters["source.files"], 1)
+            data = self.uasts[path].SerializeToString()
+            # the same name as UastRow2Document: repository//path@blob
+            self.assertEqual(docs, [("%s//%s@%s" % (self.repository, path, blob_id(data)),
+                                     docs[0][1])])
+            self.assertEqual(sorted(docs[0][1]),
+                             sorted(set(uast2paths.extract(self.uasts[path]))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+from local.vocabulary import LocalVocabulary
+from transformers.vocabulary2id import OOV
+
+# values: a 6, b 4, c 3, d 3, e 2; paths: p 4, q 4, r 1
+DOCS = {
+    "d1": [("a", ("p",), "b"), ("a", ("q",), "c"), ("d", ("r",), "e")],
+    "d2": [("a", ("p",), "c"), ("b", ("q",), "d"), ("b", ("q",), "e")],
+    "d3": [("a", ("p",), "b"), ("c", ("q",), "d")],
+    "d4": [("a", ("p",), "a")],
+}
+
+
+def vocabulary() -> LocalVocabulary:
+    result = LocalVocabulary()
+    for doc, contexts in DOCS.items():
+        result.add(doc, contexts)
+    return result
+
+
+def resolve(model) -> dict:
+    values, paths = model.index2value, model.index2path
+    return {doc: sorted((values[u], paths[p], values[v]) for u, p, v in contexts)
+            for doc, contexts in model.path_contexts}
+
+
+class LocalVocabularyTests(unittest.TestCase):
+    def test_no_pruning(self):
+        model = vocabulary().build()
+        self.assertEqual(model.value2freq, {"a": 6, "b": 4, "c": 3, "d": 3, "e": 2})
+        self.assertEqual(model.path2freq, {("p",): 4, ("q",): 4, ("r",): 1})
+        self.assertEqual(resolve(model), {doc: sorted(contexts)
+                                          for doc, contexts in DOCS.items()})
+
+    def test_min_count(self):
+        model = vocabulary().build(min_count=3)
+        self.assertEqual(model.value2freq, {"a": 6, "b": 4, "c": 3, "d": 3, OOV: 2})
+        self.assertEqual(model.path2freq, {("p",): 4, ("q",): 4, (OOV,): 1})
+        self.assertEqual(resolve(model)["d1"], sorted([("a", ("p",), "b"), ("a", ("q",), "c"),
+                                                       ("d", (OOV,), OOV)]))
+
+    def test_ties(self):
+        # c and d have the same frequency at the cutoff, the one seen first is kept
+        model = vocabulary().build(max_vocab_size=3)
+        self.assertEqual(model.value2freq, {"a": 6, "b": 4, "c": 3, OOV: 5})
+        self.assertEqual(model.path2freq, {("p",): 4, ("q",): 4, ("r",): 1})
+        self.assertEqual(model.value2index[OOV], 3)
+        model = vocabulary().build(max_vocab_size=1)
+        self.assertEqual(model.value2freq, {"a": 6, OOV: 12})
+        self.assertEqual(model.path2freq, {("p",): 4, (OOV,): 5})
+
+    def test_oov_collapse(self):
+        # (b, q, d) and (b, q, e) both become (b, q, OOV), which is kept once
+        model = vocabulary().build(max_vocab_size=3)
+        contexts = resolve(model)
+        self.assertEqual(contexts["d2"], sorted([("a", ("p",), "c"), ("b", ("q",), OOV)]))
+        self.assertEqual(contexts["d3"], sorted([("a", ("p",), "b"), ("c", ("q",), OOV)]))
+        self.assertEqual(sum(map(len, contexts.values())), 8)
+        # the frequencies still count every occurrence before the collapse
+        self.assertEqual(sum(model.value2freq.values()), 18)
+
+    def test_drop_oov(self):
+        model = vocabulary().build(min_count=4, drop_oov=True)
+        self.assertEqual(model.value2freq, {"a": 6, "b": 4})
+        self.assertEqual(model.path2freq, {("p",): 4, ("q",): 4})
+        self.assertNotIn(OOV, model.value2index)
+        self.assertNotIn((OOV,), model.path2index)
+        # d2 only has contexts with pruned values
+        self.assertEqual(resolve(model), {"d1": [("a", ("p",), "b")], "d3": [("a", ("p",), "b")],
+                                          "d4": [("a", ("p",), "a")]})
+
+    def test_empty(self):
+        result = LocalVocabulary()
+        result.add("d", [])
+        model = result.build(min_count=2, max_vocab_size=1)
+        self.assertEqual(model.value2freq, {})
+        self.assertEqual(list(model.path_contexts), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import threading
+import time
+import unittest
+
+from serving.server import LatencyStats, MicroBatcher
+
+
+class Recorder(object):
+    """
+    Batch function which records its batches, the first call can be held until release() so
+    that the next items queue up.
+    """
+
+    def __init__(self, hold: bool=False):
+        self.batches = []
+        self.started = threading.Event()
+        self._released = threading.Event()
+        if not hold:
+            self._released.set()
+
+    def release(self):
+        self._released.set()
+
+    def __call__(self, items: list) -> list:
+        self.started.set()
+        self._released.wait(10)
+        self.batches.append(list(items))
+        return [item * 10 for item in items]
+
+
+class MicroBatcherTests(unittest.TestCase):
+    def test_max_batch(self):
+        func = Recorder(hold=True)
+        batcher = MicroBatcher(func, max_batch=4, max_delay=0.01)
+        try:
+            first = batcher.submit(0)
+            self.assertTrue(func.started.wait(10))
+            futures = [batcher.submit(i) for i in range(1, 11)]
+            func.release()
+            self.assertEqual(first.result(10), 0)
+            self.assertEqual([future.result(10) for future in futures],
+                             [i * 10 for i in range(1, 11)])
+        finally:
+            batcher.close()
+        # the items which queued up while the first batch ran are cut into full batches
+        self.assertEqual(func.batches, [[0], [1, 2, 3, 4], [5, 6, 7, 8], [9, 10]])
+        counters = batcher.counters()
+        self.assertEqual(counters["batch.batches"], 4)
+        self.assertEqual(counters["batch.items"], 11)
+
+    def test_max_delay(self):
+        func = Recorder()
+        batcher = MicroBatcher(func, max_batch=32, max_delay=0.05)
+        try:
+            start = time.perf_counter()
+            self.assertEqual(batcher.submit(1).result(10), 10)
+            elapsed = time.perf_counter() - start
+        finally:
+            batcher.close()
+        # an isolated item waits for max_delay, not for a full batch
+        self.assertGreaterEqual(elapsed, 0.04)
+        self.assertLess(elapsed, 5)
+        self.assertEqual(func.batches, [[1]])
+
+    def test_delay_groups_items(self):
+        func = Recorder()
+        batcher = MicroBatcher(func, max_batch=32, max_delay=1)
+        try:
+            futures = [batcher.submit(i) for i in range(5)]
+            # the batch closes after max_delay or once it is full
+            self.assertEqual([future.result(10) for future in futures], [0, 10, 20, 30, 40])
+        finally:
+            batcher.close()
+        self.assertEqual(func.batches, [[0, 1, 2, 3, 4]])
+
+    def test_zero_delay(self):
+        func = Recorder()
+        batcher = MicroBatcher(func, max_batch=8, max_delay=0)
+        try:
+            for i in range(3):
+                self.assertEqual(batcher.submit(i).result(10), i * 10)
+        finally:
+            batcher.close()
+        self.assertEqual(func.batches, [[0], [1], [2]])
+
+    def test_error(self):
+        calls = []
+
+        def func(items):
+            calls.append(items)
+            if len(calls) == 1:
+                raise ValueError("bad batch")
+            return items
+
+        batcher = MicroBatcher(func, max_batch=2, max_delay=1)
+        try:
+            futures = [batcher.submit(i) for i in range(2)]
+            for future in futures:
+                with self.assertRaises(ValueError):
+                    future.result(10)
+            # the worker survives
+            self.assertEqual(batcher.submit(5).result(10), 5)
+        finally:
+            batcher.close()
+
+    def test_close(self):
+        func = Recorder(hold=True)
+        batcher = MicroBatcher(func, max_batch=2, max_delay=10)
+        futures = [batcher.submit(i) for i in range(3)]
+        self.assertTrue(func.started.wait(10))
+        func.release()
+        # the pending items are processed without waiting for max_delay
+        start = time.perf_counter()
+        batcher.close()
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual([future.result(0) for future in futures], [0, 10, 20])
+        with self.assertRaises(RuntimeError):
+            batcher.submit(3)
+
+
+class LatencyStatsTests(unittest.TestCase):
+    def test_summary(self):
+        stats = LatencyStats(window=100)
+        self.assertEqual(stats.summary(), {"requests": 0})
+        for ms in range(1, 201):
+            stats.record(ms / 1000)
+        summary = stats.summary()
+        # only the last 100 latencies are in the percentiles
+        self.assertEqual(summary["requests"], 200)
+        self.assertAlmostEqual(summary["p50_ms"], 150.5)
+        self.assertAlmostEqual(summary["max_ms"], 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
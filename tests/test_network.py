@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+
+from training.network import forward_backward, init_weights, sum_rows
+
+
+def dense_gradients(weights: dict, gradients) -> dict:
+    """
+    :return: dict name -> gradient with the same shape as the weight, the gradients of the rows \
+             of the embeddings are summed
+    """
+    result = {"transform": gradients.transform, "attention": gradients.attention,
+              "label_embeddings": gradients.label_embeddings}
+    for name, rows, grads in (("value_embeddings", gradients.value_rows, gradients.value_grads),
+                              ("path_embeddings", gradients.path_rows, gradients.path_grads)):
+        dense = np.zeros_like(weights[name])
+        rows, grads = sum_rows(rows, grads)
+        dense[rows] = grads
+        result[name] = dense
+    return result
+
+
+class ForwardBackwardTests(unittest.TestCase):
+    def setUp(self):
+        rnd = np.random.RandomState(1)
+        self.weights = {name: weight.astype(np.float64) for name, weight in
+                        init_weights(7, 5, 4, value_dim=3, path_dim=4, code_dim=5).items()}
+        # larger weights than the initialization so that tanh is not linear
+        for weight in self.weights.values():
+            weight *= 3
+        self.contexts = np.stack([rnd.randint(0, 7, (3, 6)), rnd.randint(0, 5, (3, 6)),
+                                  rnd.randint(0, 7, (3, 6))], axis=-1).astype(np.int32)
+        self.mask = np.array([[True] * 6, [True] * 4 + [False] * 2, [True] + [False] * 5])
+        self.labels = np.array([0, 3, 1])
+
+    def loss(self) -> float:
+        return forward_backward(self.weights, self.contexts, self.mask, self.labels, 1)[0]
+
+    def test_finite_differences(self):
+        _, _, gradients = forward_backward(self.weights, self.contexts, self.mask, self.labels, 1)
+        gradients = dense_gradients(self.weights, gradients)
+        eps = 1e-6
+        for name, weight in self.weights.items():
+            numeric = np.zeros_like(weight)
+            for index in np.ndindex(*weight.shape):
+                original = weight[index]
+                weight[index] = original + eps
+                plus = self.loss()
+                weight[index] = original - eps
+                minus = self.loss()
+                weight[index] = original
+                numeric[index] = (plus - minus) / (2 * eps)
+            np.testing.assert_allclose(gradients[name], numeric, rtol=1e-5, atol=1e-7,
+                                       err_msg=name)
+
+    def test_padding(self):
+        _, _, gradients = forward_backward(self.weights, self.contexts, self.mask, self.labels, 1)
+        self.assertEqual(len(gradients.path_rows), self.mask.sum())
+        self.assertEqual(len(gradients.value_rows), 2 * self.mask.sum())
+        # the padded contexts do not change the loss
+        self.contexts[~self.mask] = 0
+        loss = self.loss()
+        self.contexts[~self.mask] = 1
+        self.assertAlmostEqual(self.loss(), loss)
+
+    def test_scale(self):
+        loss, correct, gradients = forward_backward(
+            self.weights, self.contexts, self.mask, self.labels, 1)
+        scaled_loss, scaled_correct, scaled = forward_backward(
+            self.weights, self.contexts, self.mask, self.labels, 0.25)
+        self.assertEqual((scaled_loss, scaled_correct), (loss, correct))
+        for name, grad in gradients._asdict().items():
+            if not name.endswith("_rows"):
+                np.testing.assert_allclose(getattr(scaled, name), grad * 0.25, err_msg=name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import threading
+import time
+import unittest
+
+from utils.bblfsh_stub import serve_stub, stub_uast
+from utils.parsing import ParserPool
+
+CONTENTS = "def f(x):\n    return x + 1\n"
+
+
+class ParserPoolTests(unittest.TestCase):
+    def serve(self, **kwargs) -> str:
+        server, endpoint, self.service = serve_stub(**kwargs)
+        self.addCleanup(server.stop, 0)
+        return endpoint
+
+    def pool(self, endpoint: str, **kwargs) -> ParserPool:
+        pool = ParserPool(endpoint, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_parse(self):
+        pool = self.pool(self.serve(latency=0))
+        result = pool.parse("f.py", CONTENTS.encode(), "python")
+        self.assertEqual(result.uast, stub_uast(CONTENTS).SerializeToString())
+        self.assertIsNone(result.error)
+        self.assertEqual(result.attempts, 1)
+        counters = pool.metrics.counters
+        self.assertEqual(counters["parse.files"], 1)
+        self.assertEqual(counters["parse.bytes"], len(CONTENTS))
+        self.assertEqual(counters["parse.uast_bytes"], len(result.uast))
+        self.assertNotIn("parse.failed", counters)
+
+    def test_retries(self):
+        pool = self.pool(self.serve(latency=0, failures=2), retries=2, backoff=0.01)
+        result = pool.parse("f.py", CONTENTS, "python")
+        self.assertIsNotNone(result.uast)
+        self.assertEqual(result.attempts, 3)
+        self.assertEqual(self.service.requests["f.py"], 3)
+        self.assertEqual(pool.metrics.counters["parse.retries"], 2)
+
+    def test_retries_exhausted(self):
+        pool = self.pool(self.serve(latency=0, failures=3), retries=2, backoff=0.01)
+        start = time.perf_counter()
+        result = pool.parse("f.py", CONTENTS, "python")
+        # the backoff doubles: 0.01 + 0.02
+        self.assertGreaterEqual(time.perf_counter() - start, 0.03)
+        self.assertIsNone(result.uast)
+        self.assertTrue(result.error.startswith("UNAVAILABLE"), result.error)
+        self.assertEqual(result.attempts, 3)
+        self.assertEqual(pool.metrics.counters["parse.failed"], 1)
+
+    def test_error_response(self):
+        pool = self.pool(self.serve(latency=0, unsupported={"cobol"}), retries=2,
+                         backoff=0.01)
+        result = pool.parse("a.cbl", "MOVE A TO B", "cobol")
+        self.assertIsNone(result.uast)
+        self.assertIn("unsupported language cobol", result.error)
+        # the server answered, retrying would not help
+        self.assertEqual(result.attempts, 1)
+        self.assertEqual(self.service.requests["a.cbl"], 1)
+
+    def test_timeout(self):
+        endpoint = self.serve(latency=0, language_latency={"java": 1})
+        pool = self.pool(endpoint, timeouts={"Java": 0.1}, default_timeout=10, retries=2,
+                         backoff=0.01)
+        start = time.perf_counter()
+        result = pool.parse("A.java", "class A {}", "java")
+        self.assertLess(time.perf_counter() - start, 0.9)
+        self.assertIsNone(result.uast)
+        self.assertTrue(result.error.startswith("DEADLINE_EXCEEDED"), result.error)
+        # a file which is too slow to parse is not retried by default
+        self.assertEqual(result.attempts, 1)
+        self.assertEqual(pool.metrics.counters["parse.timeouts"], 1)
+        # the other languages have the default timeout
+        self.assertIsNotNone(pool.parse("f.py", CONTENTS, "python").uast)
+
+        pool = self.pool(endpoint, timeouts={"java": 0.1}, retries=1, backoff=0.01,
+                         retry_timeouts=True)
+        result = pool.parse("B.java", "class B {}", "java")
+        self.assertEqual(result.attempts, 2)
+        self.assertEqual(pool.metrics.counters["parse.timeouts"], 2)
+
+    def test_concurrency(self):
+        pool = self.pool(self.serve(latency=0.2), workers=8)
+        start = time.perf_counter()
+        results = list(pool.parse_all(("f%d.py" % i, CONTENTS, "python") for i in range(16)))
+        elapsed = time.perf_counter() - start
+        self.assertEqual(sorted(item[0] for item, _ in results),
+                         sorted("f%d.py" % i for i in range(16)))
+        self.assertTrue(all(result.uast is not None for _, result in results))
+        # two rounds of 8 concurrent requests instead of 16 in a row
+        self.assertLess(elapsed, 16 * 0.2 / 2)
+        self.assertEqual(pool.metrics.counters["parse.files"], 16)
+        self.assertGreater(pool.metrics.counters["parse.wall_seconds"], 0)
+
+    def test_max_in_flight(self):
+        pool = self.pool(self.serve(latency=0.01), workers=4, max_in_flight=5)
+        pulled = []
+        lock = threading.Lock()
+
+        def items():
+            for i in range(40):
+                with lock:
+                    pulled.append(i)
+                yield i
+
+        consumed = 0
+        for item, result in pool.parse_all(items(), lambda i: ("f%d.py" % i, CONTENTS, None)):
+            self.assertIsNotNone(result.uast)
+            # the slow consumer holds back the reading of the input
+            with lock:
+                self.assertLessEqual(len(pulled) - consumed, 5)
+            consumed += 1
+            time.sleep(0.01)
+        self.assertEqual(consumed, 40)
+        self.assertEqual(sum(self.service.requests.values()), 40)
+
+    def test_early_exit(self):
+        pool = self.pool(self.serve(latency=0.05), workers=2, max_in_flight=4)
+        results = pool.parse_all(("f%d.py" % i, CONTENTS, None) for i in range(100))
+        next(results)
+        results.close()
+        pool.close()
+        # only the requests in flight were sent, the pending ones were cancelled
+        self.assertLessEqual(sum(self.service.requests.values()), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from models.code2vec_features import Code2VecFeatures
+from models.path_context_shards import MANIFEST, VOCABULARY, PathContextShards, shard_name, \
+    write_manifest, write_shard
+
+
+def block(docs: list, sizes: list, start: int=0):
+    """
+    :return: (docs, offsets, contexts) where the contexts are numbered from start
+    """
+    offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    contexts = np.arange(start, start + 3 * offsets[-1], dtype=np.int32).reshape(-1, 3)
+    return docs, offsets, contexts
+
+
+class PathContextShardsTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory(prefix="test_path_context_shards")
+        self.blocks = [block(["a", "b"], [2, 1]), block([], []),
+                       block(["c", "é", "d"], [1, 0, 3], 9)]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, counts: list=None) -> list:
+        # the partitions finish in any order
+        shards = []
+        for index in reversed(range(len(self.blocks))):
+            doc_counts = counts[index] if counts is not None else None
+            shards.append(write_shard(self.dir.name, index, *self.blocks[index], doc_counts))
+        write_manifest(self.dir.name, shards)
+        return shards
+
+    def expected(self) -> list:
+        return [(doc, contexts[offsets[i]:offsets[i + 1]])
+                for docs, offsets, contexts in self.blocks for i, doc in enumerate(docs)]
+
+    def test_manifest(self):
+        shards = self.write()
+        self.assertEqual(shards[0], {"name": shard_name(2), "docs": 3, "contexts": 4})
+        with open(os.path.join(self.dir.name, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest["vocabulary"], VOCABULARY)
+        self.assertEqual([shard["name"] for shard in manifest["shards"]],
+                         ["part-00000", "part-00001", "part-00002"])
+
+    def test_round_trip(self):
+        self.write()
+        for mmap in (True, False):
+            reader = PathContextShards(self.dir.name, mmap=mmap)
+            self.assertEqual(reader.n_shards, 3)
+            self.assertEqual(len(reader), 5)
+            self.assertEqual(reader.n_contexts, 7)
+            for (docs, offsets, contexts), (read_docs, read_offsets, read_contexts) in zip(
+                    self.blocks, reader.shards()):
+                self.assertEqual(read_docs, docs)
+                np.testing.assert_array_equal(read_offsets, offsets)
+                np.testing.assert_array_equal(read_contexts, contexts)
+                self.assertEqual(read_offsets.dtype, np.int64)
+                self.assertEqual(read_contexts.dtype, np.int32)
+                self.assertEqual(read_contexts.shape, (len(contexts), 3))
+                self.assertEqual(isinstance(read_contexts, np.memmap), mmap)
+            read = list(reader)
+            self.assertEqual([doc for doc, _ in read], [doc for doc, _ in self.expected()])
+            for (_, contexts), (_, expected) in zip(read, self.expected()):
+                np.testing.assert_array_equal(contexts, expected)
+
+    def test_doc_counts(self):
+        self.write()
+        # all ones if the documents were not deduplicated
+        self.assertEqual([counts.tolist() for *_, counts in
+                          PathContextShards(self.dir.name).shards(doc_counts=True)],
+                         [[1, 1], [], [1, 1, 1]])
+        counts = [np.array([2, 1]), np.array([], dtype=np.int64), np.array([1, 4, 1])]
+        self.write(counts)
+        reader = PathContextShards(self.dir.name)
+        read = [counts for *_, counts in reader.shards(doc_counts=True)]
+        self.assertEqual([counts.tolist() for counts in read], [[2, 1], [], [1, 4, 1]])
+        self.assertTrue(all(counts.dtype == np.int64 for counts in read))
+        # without doc_counts the blocks are the same as before
+        self.assertEqual(len(reader.shard(0)), 3)
+
+    def test_vocabulary(self):
+        self.write()
+        Code2VecFeatures().construct(
+            value2index={"x": 0, "y": 1}, path2index={("A", "B"): 0}, value2freq={"x": 2, "y": 1},
+            path2freq={("A", "B"): 3}, docs=[], doc_offsets=np.zeros(1, dtype=np.int64),
+            contexts=np.empty((0, 3), dtype=np.int32)).save(
+            os.path.join(self.dir.name, VOCABULARY))
+        vocabulary = PathContextShards(self.dir.name).vocabulary
+        self.assertEqual(vocabulary.index2value, ["x", "y"])
+        self.assertEqual(vocabulary.index2path, [("A", "B")])
+        self.assertEqual(list(vocabulary.path_contexts), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
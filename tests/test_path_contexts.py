@@ -0,0 +1,136 @@
+import time
+import unittest
+from collections import Counter
+
+import bblfsh
+
+from algorithms.path_contexts import DOWN, NOOP_TYPES, UP, get_pairs, get_paths, \
+    node_to_internal_type, node_to_roles, to_path_contexts_multi
+from algorithms.structures.flat_tree import FlatTree
+from algorithms.uast_to_bag_paths import Uast2BagOfPaths
+from trees import random_uast
+
+SIZES = ((5, 5), (3, 2), (8, 12), (12, 40), (1, 3))
+
+
+def reference_paths(uast: bblfsh.Node, max_length: int, max_width: int,
+                    token_extractor=node_to_internal_type) -> list:
+    """
+    Path contexts of the original ExtNode implementation, computed by walking the ancestors:
+    every pair of leaves less than max_width apart, without comments, whose path has at most
+    max_length edges.
+    """
+    # chains of the nodes from the root to every leaf, with the indices of the children taken
+    leaves = []
+    stack = [([uast], ())]
+    while stack:
+        chain, ids = stack.pop()
+        children = chain[-1].children
+        if len(children) == 0:
+            leaves.append((chain, ids))
+        for i in range(len(children) - 1, -1, -1):
+            stack.append((chain + [children[i]], ids + (i,)))
+
+    paths = []
+    for i, (u, u_ids) in enumerate(leaves):
+        for v, v_ids in leaves[i + 1:i + max_width]:
+            if u[-1].internal_type in NOOP_TYPES or v[-1].internal_type in NOOP_TYPES:
+                continue
+            common = 1
+            while common < min(len(u), len(v)) and u_ids[common - 1] == v_ids[common - 1]:
+                common += 1
+            if len(u) + len(v) - 2 * common > max_length:
+                continue
+            path = []
+            for node in reversed(u[common:]):
+                path.extend((token_extractor(node), token_extractor(UP)))
+            path.append(token_extractor(u[common - 1]))
+            for node in v[common:]:
+                path.extend((token_extractor(DOWN), token_extractor(node)))
+            paths.append((u[-1].token, tuple(path), v[-1].token))
+    return paths
+
+
+class GetPathsTests(unittest.TestCase):
+    def test_random_trees(self):
+        for seed in range(60):
+            uast = random_uast(seed, n_nodes=10 + 5 * seed)
+            for max_length, max_width in SIZES:
+                self.assertEqual(get_paths(uast, max_length, max_width),
+                                 reference_paths(uast, max_length, max_width),
+                                 "seed %d, sizes %d %d" % (seed, max_length, max_width))
+
+    def test_small_trees(self):
+        root = bblfsh.Node(internal_type="File")
+        self.assertEqual(get_paths(root, 5, 5), [])
+        root.children.add().token = "a"
+        self.assertEqual(get_paths(root, 5, 5), [])
+        root.children.add().token = "b"
+        self.assertEqual(get_paths(root, 5, 5), [("a", ("", UP, "File", DOWN, ""), "b")])
+        self.assertEqual(get_paths(root, 1, 5), [])
+        self.assertEqual(get_paths(root, 5, 1), [])
+
+    def test_bag(self):
+        for seed in range(10):
+            uast = random_uast(seed)
+            bag = Uast2BagOfPaths(5, 5)(uast)
+            self.assertEqual(bag, {str(context): count for context, count in
+                                   Counter(reference_paths(uast, 5, 5)).items()})
+
+
+class SegmentsTests(unittest.TestCase):
+    def test_several_representations(self):
+        for seed in range(30):
+            uast = random_uast(seed, n_nodes=20 + 10 * seed)
+            tree = FlatTree.from_uast(uast)
+            for max_length, max_width in SIZES:
+                pairs = list(get_pairs(tree, max_length, max_width))
+                types, roles = to_path_contexts_multi(tree, pairs,
+                                                      (node_to_internal_type, node_to_roles))
+                self.assertEqual(types, reference_paths(uast, max_length, max_width))
+                self.assertEqual(roles, reference_paths(uast, max_length, max_width,
+                                                        node_to_roles))
+
+    def test_prefixed_bag(self):
+        uast = random_uast(7)
+        bag = Uast2BagOfPaths(6, 8, path_tokens=("internal_type", "roles"))(uast)
+        contexts = [(u, ("internal_type",) + path, v)
+                    for u, path, v in reference_paths(uast, 6, 8)]
+        contexts += [(u, ("roles",) + path, v)
+                     for u, path, v in reference_paths(uast, 6, 8, node_to_roles)]
+        self.assertEqual(bag, {str(context): count for context, count in
+                               Counter(contexts).items()})
+
+
+class TimeBudgetTests(unittest.TestCase):
+    def test_conversion_deadline(self):
+        tree = FlatTree.from_uast(random_uast(3))
+        pairs = list(get_pairs(tree, 8, 8))
+        types, roles = to_path_contexts_multi(tree, pairs, (node_to_internal_type, node_to_roles),
+                                              deadline=time.perf_counter() - 1, check_every=5)
+        complete = to_path_contexts_multi(tree, pairs, (node_to_internal_type,))[0]
+        self.assertEqual(types, complete[:5])
+        self.assertEqual(len(roles), 5)
+
+    def test_flattening_deadline(self):
+        # the UAST is flattened again up to its max_leaves-th leaf
+        uast = random_uast(3)
+        expected = Uast2BagOfPaths(5, 5, max_leaves=20)(uast)
+        for data in (uast, uast.SerializeToString()):
+            limits = {}
+            bag = Uast2BagOfPaths(5, 5, max_leaves=20, time_budget=-1)(data, limits)
+            self.assertEqual(bag, expected)
+            self.assertEqual(limits, {"max_leaves": True, "max_contexts": False,
+                                      "time_budget": True})
+        self.assertEqual(Uast2BagOfPaths(5, 5, time_budget=-1)(uast), Uast2BagOfPaths(5, 5)(uast))
+
+    def test_no_limits(self):
+        limits = {}
+        uast = random_uast(3)
+        self.assertEqual(Uast2BagOfPaths(5, 5, time_budget=3600)(uast, limits),
+                         Uast2BagOfPaths(5, 5)(uast))
+        self.assertFalse(any(limits.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from pyspark.sql import Row, SparkSession
+from pyspark.sql.types import ArrayType, BinaryType
+from sourced.ml.transformers import Moder, Uast2BagFeatures, UastRow2Document
+
+from algorithms.uast_to_bag_paths import Uast2BagOfPaths
+from extractors.paths import UastPathsBagExtractor
+from transformers.pooled_uast_extractor import PooledUastExtractor
+from utils.bblfsh_stub import serve_stub, stub_uast
+from utils.metrics import metrics_accumulator
+
+CONTENTS = ["def f(x):\n    return x + 1\n", "a = b\nc = d e f\n\ng h\n", "x\n"]
+
+
+class PooledUastExtractorTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.session = SparkSession.builder \
+            .master("local[2]") \
+            .appName("test_pooled_uast_extractor") \
+            .config("spark.ui.enabled", "false") \
+            .getOrCreate()
+        cls.server, cls.endpoint, _ = serve_stub(latency=0, unsupported={"COBOL"})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop(0)
+        cls.session.stop()
+
+    def files(self, lang: bool=True):
+        rows = [Row(repository_id="repo", path="f%d.py" % i, blob_id=str(i),
+                    content=bytearray(content.encode()), lang="Python")
+                for i, content in enumerate(CONTENTS)]
+        rows.append(Row(repository_id="repo", path="a.cbl", blob_id="c",
+                        content=bytearray(b"MOVE A TO B"), lang="COBOL"))
+        files = self.session.createDataFrame(rows)
+        return files if lang else files.drop("lang")
+
+    def test_schema(self):
+        metrics = metrics_accumulator(self.session.sparkContext)
+        files = self.files()
+        uasts = PooledUastExtractor(self.endpoint, metrics, workers=4)(files)
+        self.assertEqual(uasts.columns, files.columns + ["uast"])
+        self.assertEqual(uasts.schema["uast"].dataType, ArrayType(BinaryType()))
+        rows = sorted(uasts.collect(), key=lambda row: row.path)
+        # the COBOL file fails to parse and is dropped
+        self.assertEqual([row.path for row in rows], ["f0.py", "f1.py", "f2.py"])
+        for row, content in zip(rows, CONTENTS):
+            self.assertEqual(len(row.uast), 1)
+            self.assertEqual(bytes(row.uast[0]), stub_uast(content).SerializeToString())
+            self.assertEqual(bytes(row.content), content.encode())
+        counters = metrics.value.counters
+        self.assertEqual(counters["parse.files"], 4)
+        self.assertEqual(counters["parse.failed"], 1)
+
+    def test_pipeline(self):
+        metrics = metrics_accumulator(self.session.sparkContext)
+        for lang in (True, False):
+            uasts = PooledUastExtractor(self.endpoint, metrics, workers=4)(self.files(lang))
+            documents = UastRow2Document()(Moder("file")(uasts))
+            bags = Uast2BagFeatures([UastPathsBagExtractor(4, 3)])(documents).collect()
+            contents = [("repo//f%d.py@%d" % (i, i), content)
+                        for i, content in enumerate(CONTENTS)]
+            if not lang:
+                # Babelfish cannot tell the file is COBOL without its language
+                contents.append(("repo//a.cbl@c", "MOVE A TO B"))
+            expected = []
+            for doc, content in contents:
+                bag = Uast2BagOfPaths(4, 3)(stub_uast(content))
+                expected.extend((("v." + key, doc), value) for key, value in bag.items())
+            self.assertEqual(sorted(bags), sorted(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+import bblfsh
+
+try:
+    from pyspark.sql import Row, SparkSession
+except ImportError:
+    Row = SparkSession = None
+
+from trees import random_uast
+
+if SparkSession is not None:
+    from transformers.uast_deduplicator import UastDeduplicator
+
+
+def moved(uast: bblfsh.Node, line: int) -> bblfsh.Node:
+    """
+    :return: copy of the UAST with the positions of the nodes shifted by line
+    """
+    uast = bblfsh.Node.FromString(uast.SerializeToString())
+    stack = [uast]
+    while stack:
+        node = stack.pop()
+        node.start_position.line += line
+        node.end_position.line += line
+        stack.extend(node.children)
+    return uast
+
+
+@unittest.skipIf(SparkSession is None, "pyspark is not installed")
+class UastDeduplicatorTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.session = SparkSession.builder \
+            .master("local[2]") \
+            .appName("test_uast_deduplicator") \
+            .config("spark.ui.enabled", "false") \
+            .getOrCreate()
+        cls.sc = cls.session.sparkContext
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.stop()
+
+    @staticmethod
+    def row(document: str, *uasts: bblfsh.Node) -> Row:
+        return Row(document=document, uast=[uast.SerializeToString() for uast in uasts])
+
+    def test_fingerprint(self):
+        a, b = random_uast(0, 50), random_uast(1, 50)
+        fingerprint = UastDeduplicator.fingerprint
+        # the positions are ignored, the order and the number of the UASTs are not
+        self.assertEqual(fingerprint(self.row("x", a, b)), fingerprint(self.row("y", a, b)))
+        self.assertEqual(fingerprint(self.row("x", a)), fingerprint(self.row("y", moved(a, 7))))
+        self.assertNotEqual(fingerprint(self.row("x", a)), fingerprint(self.row("x", b)))
+        self.assertNotEqual(fingerprint(self.row("x", a, b)), fingerprint(self.row("x", b, a)))
+        self.assertNotEqual(fingerprint(self.row("x", a)), fingerprint(self.row("x", a, a)))
+        self.assertEqual(fingerprint(Row(document="x", uast=None)),
+                         fingerprint(self.row("y")))
+
+    def test_doc_counts(self):
+        a, b, c = random_uast(0, 50), random_uast(1, 50), random_uast(2, 50)
+        rows = [self.row("repo//e.py@4", a), self.row("repo//b.py@2", moved(a, 3)),
+                self.row("repo//c.py@3", b), self.row("repo//a.py@1", moved(b, 1)),
+                self.row("repo//d.py@5", moved(a, 10)), self.row("repo//f.py@6", c),
+                # the same name twice, like the same file in two references of a repository
+                self.row("repo//g.py@7", a, c), self.row("repo//g.py@7", a, c)]
+        deduplicator = UastDeduplicator()
+        unique = deduplicator(self.sc.parallelize(rows, 3)).collect()
+        try:
+            # the representative of every group has the smallest name
+            self.assertEqual(sorted(row.document for row in unique),
+                             ["repo//a.py@1", "repo//b.py@2", "repo//f.py@6", "repo//g.py@7"])
+            self.assertEqual(sorted(deduplicator.doc_counts.collect()),
+                             [("repo//a.py@1", 2), ("repo//b.py@2", 3), ("repo//f.py@6", 1),
+                              ("repo//g.py@7", 2)])
+        finally:
+            deduplicator.unpersist()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from algorithms.vector_search import normalize
+from models.vector_index import VectorIndex, write_index
+
+
+def clustered(n: int, dim: int=16, n_clusters: int=40, seed: int=0) -> np.ndarray:
+    """
+    :return: vectors scattered around random centers, like code vectors of similar functions
+    """
+    rnd = np.random.RandomState(seed)
+    centers = rnd.normal(size=(n_clusters, dim))
+    return centers[rnd.randint(n_clusters, size=n)] + rnd.normal(size=(n, dim))
+
+
+def recall(found: np.ndarray, expected: np.ndarray) -> float:
+    """
+    :return: average share of the true nearest neighbours which were found
+    """
+    return np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, expected)])
+
+
+class VectorIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory(prefix="test_vector_index")
+        self.vectors = clustered(3000)
+        self.names = ["f%d" % i for i in range(len(self.vectors))]
+        self.queries = self.vectors[:100] + 0.2 * np.random.RandomState(1).normal(
+            size=(100, self.vectors.shape[1]))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def brute_force(self, k: int):
+        scores = normalize(self.queries) @ normalize(self.vectors).T
+        return np.argsort(-scores, axis=1, kind="stable")[:, :k], -np.sort(-scores, axis=1)[:, :k]
+
+    def test_exact(self):
+        manifest = write_index(self.dir.name, self.vectors, self.names, n_lists=0)
+        self.assertEqual(manifest, {"size": 3000, "dim": 16, "lists": 0})
+        index = VectorIndex(self.dir.name)
+        rows, scores = index.search(self.queries, k=10)
+        expected_rows, expected_scores = self.brute_force(10)
+        self.assertEqual(recall(rows, expected_rows), 1)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5, atol=1e-5)
+        self.assertTrue((np.diff(scores, axis=1) <= 0).all())
+
+    def test_ivf_recall(self):
+        write_index(self.dir.name, self.vectors, self.names, n_lists=32, meta={"kind": "code"})
+        index = VectorIndex(self.dir.name)
+        self.assertEqual(index.manifest["kind"], "code")
+        expected = self.brute_force(10)[0]
+        recalls = {n_probe: recall(index.search(self.queries, 10, n_probe)[0], expected)
+                   for n_probe in (1, 4, 8, 32)}
+        self.assertGreaterEqual(recalls[8], 0.95, recalls)
+        # more probes find more neighbours
+        self.assertLess(recalls[1], recalls[4])
+        self.assertLess(recalls[4], recalls[8])
+        # probing every list is an exact search
+        self.assertEqual(recalls[32], 1, recalls)
+        rows, scores = index.search(self.queries, 10, 8)
+        exact_scores = index.exact_search(self.queries, 10)[1]
+        # the candidates are a subset of the vectors: their scores cannot be higher
+        self.assertTrue((scores <= exact_scores + 1e-6).all())
+
+    def test_rows(self):
+        write_index(self.dir.name, self.vectors, self.names, n_lists=16)
+        for mmap in (True, False):
+            index = VectorIndex(self.dir.name, mmap=mmap)
+            self.assertEqual(len(index), 3000)
+            self.assertEqual(index.dim, 16)
+            self.assertEqual(index.names, self.names)
+            # the vectors are stored by list, the rows are in the original order
+            for row in (0, 17, 2999):
+                np.testing.assert_allclose(index.vector(row), normalize(self.vectors[row]),
+                                           rtol=1e-6)
+                rows, scores = index.search(self.vectors[row], k=1, n_probe=4)
+                self.assertEqual(rows.tolist(), [[row]])
+                self.assertAlmostEqual(float(scores[0, 0]), 1, places=5)
+
+    def test_padding(self):
+        write_index(self.dir.name, self.vectors[:5], self.names[:5], n_lists=0)
+        rows, scores = VectorIndex(self.dir.name).search(self.queries[:2], k=8)
+        self.assertEqual(rows.shape, (2, 8))
+        self.assertEqual(sorted(rows[0, :5].tolist()), list(range(5)))
+        self.assertEqual(rows[:, 5:].tolist(), [[-1] * 3] * 2)
+        self.assertTrue(np.isneginf(scores[:, 5:]).all())
+
+    def test_names_mismatch(self):
+        with self.assertRaises(ValueError):
+            write_index(self.dir.name, self.vectors, self.names[1:])
+
+
+if __name__ == "__main__":
+    unittest.main()
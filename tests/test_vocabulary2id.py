@@ -0,0 +1,156 @@
+import os
+import tempfile
+import unittest
+from ast import literal_eval
+from collections import Counter
+
+try:
+    from pyspark.sql import SparkSession
+except ImportError:
+    SparkSession = None
+
+from extractors.paths import UastPathsBagExtractor
+from local.vocabulary import LocalVocabulary
+from models.code2vec_features import Code2VecFeatures
+from trees import random_uast
+
+if SparkSession is not None:
+    from transformers.vocabulary2id import OOV, Vocabulary2Id
+
+
+def bag_rows(hashed: bool, n_docs: int=6) -> list:
+    """
+    :return: ((key, doc), value) rows like Uast2BagFeatures with UastPathsBagExtractor, some \
+             documents have the same UAST so that some paths are frequent
+    """
+    extractor = UastPathsBagExtractor(4, 3, hashed=hashed)
+    return [((key, "repo//f%d.py@%d" % (i, i)), value) for i in range(n_docs)
+            for key, value in extractor.extract(random_uast(i % 4, 80))]
+
+
+def resolve(model: Code2VecFeatures) -> dict:
+    """
+    :return: dict doc -> sorted path contexts with the texts of their values and paths
+    """
+    values, paths = model.index2value, model.index2path
+    return {doc: sorted((values[u], paths[p], values[v]) for u, p, v in contexts)
+            for doc, contexts in model.path_contexts}
+
+
+@unittest.skipIf(SparkSession is None, "pyspark is not installed")
+class Vocabulary2IdTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.session = SparkSession.builder \
+            .master("local[2]") \
+            .appName("test_vocabulary2id") \
+            .config("spark.ui.enabled", "false") \
+            .getOrCreate()
+        cls.sc = cls.session.sparkContext
+        cls.contexts = {}
+        for (key, doc), _ in bag_rows(False):
+            cls.contexts.setdefault(doc, []).append(literal_eval(key[2:]))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.stop()
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory(prefix="test_vocabulary2id")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def run_vocabulary(self, hashed: bool=False, rows=None, **kwargs) -> Code2VecFeatures:
+        output = os.path.join(self.dir.name, "features.asdf")
+        if rows is None:
+            rows = self.sc.parallelize(bag_rows(hashed), 3)
+        Vocabulary2Id(self.sc, output, hashed, **kwargs)(rows)
+        return Code2VecFeatures().load(output)
+
+    def frequencies(self):
+        values, paths = Counter(), Counter()
+        for contexts in self.contexts.values():
+            for u, path, v in contexts:
+                values.update((u, v))
+                paths[path] += 1
+        return values, paths
+
+    def test_text(self):
+        model = self.run_vocabulary()
+        self.assertEqual(resolve(model), {doc: sorted(contexts)
+                                          for doc, contexts in self.contexts.items()})
+        values, paths = self.frequencies()
+        self.assertEqual(model.value2freq, dict(values))
+        self.assertEqual(model.path2freq, dict(paths))
+        self.assertEqual(sorted(model.value2index.values()), list(range(len(values))))
+        self.assertEqual(sorted(model.path2index.values()), list(range(len(paths))))
+
+    def test_hashed(self):
+        text, hashed = self.run_vocabulary(), self.run_vocabulary(hashed=True)
+        self.assertEqual(resolve(hashed), resolve(text))
+        self.assertEqual(hashed.value2freq, text.value2freq)
+        self.assertEqual(hashed.path2freq, text.path2freq)
+
+    def test_oov(self):
+        values, paths = self.frequencies()
+        for hashed in (False, True):
+            model = self.run_vocabulary(hashed, min_count=2, max_vocab_size=10)
+            kept_values = {value for value in model.value2freq if value != OOV}
+            kept_paths = {path for path in model.path2freq if path != (OOV,)}
+            self.assertLessEqual(len(kept_values), 10)
+            self.assertLessEqual(len(kept_paths), 10)
+            for kept, freqs, model_freqs, oov in (
+                    (kept_values, values, model.value2freq, OOV),
+                    (kept_paths, paths, model.path2freq, (OOV,))):
+                self.assertTrue(all(freqs[key] >= 2 for key in kept))
+                # the most frequent ones are kept
+                self.assertGreaterEqual(min(freqs[key] for key in kept),
+                                        max(freq for key, freq in freqs.items()
+                                            if key not in kept))
+                self.assertEqual(model_freqs[oov],
+                                 sum(freq for key, freq in freqs.items() if key not in kept))
+            expected = {}
+            for doc, contexts in self.contexts.items():
+                resolved = {(u if u in kept_values else OOV,
+                             path if path in kept_paths else (OOV,),
+                             v if v in kept_values else OOV) for u, path, v in contexts}
+                expected[doc] = sorted(resolved)
+            self.assertEqual(resolve(model), expected)
+
+    def test_drop_oov(self):
+        model = self.run_vocabulary(min_count=2, max_vocab_size=10, drop_oov=True)
+        self.assertNotIn(OOV, model.value2index)
+        self.assertNotIn((OOV,), model.path2index)
+        kept_values, kept_paths = set(model.value2index), set(model.path2index)
+        expected = {}
+        for doc, contexts in self.contexts.items():
+            kept = sorted(context for context in contexts if context[0] in kept_values and
+                          context[1] in kept_paths and context[2] in kept_values)
+            if kept:
+                expected[doc] = kept
+        self.assertEqual(resolve(model), expected)
+
+    def test_local_vocabulary(self):
+        # distinct frequencies, otherwise the elements at the cutoff of max_vocab_size which
+        # have the same frequency are not picked in the same order
+        contexts = {"repo//f%d.py@%d" % (i, i): [("v%d" % j, ("p%d" % j, "UP"), "w%d" % (j % 3))
+                                                 for j in range(i + 1)]
+                    for i in range(8)}
+        rows = self.sc.parallelize([(("v." + str(context), doc), 1)
+                                    for doc, doc_contexts in contexts.items()
+                                    for context in doc_contexts], 3)
+        local = LocalVocabulary()
+        for doc, doc_contexts in contexts.items():
+            local.add(doc, doc_contexts)
+        for kwargs in ({}, {"min_count": 3}, {"max_vocab_size": 4},
+                       {"min_count": 3, "max_vocab_size": 4, "drop_oov": True}):
+            model = self.run_vocabulary(rows=rows, **kwargs)
+            expected = local.build(**kwargs)
+            self.assertEqual(model.value2freq, expected.value2freq, kwargs)
+            self.assertEqual(model.path2freq, expected.path2freq, kwargs)
+            self.assertEqual(resolve(model), resolve(expected), kwargs)
+
+
+if __name__ == "__main__":
+    unittest.main()
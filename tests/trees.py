@@ -0,0 +1,33 @@
+"""
+Random UASTs shared by the tests.
+"""
+import random
+
+import bblfsh
+
+TYPES = ("Module", "FunctionDef", "Call", "Name", "Num", "Str", "BinOp", "NoopLine",
+         "SameLineNoops")
+
+
+def random_uast(seed: int, n_nodes: int=200, max_roles: int=3) -> bblfsh.Node:
+    """
+    Builds a random UAST by attaching every new node to a random node, or to the last one to
+    get deep chains too. Some leaves are comments (NoopLine, SameLineNoops), some tokens are not
+    ASCII and some roles take several bytes when serialized.
+    :param seed: seed of the random generator, the same arguments build the same tree
+    :param n_nodes: number of nodes besides the root
+    :param max_roles: maximum number of roles of a node
+    :return: root of the tree
+    """
+    rnd = random.Random(seed)
+    root = bblfsh.Node(internal_type="File")
+    nodes = [root]
+    for i in range(n_nodes):
+        parent = nodes[-1] if rnd.random() < 0.3 else rnd.choice(nodes)
+        node = parent.children.add()
+        node.internal_type = rnd.choice(TYPES)
+        node.token = rnd.choice(("x%d" % i, "", "é%d" % i, "名"))
+        node.roles.extend(rnd.choice((1, 2, 18, 127, 128, 300))
+                          for _ in range(rnd.randrange(max_roles + 1)))
+        nodes.append(node)
+    return root